@@ -1,11 +1,18 @@
+import twitter
 
 
 class TwitterCache(object):
-    def __init__(self, t):
+    def __init__(self, t, read_ahead=1, checkpoint_store=None):
         """
         @param t Twitter API instance.
+        @param read_ahead Number of pages to prefetch while paging.
+        @param checkpoint_store Directory or cache backend in which paged
+            crawls save their progress, so an interrupted crawl resumes
+            where it stopped.  None disables checkpoints.
         """
         self._twitter = t
+        self._read_ahead = read_ahead
+        self._checkpoint_store = checkpoint_store
         pass
 
         #self.MAX_GETFOLLOWERS_AGE = 60 * 60
@@ -25,12 +32,7 @@ class TwitterCache(object):
         #    pass
         #if update:
         if 1 == 1:
-            self._twitter.next_cursor = -1
-            data = []
-            while self._twitter.next_cursor != 0:
-                _followers = self._twitter.getFollowerIDs(self._twitter.next_cursor, **kw)
-                for f in _followers:
-                    data.append(f)
+            data = self._crawl(self._twitter.iterFollowerIDs, 'getFollowerIDs', None, (), kw)
             #_followers = self._twitter.getFollowerIDs(**kw)
         #    with open('cache/getFollowerIDs/%s.pickle' % self._twitter._consumer_key, 'wb') as fh:
         #        pickle.dump((data, time()), fh)
@@ -49,12 +51,7 @@ class TwitterCache(object):
         #    pass
         #if update:
         if 1 == 1:
-            self._twitter.next_cursor = -1
-            data = []
-            while self._twitter.next_cursor != 0:
-                _followers = self._twitter.getFollowers(self._twitter.next_cursor, **kw)
-                for f in _followers:
-                    data.append(f)
+            data = self._crawl(self._twitter.iterFollowers, 'getFollowers', twitter.User.newFromJsonDict, (), kw)
         #    with open('cache/getFollowers/%s.pickle' % self._twitter._consumer_key, 'wb') as fh:
         #        pickle.dump((data, time()), fh)
         return data
@@ -72,12 +69,7 @@ class TwitterCache(object):
         #    pass
         #if update:
         if 1 == 1:
-            self._twitter.next_cursor = -1
-            data = []
-            while self._twitter.next_cursor != 0:
-                _friends = self._twitter.getFriends(name, self._twitter.next_cursor, **kw)
-                for f in _friends:
-                    data.append(f)
+            data = self._crawl(self._twitter.iterFriends, 'getFriends', twitter.User.newFromJsonDict, (name,), kw)
         #    with open('cache/getFriends/%s.pickle' % name, 'wb') as fh:
         #        pickle.dump((data, time()), fh)
         return data
@@ -100,3 +92,27 @@ class TwitterCache(object):
         #        pickle.dump((user, time()), fh)
         return user
 
+    def _crawl(self, iterate, method, factory, args, kw):
+        """
+        Collect every item of a paged crawl into a list, resuming from and
+        saving to a checkpoint when a checkpoint store is configured.
+
+        @param iterate The Api iterator to page with, e.g. iterFollowers.
+        @param method Name used, with the account and user, for the checkpoint.
+        @param factory Turns a checkpointed item back into a model, or None.
+        """
+        if self._checkpoint_store is None:
+            return list(iterate(read_ahead=self._read_ahead, *args, **kw))
+        user = kw.get('screen_name') or kw.get('user_id') or (args and args[0]) or ''
+        # Several accounts may share one consumer key, and each sees its own
+        # friends and followers, so key on the account's access token.
+        account = self._twitter._access_token_key or ''
+        checkpoint = twitter.PagingCheckpoint(
+            '%s/%s/%s' % (method, account, user),
+            self._checkpoint_store, keep_items=True)
+        checkpoint.load()
+        data = list(checkpoint.getItems())
+        if factory is not None:
+            data = [factory(x) for x in data]
+        data.extend(iterate(read_ahead=self._read_ahead, checkpoint=checkpoint, *args, **kw))
+        return data
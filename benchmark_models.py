@@ -0,0 +1,102 @@
+#!/usr/bin/python2.4
+#
+# Copyright 2007 The Python-Twitter Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Measure the memory taken by twitter.Status and twitter.User instances.
+
+Prints the size of one instance, including its __dict__ if it has one,
+and the growth in peak resident memory per Status and User pair while
+building many of them from a timeline-style status.  Run it against two
+revisions of twitter.py to compare them:
+
+    python benchmark_models.py [count]
+'''
+
+import resource
+import sys
+
+import twitter
+
+STATUS = {
+    'id': 26767436224,
+    'text': 'A status of ordinary length, about as long as most of them are.',
+    'created_at': 'Fri Jan 07 18:01:37 +0000 2011',
+    'source': '<a href="http://twitter.com/" rel="nofollow">Twitter for iPhone</a>',
+    'truncated': False,
+    'favorited': False,
+    'retweeted': False,
+    'in_reply_to_status_id': None,
+    'in_reply_to_user_id': None,
+    'in_reply_to_screen_name': None,
+    'geo': None,
+    'place': None,
+    'coordinates': None,
+    'contributors': None,
+    'user': {
+        'id': 6253282,
+        'name': 'Twitter API',
+        'screen_name': 'twitterapi',
+        'location': 'San Francisco, CA',
+        'description': 'The Real Twitter API.',
+        'url': 'http://dev.twitter.com',
+        'protected': False,
+        'followers_count': 1000000,
+        'friends_count': 30,
+        'statuses_count': 3000,
+        'favourites_count': 20,
+        'created_at': 'Wed May 23 06:01:13 +0000 2007',
+        'utc_offset': -28800,
+        'time_zone': 'Pacific Time (US & Canada)',
+        'profile_image_url': 'http://a0.twimg.com/profile_images/1/normal.png',
+        'profile_background_tile': False,
+        'profile_background_color': 'c1dfee',
+        'profile_text_color': '333333',
+        'profile_link_color': '0084b4',
+        'profile_sidebar_fill_color': 'ddeef6',
+        'geo_enabled': True,
+        'verified': True,
+        'lang': 'en',
+    },
+}
+
+def getInstanceSize(instance):
+    '''The size of instance in bytes, with its __dict__ if it has one.'''
+    size = sys.getsizeof(instance)
+    if hasattr(instance, '__dict__'):
+        size += sys.getsizeof(instance.__dict__)
+    return size
+
+def getPeakGrowthPerPair(count):
+    '''The growth in peak resident memory, in bytes, per Status built.'''
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    statuses = [twitter.Status.newFromJsonDict(STATUS) for i in xrange(count)]
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux.
+    return (after - before) * 1024.0 / len(statuses)
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 200000
+    status = twitter.Status.newFromJsonDict(STATUS)
+    print 'Status: %d bytes' % getInstanceSize(status)
+    print 'User: %d bytes' % getInstanceSize(status.user)
+    print 'Peak RSS growth: %d bytes per Status and User pair (%d pairs)' % (
+        getPeakGrowthPerPair(count), count)
+
+if __name__ == '__main__':
+    main()
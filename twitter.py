@@ -43,10 +43,18 @@ import calendar
 import urllib
 import urllib2
 import socket
+import stat
 import urlparse
 import gzip
+import zlib
 import StringIO
 import re
+import select
+import collections
+import itertools
+import threading
+import Queue
+import warnings
 
 # Tor!
 #import socks
@@ -86,6 +94,12 @@ try:
 except ImportError:
   from md5 import md5
 
+try:
+  import sqlite3
+except ImportError:
+  # Only needed by SqliteCache.
+  sqlite3 = None
+
 import oauth2 as oauth
 
 
@@ -95,9 +109,25 @@ socket.setdefaulttimeout(SOCKET_TIMEOUT)
 
 CHARACTER_LIMIT = 140
 
-# A singleton representing a lazily instantiated FileCache.
+# A singleton representing a lazily instantiated FileCache behind an LRUCache.
 DEFAULT_CACHE = object()
 
+# A singleton representing a lazily instantiated per-Api ConnectionPool.
+DEFAULT_CONNECTION_POOL = object()
+
+# A singleton representing the lazily instantiated process-wide ConnectionPool.
+SHARED_CONNECTION_POOL = object()
+
+# A singleton representing a lazily instantiated per-Api RateLimiter.
+DEFAULT_RATE_LIMITER = object()
+
+# Request priority classes, most urgent first.  A RateLimiter serves waiting
+# requests in this order and holds part of the budget back from the later
+# classes.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
 REQUEST_TOKEN_URL = 'https://api.twitter.com/oauth/request_token'
 ACCESS_TOKEN_URL  = 'https://api.twitter.com/oauth/access_token'
 AUTHORIZATION_URL = 'https://api.twitter.com/oauth/authorize'
@@ -113,7 +143,29 @@ class TwitterError(Exception):
         return self.args[0]
 
 
-class Status(object):
+class _SlottedModel(object):
+    '''
+    Base class for models that keep their attributes in __slots__ rather
+    than a per-instance __dict__, which cuts their memory use several-fold.
+    Pickling is kept working with every protocol, including the pickles
+    made before the models had slots.
+    '''
+
+    __slots__ = ()
+
+    def __getstate__(self):
+        state = {}
+        for name in self.__slots__:
+            if hasattr(self, name):
+                state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Status(_SlottedModel):
     '''A class representing the Status structure used by the twitter API.
 
     The Status structure exposes the following properties:
@@ -141,6 +193,31 @@ class Status(object):
         status.retweeted
         status.retweeted_status
     '''
+    __slots__ = (
+        '_contributors',
+        '_coordinates',
+        '_created_at',
+        '_favorited',
+        '_geo',
+        '_hashtags',
+        '_id',
+        '_in_reply_to_screen_name',
+        '_in_reply_to_status_id',
+        '_in_reply_to_user_id',
+        '_location',
+        '_now',
+        '_pending',
+        '_place',
+        '_retweeted',
+        '_retweeted_status',
+        '_source',
+        '_text',
+        '_truncated',
+        '_urls',
+        '_user',
+        '_user_mentions',
+    )
+
     def __init__(self,
         created_at=None,
         favorited=None,
@@ -213,6 +290,7 @@ class Status(object):
                 a retweeted message, even if it is longer than 140 characters in
                 legacy "text" field.
         '''
+        self._pending = None
         self.created_at = created_at
         self.favorited = favorited
         self.id = id
@@ -443,6 +521,8 @@ class Status(object):
         Returns:
             A twitter.User reprenting the entity posting this status message
         '''
+        if self._pending:
+            self._hydrate('user')
         return self._user
 
     def setUser(self, user):
@@ -454,6 +534,7 @@ class Status(object):
                 A twitter.User reprenting the entity posting this status message
         '''
         self._user = user
+        self._discardPending('user')
 
     user = property(getUser, setUser,
         doc='A twitter.User reprenting the entity posting this status message')
@@ -521,14 +602,81 @@ class Status(object):
     contributors = property(getContributors, setContributors, doc='')
 
     def getRetweetedStatus(self):
+        if self._pending:
+            self._hydrate('retweeted_status')
         return self._retweeted_status
 
     def setRetweetedStatus(self, retweeted_status):
         self._retweeted_status = retweeted_status
+        self._discardPending('retweeted_status')
 
     retweeted_status = property(getRetweetedStatus, setRetweetedStatus,
         doc='')
 
+    def getUrls(self):
+        if self._pending:
+            self._hydrate('urls')
+        return self._urls
+
+    def setUrls(self, urls):
+        self._urls = urls
+        self._discardPending('urls')
+
+    urls = property(getUrls, setUrls, doc='')
+
+    def getUserMentions(self):
+        if self._pending:
+            self._hydrate('user_mentions')
+        return self._user_mentions
+
+    def setUserMentions(self, user_mentions):
+        self._user_mentions = user_mentions
+        self._discardPending('user_mentions')
+
+    user_mentions = property(getUserMentions, setUserMentions, doc='')
+
+    def getHashtags(self):
+        if self._pending:
+            self._hydrate('hashtags')
+        return self._hashtags
+
+    def setHashtags(self, hashtags):
+        self._hashtags = hashtags
+        self._discardPending('hashtags')
+
+    hashtags = property(getHashtags, setHashtags, doc='')
+
+    def _hydrate(self, name):
+        '''
+        Build the nested models under name from the raw JSON kept by a
+        lazy instance.  See newFromJsonDict.
+
+        Two threads may race to build the same models; the loser's copy is
+        simply dropped, which is cheaper than locking every read.
+        '''
+        data = self._pending.get(name)
+        if data is None:
+            return
+        if name == 'user':
+            self._user = User.newFromJsonDict(data, lazy=True)
+        elif name == 'retweeted_status':
+            self._retweeted_status = Status.newFromJsonDict(data, lazy=True)
+        elif name == 'urls':
+            self._urls = [Url.newFromJsonDict(u) for u in data]
+        elif name == 'user_mentions':
+            self._user_mentions = [User.newFromJsonDict(u, lazy=True) for u in data]
+        elif name == 'hashtags':
+            self._hashtags = [Hashtag.newFromJsonDict(h) for h in data]
+        self._discardPending(name)
+
+    def _discardPending(self, name):
+        if self._pending:
+            self._pending.pop(name, None)
+
+    def __setstate__(self, state):
+        self._pending = None
+        _SlottedModel.__setstate__(self, state)
+
     def __ne__(self, other):
         return not self.__eq__(other)
 
@@ -622,20 +770,27 @@ class Status(object):
         if self.hashtags:
             data['hashtags'] = [h.text for h in self.hashtags]
         if self.retweeted_status:
-            data['retweeted_status'] = self.retweeted_status.AsDict()
+            data['retweeted_status'] = self.retweeted_status.asDict()
         return data
 
     @staticmethod
-    def newFromJsonDict(data):
+    def newFromJsonDict(data, lazy=False):
         '''
         Create a new instance based on a JSON dict.
 
         Args:
             data: A JSON dict, as converted from the JSON in the twitter API
+            lazy:
+                If True, the user, retweeted_status, urls, user_mentions and
+                hashtags are kept as raw JSON and only built into models when
+                first read.  This makes pages that are mostly filtered and
+                discarded much cheaper to build.  Defaults to False. [Optional]
 
         Returns:
             A twitter.Status instance
         '''
+        if lazy:
+            return Status._newLazyFromJsonDict(data)
         if 'user' in data:
             user = User.newFromJsonDict(data['user'])
         else:
@@ -675,8 +830,36 @@ class Status(object):
             contributors=data.get('contributors', None),
             retweeted_status=retweeted_status)
 
-
-class User(object):
+    @staticmethod
+    def _newLazyFromJsonDict(data):
+        status = Status(created_at=data.get('created_at', None),
+            favorited=data.get('favorited', None),
+            id=data.get('id', None),
+            text=data.get('text', None),
+            location=data.get('location', None),
+            in_reply_to_screen_name=data.get('in_reply_to_screen_name', None),
+            in_reply_to_user_id=data.get('in_reply_to_user_id', None),
+            in_reply_to_status_id=data.get('in_reply_to_status_id', None),
+            truncated=data.get('truncated', None),
+            retweeted=data.get('retweeted', None),
+            source=data.get('source', None),
+            geo=data.get('geo', None),
+            place=data.get('place', None),
+            coordinates=data.get('coordinates', None),
+            contributors=data.get('contributors', None))
+        pending = {}
+        for name in ('user', 'retweeted_status'):
+            if data.get(name) is not None:
+                pending[name] = data[name]
+        entities = data.get('entities') or {}
+        for name in ('urls', 'user_mentions', 'hashtags'):
+            if entities.get(name) is not None:
+                pending[name] = entities[name]
+        status._pending = pending or None
+        return status
+
+
+class User(_SlottedModel):
     '''
     A class representing the User structure used by the twitter API.
 
@@ -705,6 +888,33 @@ class User(object):
         user.favourites_count
         user.geo_enabled
     '''
+    __slots__ = (
+        '_description',
+        '_favourites_count',
+        '_followers_count',
+        '_friends_count',
+        '_geo_enabled',
+        '_id',
+        '_location',
+        '_name',
+        '_profile_background_color',
+        '_profile_background_image_url',
+        '_profile_background_tile',
+        '_profile_image_url',
+        '_profile_link_color',
+        '_profile_sidebar_fill_color',
+        '_profile_text_color',
+        '_protected',
+        '_pending',
+        '_screen_name',
+        '_status',
+        '_statuses_count',
+        '_time_zone',
+        '_url',
+        '_utc_offset',
+        'friends_count',
+    )
+
     def __init__(self,
         id=None,
         name=None,
@@ -728,6 +938,7 @@ class User(object):
         url=None,
         status=None,
         geo_enabled=None):
+        self._pending = None
         self.id = id
         self.name = name
         self.screen_name = screen_name
@@ -1005,6 +1216,12 @@ class User(object):
         Returns:
             The latest twitter.Status of this user
         '''
+        pending = self._pending
+        if pending:
+            status = Status.newFromJsonDict(pending['status'], lazy=True)
+            if self._pending:
+                self._status = status
+                self._pending = None
         return self._status
 
     def setStatus(self, status):
@@ -1016,6 +1233,7 @@ class User(object):
                 The latest twitter.Status of this user
         '''
         self._status = status
+        self._pending = None
 
     status = property(getStatus, setStatus,
         doc='The latest twitter.Status of this user.')
@@ -1137,7 +1355,8 @@ class User(object):
     Set this to False to enable looser equality checking (Cached vs. uncached
     users can have varying numbers of followers, which would make the objects
     appear to be not equal when in fact we may only care about the screen_name
-    or id being identical).
+    or id being identical).  Being a class attribute of a slotted class, it
+    can only be set on User itself, not on single instances.
     '''
     strict_equality = True
 
@@ -1245,23 +1464,35 @@ class User(object):
             data['geo_enabled'] = self.geo_enabled
         return data
 
+    def __setstate__(self, state):
+        self._pending = None
+        _SlottedModel.__setstate__(self, state)
+
     @staticmethod
-    def newFromJsonDict(data):
+    def newFromJsonDict(data, lazy=False):
         '''
         Create a new instance based on a JSON dict.
 
         Args:
             data:
                 A JSON dict, as converted from the JSON in the twitter API
+            lazy:
+                If True, the status is kept as raw JSON and only built into
+                a twitter.Status when first read.  Defaults to False. [Optional]
 
         Returns:
             A twitter.User instance
         '''
-        if 'status' in data:
+        pending = None
+        if lazy:
+            status = None
+            if data.get('status') is not None:
+                pending = {'status': data['status']}
+        elif 'status' in data:
             status = Status.newFromJsonDict(data['status'])
         else:
             status = None
-        return User(id=data.get('id', None),
+        user = User(id=data.get('id', None),
             name=data.get('name', None),
             screen_name=data.get('screen_name', None),
             location=data.get('location', None),
@@ -1283,6 +1514,8 @@ class User(object):
             url=data.get('url', None),
             status=status,
             geo_enabled=data.get('geo_enabled', None))
+        user._pending = pending
+        return user
 
 
 class List(object):
@@ -2045,6 +2278,166 @@ class Url(object):
             expanded_url=data.get('expanded_url', None))
 
 
+class Page(list):
+    '''
+    One page of a cursored resource.
+
+    A Page is a list of the page's items, and also carries the cursors
+    Twitter returned with it, so paging state travels with the result
+    rather than living on the twitter.Api instance.
+
+    The Page structure exposes the following properties:
+
+      page.next_cursor
+      page.previous_cursor
+    '''
+
+    def __init__(self, items=None, next_cursor=0, previous_cursor=0):
+        list.__init__(self, items or [])
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return 'Page(%s, next_cursor=%r, previous_cursor=%r)' % (
+            list.__repr__(self), self.next_cursor, self.previous_cursor)
+
+    @staticmethod
+    def newFromJsonDict(data, items_key, factory=None):
+        '''
+        Create a new instance based on a JSON dict.
+
+        Args:
+            data:
+                A JSON dict, as converted from the JSON in the twitter API
+            items_key:
+                The key holding the page's items in data
+            factory:
+                A callable turning each item into a model, such as
+                User.newFromJsonDict.  If None the items are kept as
+                decoded. [Optional]
+
+        Returns:
+            A twitter.Page instance
+        '''
+        items = data.get(items_key, [])
+        if factory is not None:
+            items = [factory(x) for x in items]
+        return Page(items,
+            next_cursor=data.get('next_cursor', 0),
+            previous_cursor=data.get('previous_cursor', 0))
+
+
+class PagingCheckpoint(object):
+    '''
+    Records how far a cursor-paged crawl has got, so that after a crash it
+    can resume from the last completed page instead of starting again from
+    cursor -1.
+
+    Checkpoints are kept in a store, which is either the path of a directory
+    or a cache backend such as a LRUCache or SqliteCache.  A store with age
+    or size limits may evict a checkpoint, which simply restarts the crawl.
+
+    The PagingCheckpoint structure exposes the following properties:
+
+      checkpoint.name
+      checkpoint.keep_items
+      checkpoint.cursor
+      checkpoint.pages
+      checkpoint.count
+    '''
+
+    def __init__(self, name, store, keep_items=False):
+        '''
+        Args:
+            name:
+                A name identifying the crawl, unique within the store.
+            store:
+                A directory path, or a cache backend to keep the checkpoint in.
+            keep_items:
+                If True, the decoded items of each completed page are stored
+                too, and can be read back with getItems() after a resume.
+                Defaults to False. [Optional]
+        '''
+        if isinstance(store, basestring):
+            store = _FileCache(store)
+        self.name = name
+        self._store = store
+        self.keep_items = keep_items
+        self._loaded = False
+        self.cursor = -1
+        self.pages = 0
+        self.count = 0
+
+    def load(self):
+        '''
+        Read the checkpoint from its store.  Only the first call reads it;
+        later calls return the same answer.
+
+        Returns:
+            True if a checkpoint was found and the crawl should resume from
+            checkpoint.cursor, otherwise False.
+        '''
+        if not self._loaded:
+            self._loaded = True
+            state = self._store.get(self._getKey())
+            if state is not None:
+                state = simplejson.loads(state)
+                self.cursor = state['cursor']
+                self.pages = state['pages']
+                self.count = state['count']
+        return self.pages > 0
+
+    def save(self, cursor, items):
+        '''
+        Record that a page has been completely consumed.
+
+        Args:
+            cursor:
+                The next_cursor returned with the page.
+            items:
+                The items of the page, as decoded from Twitter's JSON.
+        '''
+        if self.keep_items:
+            self._store.set(self._getKey(self.pages), simplejson.dumps(items))
+        self.cursor = cursor
+        self.pages += 1
+        self.count += len(items)
+        self._loaded = True
+        self._store.set(self._getKey(), simplejson.dumps(
+            {'cursor': self.cursor, 'pages': self.pages, 'count': self.count}))
+
+    def getItems(self):
+        '''
+        Yield the decoded items of every completed page, in order.  Only
+        available when the checkpoint was created with keep_items=True.
+        '''
+        if not self.keep_items:
+            raise TwitterError('PagingCheckpoint %s does not keep items' % self.name)
+        self.load()
+        for page in xrange(self.pages):
+            data = self._store.get(self._getKey(page))
+            if data is None:
+                raise TwitterError('PagingCheckpoint %s has lost page %d' % (self.name, page))
+            for item in simplejson.loads(data):
+                yield item
+
+    def clear(self):
+        '''Remove the checkpoint from its store, e.g. once the crawl completes.'''
+        self.load()
+        self._store.remove(self._getKey())
+        if self.keep_items:
+            for page in xrange(self.pages):
+                self._store.remove(self._getKey(page))
+        self.cursor = -1
+        self.pages = 0
+        self.count = 0
+
+    def _getKey(self, page=None):
+        if page is None:
+            return 'checkpoint:%s' % self.name
+        return 'checkpoint:%s:%d' % (self.name, page)
+
+
 class Api(object):
     '''
     A python interface into the Twitter API
@@ -2112,6 +2505,10 @@ class Api(object):
     '''
 
     DEFAULT_CACHE_TIMEOUT = 60 * 60 * 24 * 90  # Cache for {{duration}} seconds.
+    USERS_LOOKUP_CHUNK_SIZE = 100  # The most users users/lookup returns at once.
+    DEFAULT_USERS_LOOKUP_WORKERS = 4
+    DEFAULT_FETCH_MANY_WORKERS = 8
+    MAX_REVALIDATIONS = 4  # The most stale entries refreshed at once.
     _API_REALM = 'Twitter API'
 
     def __init__(self,
@@ -2126,7 +2523,11 @@ class Api(object):
         shortner=None,
         base_url=None,
         use_gzip_compression=False,
-        debugHTTP=False):
+        debugHTTP=False,
+        connection_pool=DEFAULT_CONNECTION_POOL,
+        rate_limiter=DEFAULT_RATE_LIMITER,
+        decode_pool=None,
+        lazy_models=False):
         '''
         Instantiate a new twitter.Api object.
 
@@ -2160,15 +2561,49 @@ class Api(object):
             debugHTTP:
                 Set to True to enable debug output from urllib2 when performing
                 any HTTP requests.  Defaults to False. [Optional]
+            connection_pool:
+                The twitter.ConnectionPool instance used to keep HTTP
+                connections alive between requests.  Defaults to a pool
+                private to this instance.  Use SHARED_CONNECTION_POOL to
+                share one pool across the process, or None to open a new
+                connection for every request. [Optional]
+            rate_limiter:
+                The twitter.RateLimiter instance that meters requests to
+                stay within Twitter's rate limit.  Defaults to a limiter
+                private to this instance.  Use None to send requests
+                unmetered. [Optional]
+            decode_pool:
+                The twitter.DecodePool used to decode large responses and
+                build their models in worker processes.  Defaults to None,
+                decoding on the calling thread. [Optional]
+            lazy_models:
+                Set to True to build the statuses and users of timelines,
+                searches and other list responses lazily: their nested
+                users, statuses and entities are only built when first
+                read.  Defaults to False. [Optional]
         '''
         self.screen_name     = screen_name
         self.setCache(cache)
         self._urllib         = urllib2
+        self._opener         = None
         self._cache_timeout  = Api.DEFAULT_CACHE_TIMEOUT
+        self._stale_while_revalidate = 0
         self._input_encoding = input_encoding
         self._use_gzip       = use_gzip_compression
         self._debugHTTP      = debugHTTP
         self._oauth_consumer = None
+        self.setConnectionPool(connection_pool)
+        self.setRateLimiter(rate_limiter)
+        self.setDecodePool(decode_pool)
+        self.setLazyModels(lazy_models)
+        self._rate_limit_state = RateLimitState()
+        self._single_flight  = _SingleFlight()
+        self._revalidating   = set()
+        self._revalidating_lock = threading.Lock()
+        self._revalidation_pool = _ThreadPool(Api.MAX_REVALIDATIONS)
+        self._last_cursors = (-1, 0)
+        self._cache_statistics = {}
+        self._cache_statistics_lock = threading.Lock()
 
         self._initializeRequestHeaders(request_headers)
         self._initializeUserAgent()
@@ -2187,8 +2622,6 @@ class Api(object):
             raise TwitterError('Twitter requires oAuth Access Token for all API access')
 
         self.setCredentials(consumer_key, consumer_secret, access_token_key, access_token_secret)
-        self.next_cursor = -1
-        self.previous_cursor = 0
 
     def setCredentials(self, consumer_key, consumer_secret, access_token_key=None, access_token_secret=None):
         '''
@@ -2258,10 +2691,9 @@ class Api(object):
         if include_entities:
             parameters['include_entities'] = 1
         url  = '%s/statuses/public_timeline.json' % self.base_url
-        json = self._fetchUrl(url,  parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def filterPublicTimeline(self, term, since_id=None, **kw):
         '''
@@ -2326,8 +2758,10 @@ class Api(object):
             query_users:
                 If set to False, then all users only have screen_name and
                 profile_image_url available.
-                If set to True, all information of users are available,
-                but it uses lots of request quota, one per status.
+                If set to True, all information of users are available.
+                The users are fetched with batched users/lookup requests,
+                or one request per user if the instance is not
+                authenticated.
 
         Returns:
             A sequence of twitter.Status instances, one for each message containing
@@ -2349,20 +2783,18 @@ class Api(object):
         parameters['page'] = page
         # Make and send requests.
         url  = 'http://search.twitter.com/search.json'
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=_SearchResult, items_key='results',
+            parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        results = []
-        for x in data['results']:
-            temp = Status.newFromJsonDict(x)
-            if query_users:
-                # Build user object with new request.
-                temp.user = self.getUser(urllib.quote(x['from_user']))
-            else:
-                temp.user = User(screen_name=x['from_user'], profile_image_url=x['profile_image_url'])
-            results.append(temp)
+        results = data['results']
+        if query_users:
+            users = self._hydrateSearchUsers(results, **kw)
+            for status in results:
+                user = users.get(status.user.screen_name.lower())
+                if user is not None:
+                    status.user = user
         # Return built list of statuses.
-        return results # [Status.newFromJsonDict(x) for x in data['results']]
+        return results
 
     def getTrendsCurrent(self, exclude=None, **kw):
         '''
@@ -2380,8 +2812,7 @@ class Api(object):
         if exclude:
             parameters['exclude'] = exclude
         url = '%s/trends/current.json' % self.base_url
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, parameters=parameters, **kw)
         self._checkForTwitterError(data)
         trends = []
         for t in data['trends']:
@@ -2412,8 +2843,7 @@ class Api(object):
             startdate = time.strftime('%Y-%m-%d', time.gmtime())
         parameters['date'] = startdate
         url = '%s/trends/daily.json' % self.base_url
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, parameters=parameters, **kw)
         self._checkForTwitterError(data)
         trends = []
         for i in xrange(24):
@@ -2447,8 +2877,7 @@ class Api(object):
             startdate = time.strftime('%Y-%m-%d', time.gmtime())
         parameters['date'] = startdate
         url = '%s/trends/weekly.json' % self.base_url
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, parameters=parameters, **kw)
         self._checkForTwitterError(data)
         trends = []
         for i in xrange(7):
@@ -2537,10 +2966,9 @@ class Api(object):
             parameters['include_rts'] = True
         if include_entities:
             parameters['include_entities'] = True
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def getUserTimeline(self,
         id=None,
@@ -2641,10 +3069,9 @@ class Api(object):
         if include_entities:
             parameters['include_entities'] = 1
 
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def getStatus(self, id, **kw):
         '''
@@ -2666,8 +3093,7 @@ class Api(object):
         except:
             raise TwitterError("id must be an long integer")
         url = '%s/statuses/show/%s.json' % (self.base_url, id)
-        json = self._fetchUrl(url, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, **kw)
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -2719,10 +3145,11 @@ class Api(object):
                 parameters['page'] = int(page)
             except:
                 raise TwitterError("page must be an integer")
-        json = self._FetchUrl(url, parameters=parameters)
-        data = simplejson.loads(json)
-        self._CheckForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        # Someone is waiting to read it; let it past bulk requests.
+        data = self._fetchJson(url, model=Status, parameters=parameters, account_specific=True,
+            priority=PRIORITY_INTERACTIVE)
+        self._checkForTwitterError(data)
+        return data
 
     def destroyStatus(self, id, **kw):
         '''
@@ -2744,8 +3171,7 @@ class Api(object):
         except:
             raise TwitterError("id must be an integer")
         url = '%s/statuses/destroy/%s.json' % (self.base_url, id)
-        json = self._fetchUrl(url, post_data={'id': id}, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'id': id}, **kw)
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -2782,8 +3208,7 @@ class Api(object):
         data = {'status': u_status.encode('utf-8')}
         if in_reply_to_status_id:
             data['in_reply_to_status_id'] = in_reply_to_status_id
-        json = self._fetchUrl(url, post_data=data, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data=data, **kw)
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -2802,9 +3227,8 @@ class Api(object):
         if not self._oauth_consumer:
             raise TwitterError("The twitter.Api instance must be authenticated.")
         url = '%s/statuses/retweet/%d.json' % (self.base_url, id)
-        json = self._FetchUrl(url, post_data={'':None})
-        data = simplejson.loads(json)
-        self._CheckForTwitterError(data)
+        data = self._fetchJson(url, post_data={'':None})
+        self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
     def postUpdates(self, status, continuation=None, **kw):
@@ -2858,8 +3282,7 @@ class Api(object):
             raise TwitterError("The twitter.Api instance must be authenticated.")
         url = '%s/statuses/retweet/%s.json' % (self.base_url, status_id)
         data = {'id': status_id}
-        json = self._fetchUrl(url, post_data=data, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data=data, **kw)
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -2906,10 +3329,10 @@ class Api(object):
             parameters['since_id'] = since_id
         if include_entities:
             parameters['include_entities'] = True
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        kw['account_specific'] = True
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def getReplies(self, since=None, since_id=None, page=None, **kw):
         '''
@@ -2942,10 +3365,11 @@ class Api(object):
             parameters['since_id'] = since_id
         if page:
             parameters['page'] = page
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        kw['account_specific'] = True
+        kw.setdefault('priority', PRIORITY_INTERACTIVE)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def getRetweets(self, statusid, **kw):
         '''
@@ -2963,10 +3387,11 @@ class Api(object):
             raise TwitterError("The twitter.Api instsance must be authenticated.")
         url = '%s/statuses/retweets/%s.json?include_entities=true&include_rts=true' % (self.base_url, statusid)
         parameters = {}
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        # Which retweets are visible depends on the authenticated user.
+        kw['account_specific'] = True
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(s) for s in data]
+        return data
 
     def getFriends(self, user=None, cursor=-1, **kw):
         '''
@@ -2980,21 +3405,44 @@ class Api(object):
                 If not specified, defaults to the authenticated user. [Optional]
 
         Returns:
-            A sequence of twitter.User instances, one for each friend
+            A twitter.Page of twitter.User instances, one for each friend,
+            along with the next_cursor and previous_cursor of the page
         '''
-        if not user and not self._oauth_consumer:
-            raise TwitterError("twitter.Api instance must be authenticated")
-        if user:
-            url = '%s/statuses/friends/%s.json' % (self.base_url, user)
-        else:
-            url = '%s/statuses/friends.json' % self.base_url
-            kw['account_specific'] = True
-        parameters = {}
-        parameters['cursor'] = cursor
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return [User.newFromJsonDict(x) for x in data['users']]
+        data = self._getFriendsData(user, cursor, model=User, items_key='users', **kw)
+        return Page.newFromJsonDict(data, 'users')
+
+    def iterFriends(self, user=None, cursor=-1, read_ahead=0, checkpoint=None, **kw):
+        '''
+        Iterate over a user's friends, fetching one page at a time.
+
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
+
+        Args:
+            user:
+                The twitter name or id of the user. [Optional]
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getFriends for a list of accepted parameters.
+
+        Returns:
+            A generator yielding twitter.User instances, one for each friend
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getFriendsData(user, cursor, model=model, items_key='users', **kw)
+        return self._iterCursor(fetch_page, 'users', User, cursor, read_ahead, checkpoint)
 
     def getFriendIDs(self, user=None, cursor=-1, **kw):
         '''
@@ -3009,19 +3457,40 @@ class Api(object):
         Returns:
             A list of integers, one for each user id.
         '''
-        if not user and not self._oauth_consumer:
-            raise TwitterError("twitter.Api instance must be authenticated")
-        if user:
-            url = '%s/friends/ids/%s.json' % (self.base_url, user)
-        else:
-            url = '%s/friends/ids.json' % self.base_url
-            kw['account_specific'] = True
-        parameters = {}
-        parameters['cursor'] = cursor
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return data
+        return self._getFriendIDsData(user, cursor, **kw)
+
+    def iterFriendIDs(self, user=None, cursor=-1, read_ahead=0, checkpoint=None, **kw):
+        '''
+        Iterate over the ids of a user's friends, fetching one page at a time.
+
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
+
+        Args:
+            user:
+                The twitter name or id of the user. [Optional]
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getFriendIDs for a list of accepted parameters.
+
+        Returns:
+            A generator yielding integers, one for each user id
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getFriendIDsData(user, cursor, **kw)
+        return self._iterCursor(fetch_page, 'ids', None, cursor, read_ahead, checkpoint)
 
     def getFollowerIDs(self, cursor=-1, **kw):
         '''
@@ -3032,19 +3501,38 @@ class Api(object):
         Returns:
             A sequence of twitter.User instances, one for each follower
         '''
-        url = 'http://twitter.com/followers/ids.json'
-        parameters = {}
-        parameters['cursor'] = cursor
-        if kw.get('user_id', False):
-            parameters['user_id'] = kw.get('user_id')
-        if kw.get('screen_name', False):
-            parameters['screen_name'] = kw.get('screen_name')
-        if not (kw.get('user_id', False) or kw.get('screen_name', False)):
-            kw['account_specific'] = True
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return data
+        return self._getFollowerIDsData(cursor, **kw)
+
+    def iterFollowerIDs(self, cursor=-1, read_ahead=0, checkpoint=None, **kw):
+        '''
+        Iterate over the ids of a user's followers, fetching one page at a time.
+
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
+
+        Args:
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getFollowerIDs for a list of accepted parameters.
+
+        Returns:
+            A generator yielding integers, one for each user id
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getFollowerIDsData(cursor, **kw)
+        return self._iterCursor(fetch_page, 'ids', None, cursor, read_ahead, checkpoint)
 
     def getFollowers(self, cursor=-1, **kw):
         '''
@@ -3059,27 +3547,46 @@ class Api(object):
             cursor:
                 "page" value that Twitter will use to start building the
                 list sequence from.  -1 to start at the beginning.
-                Twitter will return in the result the values for next_cursor
-                and previous_cursor. [Optional]
+                The returned twitter.Page carries the next_cursor and
+                previous_cursor values Twitter sent back. [Optional]
 
         Returns:
-            A sequence of twitter.User instances, one for each follower
+            A twitter.Page of twitter.User instances, one for each follower,
+            along with the next_cursor and previous_cursor of the page
         '''
-        if not self._oauth_consumer:
-            raise TwitterError("twitter.Api instance must be authenticated")
-        url = '%s/statuses/followers.json' % self.base_url
-        parameters = {}
-        parameters['cursor'] = cursor
-        if kw.get('user_id', False):
-            parameters['user_id'] = kw.get('user_id')
-        if kw.get('screen_name', False):
-            parameters['screen_name'] = kw.get('screen_name')
-        if not (kw.get('user_id', False) or kw.get('screen_name', False)):
-            kw['account_specific'] = True
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return [User.newFromJsonDict(x) for x in data['users']]
+        data = self._getFollowersData(cursor, model=User, items_key='users', **kw)
+        return Page.newFromJsonDict(data, 'users')
+
+    def iterFollowers(self, cursor=-1, read_ahead=0, checkpoint=None, **kw):
+        '''
+        Iterate over a user's followers, fetching one page at a time.
+
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
+
+        Args:
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getFollowers for a list of accepted parameters.
+
+        Returns:
+            A generator yielding twitter.User instances, one for each follower
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getFollowersData(cursor, model=model, items_key='users', **kw)
+        return self._iterCursor(fetch_page, 'users', User, cursor, read_ahead, checkpoint)
 
     def getFeatured(self, **kw):
         '''
@@ -3091,10 +3598,9 @@ class Api(object):
             A sequence of twitter.User instances
         '''
         url = '%s/statuses/featured.json' % self.base_url
-        json = self._fetchUrl(url, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=User, **kw)
         self._checkForTwitterError(data)
-        return [User.newFromJsonDict(x) for x in data]
+        return data
 
     def usersLookup(self, user_id=None, screen_name=None, users=None, **kw):
         '''
@@ -3104,6 +3610,8 @@ class Api(object):
         screen_names, or twitter.User objects. The list of users that
        are queried is the union of all specified parameters.
 
+        Any number of users may be given; see iterUsersLookup.
+
         The twitter.Api instance must be authenticated.
 
         Args:
@@ -3120,25 +3628,117 @@ class Api(object):
         Returns:
             A list of twitter.User objects for the requested users
         '''
+        return list(self.iterUsersLookup(user_id, screen_name, users, **kw))
+
+    def iterUsersLookup(self,
+        user_id=None,
+        screen_name=None,
+        users=None,
+        max_workers=DEFAULT_USERS_LOOKUP_WORKERS,
+        missing=None,
+        include_entities=None,
+        **kw):
+        '''
+        Fetch extended information for any number of users.
+
+        The users are split into users/lookup requests of at most
+        USERS_LOOKUP_CHUNK_SIZE, which run concurrently.  When the instance
+        has a cache, each user is cached on its own, so users fetched
+        recently by an earlier lookup are not requested again.
+
+        The twitter.Api instance must be authenticated.
+
+        Args:
+            user_id:
+                A list of user_ids to retrieve extended information.
+                [Optional]
+            screen_name:
+                A list of screen_names to retrieve extended information.
+                [Optional]
+            users:
+                A list of twitter.User objects to retrieve extended information.
+                [Optional]
+            max_workers:
+                The most users/lookup requests to run at once.  Defaults to
+                DEFAULT_USERS_LOOKUP_WORKERS.  Lookups needing more than one
+                request run at PRIORITY_BULK unless a priority is given.
+                [Optional]
+            missing:
+                A list to which each requested user_id or screen_name that
+                Twitter did not return is appended. [Optional]
+            include_entities:
+                If True, each user's latest status will include a node called
+                "entities".  Sent with every users/lookup request. [Optional]
+            **kw:
+                See api._fetchUrl for a list of accepted parameters.  They
+                apply to every users/lookup request.
+
+        Returns:
+            A generator yielding twitter.User instances in the order the
+            users were requested: user_id, then users, then screen_name.
+        '''
+        # Checked here rather than in the generator, so that bad arguments
+        # raise at the call instead of at the first next().
         if not self._oauth_consumer:
             raise TwitterError("The twitter.Api instance must be authenticated.")
         if not user_id and not screen_name and not users:
             raise TwitterError("Specify at least on of user_id, screen_name, or users.")
-        url = '%s/users/lookup.json' % self.base_url
-        parameters = {}
-        uids = list()
+        return self._iterUsersLookup(user_id, screen_name, users, max_workers,
+            missing, include_entities, **kw)
+
+    def _iterUsersLookup(self, user_id, screen_name, users, max_workers, missing,
+        include_entities, **kw):
+        requested = []
         if user_id:
-            uids.extend(user_id)
+            requested.extend([('user_id', '%s' % u) for u in user_id])
         if users:
-            uids.extend([u.id for u in users])
-        if len(uids):
-            parameters['user_id'] = ','.join(["%s" % u for u in uids])
+            requested.extend([('user_id', '%s' % u.id) for u in users])
         if screen_name:
-            parameters['screen_name'] = ','.join(screen_name)
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return [User.newFromJsonDict(u) for u in data]
+            requested.extend([('screen_name', u) for u in screen_name])
+
+        # _fetchUsersChunk takes the timeout separately, for the per-user cache.
+        cache_timeout = kw.pop('cache_timeout', self._cache_timeout)
+        found = {}
+        seen = set()
+        wanted = {'user_id': [], 'screen_name': []}
+        for parameter, value in requested:
+            key = self._getUserCacheKey(parameter, value, include_entities)
+            if key in seen:
+                continue
+            seen.add(key)
+            data = self._getCachedUser(key, cache_timeout)
+            if data is None:
+                wanted[parameter].append(value)
+            else:
+                found[key] = data
+
+        chunks = []
+        for parameter in ('user_id', 'screen_name'):
+            values = wanted[parameter]
+            for start in xrange(0, len(values), self.USERS_LOOKUP_CHUNK_SIZE):
+                chunks.append((parameter, values[start:start + self.USERS_LOOKUP_CHUNK_SIZE]))
+        if len(chunks) > 1:
+            kw.setdefault('priority', PRIORITY_BULK)
+        fetch = lambda chunk: self._fetchUsersChunk(
+            chunk[0], chunk[1], cache_timeout, include_entities, **kw)
+        futures = _mapConcurrently(fetch, chunks, max_workers)
+        pending = {}
+        for chunk, future in zip(chunks, futures):
+            for value in chunk[1]:
+                pending[self._getUserCacheKey(chunk[0], value, include_entities)] = future
+
+        for parameter, value in requested:
+            key = self._getUserCacheKey(parameter, value, include_entities)
+            if key not in found:
+                for data in pending[key].get():
+                    found[self._getUserCacheKey('user_id', '%s' % data['id'], include_entities)] = data
+                    found[self._getUserCacheKey('screen_name', data['screen_name'], include_entities)] = data
+                found.setdefault(key, None)
+            if found[key] is None:
+                if missing is not None:
+                    missing.append(value)
+            else:
+                yield User.newFromJsonDict(found[key])
 
     def getUser(self, user=None, **kw):
         '''
@@ -3158,8 +3758,7 @@ class Api(object):
             user = self.screen_name
             kw['account_specific'] = True
         url = '%s/users/show/%s.json' % (self.base_url, user.strip())
-        json = self._fetchUrl(url, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, **kw)
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3196,10 +3795,11 @@ class Api(object):
             parameters['since_id'] = since_id
         if page:
             parameters['page'] = page
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        kw['account_specific'] = True
+        kw.setdefault('priority', PRIORITY_INTERACTIVE)
+        data = self._fetchJson(url, model=DirectMessage, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [DirectMessage.newFromJsonDict(x) for x in data]
+        return data
 
     def postDirectMessage(self, user, text):
         '''
@@ -3220,8 +3820,7 @@ class Api(object):
             raise TwitterError("The twitter.Api instance must be authenticated.")
         url = '%s/direct_messages/new.json' % self.base_url
         data = {'text': text, 'user': user}
-        json = self._fetchUrl(url, post_data=data)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data=data)
         self._checkForTwitterError(data)
         return DirectMessage.newFromJsonDict(data)
 
@@ -3241,8 +3840,7 @@ class Api(object):
             A twitter.DirectMessage instance representing the message destroyed
         '''
         url = '%s/direct_messages/destroy/%s.json' % (self.base_url, id)
-        json = self._fetchUrl(url, post_data={'id': id})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'id': id})
         self._checkForTwitterError(data)
         return DirectMessage.newFromJsonDict(data)
 
@@ -3260,8 +3858,7 @@ class Api(object):
             A twitter.User instance representing the befriended user.
         '''
         url = '%s/friendships/create/%s.json' % (self.base_url, user)
-        json = self._fetchUrl(url, post_data={'user': user})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'user': user})
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3279,8 +3876,7 @@ class Api(object):
             A twitter.User instance representing the discontinued friend.
         '''
         url = '%s/friendships/destroy/%s.json' % (self.base_url, user)
-        json = self._fetchUrl(url, post_data={'user': user})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'user': user})
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3299,8 +3895,7 @@ class Api(object):
             A twitter.Status instance representing the newly-marked favorite.
         '''
         url = '%s/favorites/create/%s.json' % (self.base_url, status.id)
-        json = self._fetchUrl(url, post_data={'id': status.id})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'id': status.id})
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -3319,8 +3914,7 @@ class Api(object):
             A twitter.Status instance representing the newly-unmarked favorite.
         '''
         url = '%s/favorites/destroy/%s.json' % (self.base_url, status.id)
-        json = self._fetchUrl(url, post_data={'id': status.id})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'id': status.id})
         self._checkForTwitterError(data)
         return Status.newFromJsonDict(data)
 
@@ -3351,10 +3945,9 @@ class Api(object):
         else:
             url = '%s/favorites.json' % self.base_url
             kw['account_specific'] = True
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def getMentions(self, since_id=None, max_id=None, page=None, **kw):
         '''
@@ -3388,10 +3981,11 @@ class Api(object):
             parameters['max_id'] = max_id
         if page:
             parameters['page'] = page
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
+        kw['account_specific'] = True
+        kw.setdefault('priority', PRIORITY_INTERACTIVE)
+        data = self._fetchJson(url, model=Status, parameters=parameters, **kw)
         self._checkForTwitterError(data)
-        return [Status.newFromJsonDict(x) for x in data]
+        return data
 
     def createList(self, user, name, mode=None, description=None):
         '''
@@ -3424,8 +4018,7 @@ class Api(object):
             parameters['mode'] = mode
         if description is not None:
             parameters['description'] = description
-        json = self._fetchUrl(url, post_data=parameters)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data=parameters)
         self._checkForTwitterError(data)
         return List.newFromJsonDict(data)
 
@@ -3444,8 +4037,7 @@ class Api(object):
         '''
         url = '%s/%s/%s/members.json' % (self.base_url, self.screen_name, list_id)
         parameters = {'id': user}
-        json = self._fetchUrl(url, post_data=parameters)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data=parameters)
         self._checkForTwitterError(data)
         return List.newFromJsonDict(data)
 
@@ -3465,8 +4057,7 @@ class Api(object):
             A twitter.List instance representing the removed list.
         '''
         url = '%s/%s/lists/%s.json' % (self.base_url, user, id)
-        json = self._fetchUrl(url, post_data={'_method': 'DELETE'})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'_method': 'DELETE'})
         self._checkForTwitterError(data)
         return List.newFromJsonDict(data)
 
@@ -3486,8 +4077,7 @@ class Api(object):
             A twitter.List instance representing the list subscribed to
         '''
         url = '%s/%s/%s/subscribers.json' % (self.base_url, owner, list)
-        json = self._fetchUrl(url, post_data={'list_id': list})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'list_id': list})
         self._checkForTwitterError(data)
         return List.newFromJsonDict(data)
 
@@ -3508,8 +4098,7 @@ class Api(object):
             A twitter.List instance representing the removed list.
         '''
         url = '%s/%s/%s/subscribers.json' % (self.base_url, owner, list)
-        json = self._fetchUrl(url, post_data={'_method': 'DELETE', 'list_id': list})
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, post_data={'_method': 'DELETE', 'list_id': list})
         self._checkForTwitterError(data)
         return List.newFromJsonDict(data)
 
@@ -3525,21 +4114,48 @@ class Api(object):
             cursor:
                 "page" value that Twitter will use to start building the
                 list sequence from.  -1 to start at the beginning.
-                Twitter will return in the result the values for next_cursor
-                and previous_cursor. [Optional]
+                The returned twitter.Page carries the next_cursor and
+                previous_cursor values Twitter sent back. [Optional]
 
         Returns:
-            A sequence of twitter.List instances, one for each list
+            A twitter.Page of twitter.List instances, one for each list,
+            along with the next_cursor and previous_cursor of the page
         '''
-        if not self._oauth_consumer:
-            raise TwitterError("twitter.Api instance must be authenticated")
-        url = '%s/%s/lists/subscriptions.json' % (self.base_url, user)
-        parameters = {}
-        parameters['cursor'] = cursor
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return [List.newFromJsonDict(x) for x in data['lists']]
+        data = self._getSubscriptionsData(user, cursor, model=List, items_key='lists', **kw)
+        return Page.newFromJsonDict(data, 'lists')
+
+    def iterSubscriptions(self, user, cursor=-1, read_ahead=0, checkpoint=None, **kw):
+        '''
+        Iterate over the lists a user is subscribed to, fetching one page at a time.
+
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
+
+        Args:
+            user:
+                The twitter name or id of the user.
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getSubscriptions for a list of accepted parameters.
+
+        Returns:
+            A generator yielding twitter.List instances, one for each list
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getSubscriptionsData(user, cursor, model=model, items_key='lists', **kw)
+        return self._iterCursor(fetch_page, 'lists', List, cursor, read_ahead, checkpoint)
 
     def getLists(self, user, cursor=-1, **kw):
         '''
@@ -3555,36 +4171,62 @@ class Api(object):
             cursor:
                 "page" value that Twitter will use to start building the
                 list sequence from.  -1 to start at the beginning.
-                Twitter will return in the result the values for next_cursor
-                and previous_cursor. [Optional]
+                The returned twitter.Page carries the next_cursor and
+                previous_cursor values Twitter sent back. [Optional]
 
         Returns:
-            A sequence of twitter.List instances, one for each list
+            A twitter.Page of twitter.List instances, one for each list,
+            along with the next_cursor and previous_cursor of the page
         '''
-        if not self._oauth_consumer:
-            raise TwitterError('twitter.Api instance must be authenticated')
-        url = '%s/%s/lists.json' % (self.base_url, user)
-        parameters = {}
-        parameters['cursor'] = cursor
-        json = self._fetchUrl(url, parameters=parameters, **kw)
-        data = simplejson.loads(json)
-        self._checkForTwitterError(data)
-        return [List.newFromJsonDict(x) for x in data['lists']]
+        data = self._getListsData(user, cursor, model=List, items_key='lists', **kw)
+        return Page.newFromJsonDict(data, 'lists')
 
-    def getUserByEmail(self, email, **kw):
+    def iterLists(self, user, cursor=-1, read_ahead=0, checkpoint=None, **kw):
         '''
-        Returns a single user by email address.
+        Iterate over a user's lists, fetching one page at a time.
 
-        Args:
-            email:
-                The email of the user to retrieve.
+        The cursor is kept by the iterator itself, so several iterators can
+        page through the same twitter.Api instance at once.  Pages are
+        requested at PRIORITY_BULK unless a priority is given.
 
-        Returns:
-            A twitter.User instance representing that user.
+        Args:
+            user:
+                The twitter name or id of the user.
+            cursor:
+                The cursor to start from.  -1, the default, starts at the
+                beginning. [Optional]
+            read_ahead:
+                The number of pages to fetch ahead of the caller on a
+                background thread.  0, the default, fetches each page only
+                once the previous one has been consumed. [Optional]
+            checkpoint:
+                A twitter.PagingCheckpoint.  If it holds a saved cursor the
+                iteration resumes from there instead of from cursor; the
+                cursor is saved after each page is consumed and the
+                checkpoint cleared once the last page has been. [Optional]
+            **kw:
+                See api.getLists for a list of accepted parameters.
+
+        Returns:
+            A generator yielding twitter.List instances, one for each list
+        '''
+        kw.setdefault('priority', PRIORITY_BULK)
+        fetch_page = lambda cursor, model: self._getListsData(user, cursor, model=model, items_key='lists', **kw)
+        return self._iterCursor(fetch_page, 'lists', List, cursor, read_ahead, checkpoint)
+
+    def getUserByEmail(self, email, **kw):
+        '''
+        Returns a single user by email address.
+
+        Args:
+            email:
+                The email of the user to retrieve.
+
+        Returns:
+            A twitter.User instance representing that user.
         '''
         url = '%s/users/show.json?email=%s' % (self.base_url, email)
-        json = self._fetchUrl(url, **kw)
-        data = simplejson.loads(json)
+        data = self._fetchJson(url, **kw)
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3605,12 +4247,11 @@ class Api(object):
         raise Exception('FATAL: updateProfileImageUrl DOES NOT CURRENTLY WORK.' + \
             'MULTI-MIME PART UPLOAD SUPPORT DOES NOT EXIST RIGHT NOW IN THIS LIB.')
         url = '%s/account/update_profile_image.json' % self.base_url
-        json = self._fetchUrl(url, **{'image_url': image_url})
+        data = self._fetchJson(url, **{'image_url': image_url})
         #    post_data={
         #        'image': wget(image_url),
         #        'include_entities': kw.get('include_entities', True)
         #    }
-        data = simplejson.loads(json)
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3626,13 +4267,12 @@ class Api(object):
             raise TwitterError("Api instance must first be given user credentials.")
         url = '%s/account/verify_credentials.json' % self.base_url
         try:
-            json = self._fetchUrl(url, **{'account_specific': True})
+            data = self._fetchJson(url, **{'account_specific': True})
         except urllib2.HTTPError, http_error:
             if http_error.code == httplib.UNAUTHORIZED:
                 return None
             else:
                 raise http_error
-        data = simplejson.loads(json)
         self._checkForTwitterError(data)
         return User.newFromJsonDict(data)
 
@@ -3642,10 +4282,11 @@ class Api(object):
 
         Args:
             cache:
-                An instance that supports the same API as the twitter._FileCache
+                An instance that supports the same API as the twitter._FileCache,
+                such as twitter.SqliteCache or twitter.LRUCache.
         '''
         if cache == DEFAULT_CACHE:
-            self._cache = _FileCache()
+            self._cache = LRUCache(_FileCache())
         else:
             self._cache = cache
 
@@ -3658,6 +4299,66 @@ class Api(object):
                 An instance that supports the same API as the urllib2 module
         '''
         self._urllib = urllib
+        self._opener = None
+
+    def setConnectionPool(self, connection_pool):
+        '''
+        Override the default connection pool.  Set to None to disable
+        keep-alive connections.
+
+        Args:
+            connection_pool:
+                A twitter.ConnectionPool instance, DEFAULT_CONNECTION_POOL
+                for a pool private to this instance, or SHARED_CONNECTION_POOL
+                for the process-wide pool.
+        '''
+        if connection_pool == DEFAULT_CONNECTION_POOL:
+            self._connection_pool = ConnectionPool()
+        elif connection_pool == SHARED_CONNECTION_POOL:
+            self._connection_pool = ConnectionPool.getShared()
+        else:
+            self._connection_pool = connection_pool
+        self._opener = None
+
+    def setRateLimiter(self, rate_limiter):
+        '''
+        Override the default rate limiter.  Set to None to send requests
+        without metering them.
+
+        Args:
+            rate_limiter:
+                A twitter.RateLimiter instance, or DEFAULT_RATE_LIMITER for
+                a limiter private to this instance.  A limiter may be shared
+                by several instances using the same credentials.
+        '''
+        if rate_limiter == DEFAULT_RATE_LIMITER:
+            self._rate_limiter = RateLimiter()
+        else:
+            self._rate_limiter = rate_limiter
+
+    def setDecodePool(self, decode_pool):
+        '''
+        Set the pool of worker processes used to decode large responses.
+        Set to None to decode them on the calling thread.
+
+        Args:
+            decode_pool:
+                A twitter.DecodePool instance, which may be shared by
+                several instances.
+        '''
+        self._decode_pool = decode_pool
+
+    def setLazyModels(self, lazy_models):
+        '''
+        Set whether list responses are built into lazy models.  See
+        Status.newFromJsonDict.
+
+        Args:
+            lazy_models:
+                True to build nested models only when first read, False to
+                build them all up front.
+        '''
+        self._lazy_models = lazy_models
 
     def setCacheTimeout(self, cache_timeout):
         '''
@@ -3669,6 +4370,59 @@ class Api(object):
         '''
         self._cache_timeout = cache_timeout
 
+    def setStaleWhileRevalidate(self, stale_while_revalidate):
+        '''
+        Override the default stale-while-revalidate window.
+
+        Args:
+            stale_while_revalidate:
+                Time, in seconds, past the cache timeout during which an
+                expired response is still returned immediately while a
+                background request refreshes it.  0 disables the window.
+        '''
+        self._stale_while_revalidate = stale_while_revalidate
+
+    def _getNextCursor(self):
+        warnings.warn('Api.next_cursor is deprecated; use the next_cursor '
+            'of the returned twitter.Page', DeprecationWarning, stacklevel=2)
+        return self._last_cursors[0]
+
+    next_cursor = property(_getNextCursor,
+        doc='The next_cursor of the last cursored page fetched.  Deprecated: '
+            'it is shared by every thread using this instance; use the '
+            'cursors of the returned twitter.Page instead.')
+
+    def _getPreviousCursor(self):
+        warnings.warn('Api.previous_cursor is deprecated; use the '
+            'previous_cursor of the returned twitter.Page', DeprecationWarning,
+            stacklevel=2)
+        return self._last_cursors[1]
+
+    previous_cursor = property(_getPreviousCursor,
+        doc='The previous_cursor of the last cursored page fetched.  '
+            'Deprecated, as for next_cursor.')
+
+    def getCacheStatistics(self):
+        '''
+        Return how cached fetches made through this instance were served.
+
+        Returns:
+            A dictionary counting fresh cache hits (hits), expired entries
+            served inside the stale-while-revalidate window (stale_hits),
+            expired entries whose body was reused after a 304 Not Modified
+            (not_modified), responses downloaded in full (refetched) and
+            background refreshes that failed, leaving the entry
+            stale (revalidation_errors).
+        '''
+        self._cache_statistics_lock.acquire()
+        try:
+            statistics = {'hits': 0, 'stale_hits': 0, 'not_modified': 0, 'refetched': 0,
+                'revalidation_errors': 0}
+            statistics.update(self._cache_statistics)
+            return statistics
+        finally:
+            self._cache_statistics_lock.release()
+
     def setUserAgent(self, user_agent):
         '''
         Override the default user agent
@@ -3717,6 +4471,9 @@ class Api(object):
         '''
         Fetch the rate limit status for the currently authorized user.
 
+        This always makes a request; getRateLimitState returns what recent
+        responses reported without one.
+
         Returns:
             A dictionary containing the time the limit will reset (reset_time),
             the number of remaining hits allowed before the reset (remaining_hits),
@@ -3724,37 +4481,330 @@ class Api(object):
             the time of the reset in seconds since The Epoch (reset_time_in_seconds).
         '''
         url  = '%s/account/rate_limit_status.json' % self.base_url
-        json = self._fetchUrl(url, **{'account_specific': True})
-        data = simplejson.loads(json)
+        # Checking the limit does not count against it, so it is not metered.
+        data = self._fetchJson(url, **{'account_specific': True, 'cache_timeout': 0,
+            'priority': None})
         self._checkForTwitterError(data)
+        if 'reset_time_in_seconds' in data:
+            self._recordRateLimit(data.get('hourly_limit'),
+                data.get('remaining_hits'), data.get('reset_time_in_seconds'))
         return data
 
+    def getRateLimitState(self):
+        '''
+        Return the live rate limit state of this instance, as last reported
+        in the X-RateLimit-* headers of a response or by getRateLimitStatus.
+
+        Returns:
+            A twitter.RateLimitState instance
+        '''
+        return self._rate_limit_state
+
+    def fetchMany(self,
+        calls,
+        method='getUserTimeline',
+        max_workers=DEFAULT_FETCH_MANY_WORKERS,
+        ordered=True):
+        '''
+        Make many calls on this instance from a bounded pool of worker
+        threads, for instance to fetch the timelines of thousands of users.
+
+        Every call goes through this instance, so its cache, rate limiter
+        and connection pool apply; to cap the requests in flight to one
+        host, give the instance a ConnectionPool with max_active set.
+
+        Args:
+            calls:
+                A sequence of calls.  Each is either a (method name, dict
+                of keyword arguments) pair, or a single argument, such as a
+                screen name, to pass to method.
+            method:
+                The name of the twitter.Api method to call with each single
+                argument.  Defaults to getUserTimeline. [Optional]
+            max_workers:
+                The most calls to run at once.  Defaults to
+                DEFAULT_FETCH_MANY_WORKERS. [Optional]
+            ordered:
+                If True, the default, results are yielded in the order of
+                calls; if False, as each call completes. [Optional]
+
+        Returns:
+            A generator yielding a (call, result, error) tuple per call.
+            error is None if the call succeeded, otherwise the exception
+            it raised, with result None.
+        '''
+        pool = _ThreadPool(max_workers)
+        completed = Queue.Queue()
+        futures = []
+        try:
+            for call in calls:
+                if (isinstance(call, tuple) and len(call) == 2
+                    and isinstance(call[0], basestring) and isinstance(call[1], dict)):
+                    future = pool.submit(getattr(self, call[0]), **call[1])
+                else:
+                    future = pool.submit(getattr(self, method), call)
+                future.call = call
+                if not ordered:
+                    future.addCallback(completed.put)
+                futures.append(future)
+            if ordered:
+                finished = futures
+            else:
+                finished = (completed.get() for i in xrange(len(futures)))
+            for future in finished:
+                future.done.wait()
+                if future.error is None:
+                    yield future.call, future.result, None
+                else:
+                    yield future.call, None, future.error[1]
+        finally:
+            # Calls not yet started when the caller stops reading are dropped.
+            pool.shutdown(cancel=True)
+
+    def getSchedulerMetrics(self):
+        '''
+        Return the queue depth and wait time of each priority class in this
+        instance's rate limiter.  See RateLimiter.getMetrics.
+
+        Returns:
+            A dict keyed by priority class name, or an empty dict if the
+            instance has no rate limiter.
+        '''
+        if self._rate_limiter is None:
+            return {}
+        return self._rate_limiter.getMetrics()
+
     def maximumHitFrequency(self):
         '''
         Determines the minimum number of seconds that a program must wait
         before hitting the server again without exceeding the rate_limit
         imposed for the currently authenticated user.
 
+        The answer comes from the rate limit headers of recent responses.
+        Only if no response has reported them yet, or the period they
+        described has ended, is getRateLimitStatus called.
+
         Returns:
             The minimum second interval that a program must use so as to not
             exceed the rate_limit imposed for the user.
         '''
-        rate_status = self.getRateLimitStatus()
-        reset_time  = rate_status.get('reset_time', None)
-        limit       = rate_status.get('remaining_hits', None)
+        reset_time = self.getRateLimitState().reset_time
+        if reset_time is None or reset_time <= time.time():
+            self.getRateLimitStatus()
+        limit, remaining, reset_time = self.getRateLimitState().get()
+        if reset_time and reset_time <= time.time() and limit:
+            # Twitter has not reported the new period yet; assume it has
+            # just started with the full hourly limit.
+            remaining = limit
+            reset_time = time.time() + 60 * 60
         if reset_time:
-            # Put the reset time into a datetime object.
-            reset = datetime.datetime(*rfc822.parsedate(reset_time)[:7])
-            # Find the difference in time between now and the reset time + 1 hour.
-            delta = reset + datetime.timedelta(hours=1) - datetime.datetime.utcnow()
-            if not limit:
-                return int(delta.seconds)
+            # Find the difference in time between now and the reset time.
+            delta = max(reset_time - time.time(), 0)
+            if not remaining:
+                return int(delta)
             # Determine the minimum number of seconds allowed as a regular interval.
-            max_frequency = int(delta.seconds / limit) + 1
+            max_frequency = int(delta / remaining) + 1
             # Return the number of seconds.
             return max_frequency
         return 60
 
+    def _getFriendsData(self, user, cursor, **kw):
+        '''Fetch one page of a user's friends, returning the decoded JSON.'''
+        if not user and not self._oauth_consumer:
+            raise TwitterError("twitter.Api instance must be authenticated")
+        if user:
+            url = '%s/statuses/friends/%s.json' % (self.base_url, user)
+        else:
+            url = '%s/statuses/friends.json' % self.base_url
+            kw['account_specific'] = True
+        parameters = {}
+        parameters['cursor'] = cursor
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _getFriendIDsData(self, user, cursor, **kw):
+        '''Fetch one page of a user's friend ids, returning the decoded JSON.'''
+        if not user and not self._oauth_consumer:
+            raise TwitterError("twitter.Api instance must be authenticated")
+        if user:
+            url = '%s/friends/ids/%s.json' % (self.base_url, user)
+        else:
+            url = '%s/friends/ids.json' % self.base_url
+            kw['account_specific'] = True
+        parameters = {}
+        parameters['cursor'] = cursor
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _getFollowerIDsData(self, cursor, **kw):
+        '''Fetch one page of a user's follower ids, returning the decoded JSON.'''
+        url = '%s/followers/ids.json' % self.base_url
+        parameters = {}
+        parameters['cursor'] = cursor
+        if kw.get('user_id', False):
+            parameters['user_id'] = kw.get('user_id')
+        if kw.get('screen_name', False):
+            parameters['screen_name'] = kw.get('screen_name')
+        if not (kw.get('user_id', False) or kw.get('screen_name', False)):
+            kw['account_specific'] = True
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _getFollowersData(self, cursor, **kw):
+        '''Fetch one page of a user's followers, returning the decoded JSON.'''
+        if not self._oauth_consumer:
+            raise TwitterError("twitter.Api instance must be authenticated")
+        url = '%s/statuses/followers.json' % self.base_url
+        parameters = {}
+        parameters['cursor'] = cursor
+        if kw.get('user_id', False):
+            parameters['user_id'] = kw.get('user_id')
+        if kw.get('screen_name', False):
+            parameters['screen_name'] = kw.get('screen_name')
+        if not (kw.get('user_id', False) or kw.get('screen_name', False)):
+            kw['account_specific'] = True
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _getSubscriptionsData(self, user, cursor, **kw):
+        '''Fetch one page of a user's list subscriptions, returning the decoded JSON.'''
+        if not self._oauth_consumer:
+            raise TwitterError("twitter.Api instance must be authenticated")
+        url = '%s/%s/lists/subscriptions.json' % (self.base_url, user)
+        parameters = {}
+        parameters['cursor'] = cursor
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _getListsData(self, user, cursor, **kw):
+        '''Fetch one page of a user's lists, returning the decoded JSON.'''
+        if not self._oauth_consumer:
+            raise TwitterError('twitter.Api instance must be authenticated')
+        url = '%s/%s/lists.json' % (self.base_url, user)
+        parameters = {}
+        parameters['cursor'] = cursor
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        return data
+
+    def _hydrateSearchUsers(self, results, **kw):
+        '''
+        Fetch the full twitter.User of every author of a list of search
+        result statuses, returning a dict keyed by lower-cased screen name.  Users
+        Twitter could not find are left out.  kw is passed on to each
+        request.
+        '''
+        names = []
+        for status in results:
+            if status.user.screen_name not in names:
+                names.append(status.user.screen_name)
+        if not names:
+            return {}
+        if self._oauth_consumer:
+            users = self.iterUsersLookup(screen_name=names, **kw)
+        else:
+            users = [self.getUser(urllib.quote(name), **kw) for name in names]
+        return dict([(u.screen_name.lower(), u) for u in users])
+
+    def _fetchUsersChunk(self, parameter, values, cache_timeout, include_entities=None, **kw):
+        '''
+        Fetch one users/lookup request, caching each returned user on its
+        own, and return the decoded users.
+        '''
+        url = '%s/users/lookup.json' % self.base_url
+        parameters = {parameter: ','.join(values)}
+        if include_entities:
+            parameters['include_entities'] = 1
+        # The users are cached one by one below, so the response itself
+        # is not worth caching.
+        kw['cache_timeout'] = 0
+        data = self._fetchJson(url, parameters=parameters, **kw)
+        self._checkForTwitterError(data)
+        if self._cache and cache_timeout:
+            for user in data:
+                encoded = simplejson.dumps(user)
+                self._cache.set(self._getUserCacheKey(
+                    'user_id', '%s' % user['id'], include_entities), encoded)
+                self._cache.set(self._getUserCacheKey(
+                    'screen_name', user['screen_name'], include_entities), encoded)
+        return data
+
+    def _getCachedUser(self, key, cache_timeout):
+        '''Return the decoded user cached under key, or None if missing or expired.'''
+        if not self._cache or not cache_timeout:
+            return None
+        cached = _cacheLookup(self._cache, key, False)
+        if cached is None or time.time() >= cached[1] + cache_timeout:
+            return None
+        return simplejson.loads(cached[0])
+
+    def _getUserCacheKey(self, parameter, value, include_entities=None):
+        '''
+        The cache key of a single user, as looked up by user_id or
+        screen_name.  Users fetched with entities are kept apart from those
+        fetched without.
+        '''
+        if parameter == 'screen_name':
+            value = value.lower()
+        url = '%s/users/lookup.json?%s=%s' % (self.base_url, parameter, value)
+        if include_entities:
+            url += '&include_entities=1'
+        return _CacheKey(url)
+
+    def _iterCursor(self, fetch_page, items_key, model, cursor, read_ahead=0, checkpoint=None):
+        '''
+        Yield the items of every page of a cursored resource, starting at
+        cursor and stopping once Twitter reports a next_cursor of 0.
+
+        Args:
+            fetch_page:
+                A callable taking a cursor and a model, and returning the
+                decoded JSON of that page, with its items built into
+                instances of the model unless the model is None.
+            items_key:
+                The key holding the page's items in the decoded JSON.
+            model:
+                The model class to yield the items as, or None to yield
+                them as decoded.
+            read_ahead:
+                The number of pages to prefetch.  See _prefetchPages.
+            checkpoint:
+                A PagingCheckpoint to resume from and save progress to.
+        '''
+        # A DecodePool builds the models along with the decoding, outside
+        # this process.  Otherwise pages are fetched as decoded, on the
+        # prefetch thread when reading ahead, and the models are built here
+        # as the items are consumed.  A checkpoint keeping items always
+        # gets the JSON Twitter sent.
+        keep_items = checkpoint is not None and checkpoint.keep_items
+        factory = None
+        if model is not None and (self._decode_pool is None or keep_items):
+            factory = _getModelFactory(model, self._lazy_models)
+            model = None
+        fetch = lambda cursor: fetch_page(cursor, model)
+        if checkpoint is not None and checkpoint.load():
+            cursor = checkpoint.cursor
+        if read_ahead > 0:
+            pages = _prefetchPages(fetch, cursor, read_ahead)
+        else:
+            pages = _readPages(fetch, cursor)
+        for data in pages:
+            items = data[items_key]
+            for item in items:
+                if factory is None:
+                    yield item
+                else:
+                    yield factory(item)
+            if checkpoint is not None:
+                checkpoint.save(data.get('next_cursor', 0), items)
+        if checkpoint is not None:
+            checkpoint.clear()
+
     def _buildUrl(self, url, path_elements=None, extra_params=None):
         # Break url into consituent parts.
         (scheme, netloc, path, params, query, fragment) = urlparse.urlparse(url)
@@ -3855,13 +4905,177 @@ class Api(object):
             TwitterError wrapping the twitter error message if one exists.
         """
         # Twitter errors are relatively unlikely, so it is faster
-        # to check first, rather than try and catch the exception.
-        if 'error' in data:
+        # to check first, rather than try and catch the exception.  Errors
+        # always come as a dict; 'in' on a list of models would compare
+        # the string with every item.
+        if isinstance(data, dict) and 'error' in data:
             raise TwitterError(data['error'])
-        if data.has_key('next_cursor'):
-                self.next_cursor = data['next_cursor']
-        if data.has_key('previous_cursor'):
-                self.previous_cursor = data['previous_cursor']
+        if isinstance(data, dict) and 'next_cursor' in data:
+            # Only kept for the deprecated Api.next_cursor and
+            # Api.previous_cursor.
+            self._last_cursors = (data['next_cursor'], data.get('previous_cursor', 0))
+
+    def _getOpener(self):
+        '''
+        Return the urllib2 opener shared by every request made through this
+        instance, building it on first use.
+        '''
+        if self._opener is None:
+            if self._debugHTTP:
+                _debug = 1
+            else:
+                _debug = 0
+            if self._connection_pool is not None:
+                http_handler  = _KeepAliveHTTPHandler(self._connection_pool, debuglevel=_debug)
+                https_handler = _KeepAliveHTTPSHandler(self._connection_pool, debuglevel=_debug)
+            else:
+                http_handler  = self._urllib.HTTPHandler(debuglevel=_debug)
+                https_handler = self._urllib.HTTPSHandler(debuglevel=_debug)
+            opener = self._urllib.OpenerDirector()
+            opener.add_handler(http_handler)
+            opener.add_handler(https_handler)
+            self._opener = opener
+        return self._opener
+
+    def _openUrl(self, url, encoded_post_data=None, request_headers=None, priority=PRIORITY_NORMAL):
+        '''
+        Perform a single HTTP request through the shared opener.
+
+        Args:
+            url:
+                The fully built URL to retrieve.
+            encoded_post_data:
+                The URL-encoded POST body, or None for a GET. [Optional]
+            request_headers:
+                A dict of extra HTTP headers to send. [Optional]
+            priority:
+                The class the rate limiter schedules the request in, or
+                None to send it unmetered.  Defaults to PRIORITY_NORMAL.
+                [Optional]
+
+        Returns:
+            A string containing the (decompressed) body of the response.
+        '''
+        return self._openResponse(url, encoded_post_data, request_headers, priority)[2]
+
+    def _openResponse(self, url, encoded_post_data=None, request_headers=None, priority=PRIORITY_NORMAL):
+        '''
+        Like _openUrl, but also returns the response status and headers.
+
+        Returns:
+            A (status, headers, body) tuple.
+        '''
+        opener = self._getOpener()
+        request = self._urllib.Request(url, encoded_post_data, request_headers or {})
+        # Only GET requests count against the hourly REST limit.
+        if self._rate_limiter is not None and encoded_post_data is None and \
+            priority is not None:
+            self._rate_limiter.acquire(priority)
+        # A kept-alive connection the server dropped is already retried by
+        # the connection pool, for the requests that are safe to repeat.
+        try:
+            response = opener.open(request)
+        except IOError, e:
+            # HTTP errors, including rate limit refusals, carry the rate
+            # limit headers too.
+            self._updateRateLimit(getattr(e, 'hdrs', None))
+            raise
+        self._updateRateLimit(response.headers)
+        url_data = self._decompressGzippedResponse(response)
+        response.close()
+        return getattr(response, 'code', httplib.OK), response.headers, url_data
+
+    def _updateRateLimit(self, headers):
+        '''Record the X-RateLimit-* values of a response, if it has them.'''
+        if headers is None:
+            return
+        try:
+            limit = int(headers.get('X-RateLimit-Limit'))
+            remaining = int(headers.get('X-RateLimit-Remaining'))
+            reset = int(headers.get('X-RateLimit-Reset'))
+        except (TypeError, ValueError):
+            return
+        self._recordRateLimit(limit, remaining, reset)
+
+    def _recordRateLimit(self, limit, remaining, reset_time):
+        '''Update the live rate limit state, and the rate limiter if any.'''
+        self._rate_limit_state.update(limit, remaining, reset_time)
+        if self._rate_limiter is not None:
+            self._rate_limiter.update(limit, remaining, reset_time)
+
+    def _refreshCache(self, key, url, request_headers, account_specific, cached=None, priority=PRIORITY_NORMAL):
+        '''
+        Fetch url and store the response in the cache under key.
+
+        When an expired entry is passed in as cached and the cache kept its
+        validators, the request is made conditional; a 304 Not Modified
+        response then refreshes the entry's timestamp and its body is reused.
+        '''
+        supports_validators = hasattr(self._cache, 'getValidators')
+        if cached is not None and supports_validators:
+            validators = self._cache.getValidators(key, account_specific)
+            if validators:
+                request_headers = dict(request_headers)
+                if validators.get('ETag'):
+                    request_headers['If-None-Match'] = str(validators['ETag'])
+                if validators.get('Last-Modified'):
+                    request_headers['If-Modified-Since'] = str(validators['Last-Modified'])
+        status, headers, url_data = self._openResponse(url, None, request_headers, priority)
+        if status == httplib.NOT_MODIFIED and cached is not None:
+            self._cache.touch(key, account_specific)
+            self._countCacheEvent('not_modified')
+            return cached[0]
+        self._countCacheEvent('refetched')
+        if supports_validators:
+            validators = {}
+            for name in ('ETag', 'Last-Modified'):
+                if headers is not None and headers.get(name):
+                    validators[name] = headers.get(name)
+            self._cache.set(key, url_data, account_specific, validators=validators)
+        else:
+            self._cache.set(key, url_data, account_specific)
+        return url_data
+
+    def _countCacheEvent(self, event):
+        self._cache_statistics_lock.acquire()
+        try:
+            self._cache_statistics[event] = self._cache_statistics.get(event, 0) + 1
+        finally:
+            self._cache_statistics_lock.release()
+
+    def _revalidateInBackground(self, key, url, request_headers, account_specific, cached):
+        '''
+        Refresh a stale cache entry in the background, unless a refresh for
+        the same key is already running.  At most Api.MAX_REVALIDATIONS
+        entries are refreshed at once; past that the entry is left stale,
+        to be refreshed by a later read.
+        '''
+        self._revalidating_lock.acquire()
+        try:
+            if key.cleaned in self._revalidating or \
+                len(self._revalidating) >= Api.MAX_REVALIDATIONS:
+                return
+            self._revalidating.add(key.cleaned)
+        finally:
+            self._revalidating_lock.release()
+
+        def revalidate():
+            try:
+                try:
+                    self._single_flight.do(key.cleaned, self._refreshCache,
+                        key, url, request_headers, account_specific, cached, PRIORITY_BULK)
+                except Exception:
+                    # The entry stays stale; the next read past the window
+                    # fetches it in line and sees the error.
+                    self._countCacheEvent('revalidation_errors')
+            finally:
+                self._revalidating_lock.acquire()
+                try:
+                    self._revalidating.discard(key.cleaned)
+                finally:
+                    self._revalidating_lock.release()
+
+        self._revalidation_pool.submit(revalidate)
 
     def _fetchUrl(self,
         url,
@@ -3892,6 +5106,10 @@ class Api(object):
                     'cache_timeout':
                         A per-call override on the default cache timeout.  Defaults
                         to the class instances self._cache_timeout value if omitted.
+                    'stale_while_revalidate':
+                        A per-call override on the default stale-while-revalidate
+                        window.  Defaults to the class instances
+                        self._stale_while_revalidate value if omitted.
                     'account_specific':
                         Indicate if the call is specific to the given account.
                         If yes, an account-specific directory will be used.  Defaults
@@ -3899,12 +5117,23 @@ class Api(object):
                     'attempt_number':
                         Integer which defaults to 0.  Used to retry "over capacity"
                         failures.
+                    'priority':
+                        The class the rate limiter schedules the request in:
+                        PRIORITY_INTERACTIVE, PRIORITY_NORMAL or PRIORITY_BULK,
+                        or None for a request the limiter should not meter.
+                        Defaults to PRIORITY_INTERACTIVE for POST requests and
+                        PRIORITY_NORMAL otherwise.
 
         Returns:
             A string containing the body of the response.
         '''
         cache_timeout = kw.get('cache_timeout', self._cache_timeout)
+        stale_while_revalidate = kw.get('stale_while_revalidate', self._stale_while_revalidate)
         account_specific = kw.get('account_specific', False)
+        if post_data:
+            priority = kw.get('priority', PRIORITY_INTERACTIVE)
+        else:
+            priority = kw.get('priority', PRIORITY_NORMAL)
         #print self.screen_name
         #if not cache_timeout:
         #    print '[%s][twitterlib] caching disabled for url %s' % (self.screen_name, url)
@@ -3921,28 +5150,11 @@ class Api(object):
         else:
             http_method = 'GET'
 
-        if self._debugHTTP:
-            _debug = 1
-        else:
-            _debug = 0
-
-        http_handler  = self._urllib.HTTPHandler(debuglevel=_debug)
-        https_handler = self._urllib.HTTPSHandler(debuglevel=_debug)
-
-        #opener = register_openers()
-        opener = self._urllib.OpenerDirector()
-        opener.add_handler(http_handler)
-        opener.add_handler(https_handler)
-
         if use_gzip_compression is None:
             use_gzip = self._use_gzip
         else:
             use_gzip = use_gzip_compression
 
-        # Set up compression
-        if use_gzip and not post_data:
-            opener.addheaders.append(('Accept-Encoding', 'gzip'))
-
         if self._oauth_consumer is not None:
             if post_data and http_method == 'POST':
                 parameters = post_data.copy()
@@ -3998,67 +5210,43 @@ class Api(object):
         #    print url_data
         #    #opener.close()
         #elif encoded_post_data or no_cache or not self._cache or not self._cache_timeout:
-        if encoded_post_data or not self._cache or not cache_timeout:
-            try_number = 0
-            while try_number < 2:
-                try_number += 1
-                try:
-                    response = opener.open(url, encoded_post_data)
-                    url_data = self._decompressGzippedResponse(response)
-                    opener.close()
-                    break
-                except IOError, e:
-                    print 'some kind of transport urllib2 error (ioerror), continuing on..'
-                    if try_number >= 1:
-                        raise e
-                    continue
-                except httplib.BadStatusLine, e:
-                    print 'some kind of transport urllib2 error (badstatusline), continuing on..'
-                    if try_number >= 1:
-                        raise e
-                    continue
+        # Set up compression
+        request_headers = {}
+        if use_gzip and not post_data:
+            request_headers['Accept-Encoding'] = 'gzip'
+
+        # Concurrent GETs for the same resource share a single request; the
+        # key ignores the oauth parameters, which differ on every call.
+        if encoded_post_data:
+            url_data = self._openUrl(url, encoded_post_data, request_headers, priority)
+        elif not self._cache or not cache_timeout:
+            url_data = self._single_flight.do(_CacheKey(url).cleaned,
+                self._openUrl, url, None, request_headers, priority)
         else:
-            # Unique keys are a combination of the url and the oAuth Consumer Key
-            #if self._consumer_key:
-            #    key = self._consumer_key + ':' + url
-            #else:
-            key = url
+            # Account specific responses depend on who asks, and one cache
+            # may be shared by several accounts, so their keys combine the
+            # url with the access token.  Resolve the key once; the cache
+            # layers reuse its cleaned and hashed forms instead of
+            # recomputing them on every call.
+            if account_specific and self._access_token_key:
+                key = _CacheKey('%s:%s' % (self._access_token_key, url))
+            else:
+                key = _CacheKey(url)
             # See if it has been cached before
-            last_cached = self._cache.getCachedTime(key, account_specific)
+            cached = _cacheLookup(self._cache, key, account_specific)
             # If the cached version is outdated then fetch another and store it
-            #print cache_timeout
-            if not last_cached or time.time() >= last_cached + cache_timeout:
-                try_number = 0
-                while try_number < 2:
-                    try_number += 1
-                    try:
-                        response = opener.open(url, encoded_post_data)
-                        url_data = self._decompressGzippedResponse(response)
-                        opener.close()
-                        break
-                    except IOError, e:
-                        print 'some kind of transport urllib2 error (ioerror), continuing on..'
-                        if try_number >= 1:
-                            raise e
-                        continue
-                    except httplib.BadStatusLine, e:
-                        print 'some kind of transport urllib2 error (badstatusline), continuing on..'
-                        if try_number >= 1:
-                            raise e
-                        continue
-#                    except urllib2.URLError, e:
-#                        print e
-#                        print 'continuing on..'
-#                        continue
-#                    except urllib2.SSLError, e:
-#                        print e
-#                        print 'continuing on..'
-#                        continue
-                self._cache.set(key, url_data, account_specific)
+            now = time.time()
+            if cached is None or now >= cached[1] + cache_timeout + stale_while_revalidate:
+                url_data = self._single_flight.do(key.cleaned, self._refreshCache,
+                    key, url, request_headers, account_specific, cached, priority)
+            elif now >= cached[1] + cache_timeout:
+                # Expired, but within the stale-while-revalidate window.
+                url_data = cached[0]
+                self._countCacheEvent('stale_hits')
+                self._revalidateInBackground(key, url, request_headers, account_specific, cached)
             else:
-                #print 'found in cache! ct=%s ... url= %s' % (cache_timeout, url)
-                #print 'secs remaining was %s' % (time.time() - (last_cached + cache_timeout))
-                url_data = self._cache.get(key, account_specific)
+                url_data = cached[0]
+                self._countCacheEvent('hits')
         # Always return the latest version
         #print url_data + '\n\n'
         if over_capacity_re.search(url_data):
@@ -4076,65 +5264,961 @@ class Api(object):
                 parameters=parameters,
                 use_gzip_compression=use_gzip_compression,
                 **kw)
-        #print url_data
+        return url_data
+
+    def _fetchJson(self, url, model=None, items_key=None, **kw):
+        '''
+        Fetch a URL and decode its body as JSON, in the decode pool if the
+        instance has one.
+
+        Accepts the same arguments as _fetchUrl, which should only be used
+        directly by callers that need the raw response string.
+
+        Args:
+            model:
+                A model class, such as Status or User.  If given, the items
+                of the decoded list, or of the list under items_key, are
+                replaced by model instances built from them. [Optional]
+            items_key:
+                The key of the list of items in a decoded dict. [Optional]
+
+        Returns:
+            The decoded JSON object.  Its Status and User instances are
+            lazy if the instance was set to build lazy models.
+        '''
+        url_data = self._fetchUrl(url, **kw)
         try:
-            simplejson.loads(url_data)
+            if self._decode_pool is not None:
+                return self._decode_pool.decode(url_data, model, items_key, self._lazy_models)
+            return _decodeJson(url_data, model, items_key, self._lazy_models)
         except ValueError:
             print 'Yikes, failed to parse this to json:\n%s\n--------------------------------------------' % url_data
-        return url_data
+            raise
 
-over_capacity_re = re.compile('<title>Twitter \/ Over capacity</title>', re.M)
+class ApiPool(Api):
+    '''
+    A twitter.Api that spreads its requests over several accounts.
 
-class _FileCacheError(Exception):
-    '''Base exception class for FileCache related errors'''
+    Every method of twitter.Api is available.  Each read request is sent
+    through the account with the most rate limit budget left, so a pool of
+    N accounts allows about N times the read throughput of one.  Writes
+    (POST requests) and account specific reads, such as getMentions,
+    getDirectMessages, getRetweets or getFriends for the authenticated
+    user, always use the primary account, the first one given.  A read
+    another account is not authorized to make, such as the timeline of a
+    user only the primary follows, is sent again through the primary.
 
-class _FileCache(object):
+    Each account keeps its own rate limit state and limiter; give them
+    the same cache instance so that a response fetched through one
+    account is reused by the others.
 
-    DEPTH = 3
+    Example usage:
 
-    def __init__(self, root_directory=None, screen_name=''):
-        self._screen_name = screen_name
-        self._initializeRootDirectory(root_directory)
+        >>> cache = twitter.LRUCache(twitter.SqliteCache('twitter.db'))
+        >>> pool = twitter.ApiPool([
+        ...     twitter.Api(consumer_key=k, consumer_secret=s,
+        ...                 access_token_key=tk, access_token_secret=ts,
+        ...                 cache=cache)
+        ...     for (tk, ts) in tokens])
+        >>> users = pool.usersLookup(user_id=follower_ids)
+    '''
 
-    def get(self, key, account_specific=False):
-        key = self._cleanKey(key)
-        path = self._getPath(key, account_specific)
-        if os.path.exists(path):
-            return open(path).read()
-        else:
-            return None
+    def __init__(self, apis):
+        '''
+        Args:
+            apis:
+                A sequence of authenticated twitter.Api instances, one per
+                account.  The first is the primary account.
+        '''
+        if not apis:
+            raise TwitterError('An ApiPool needs at least one twitter.Api instance')
+        self._apis = list(apis)
+        self._primary = self._apis[0]
+        # The pool makes no requests itself; every _fetchUrl is handed to
+        # one of its members.
+        Api.__init__(self,
+            screen_name=self._primary.screen_name,
+            input_encoding=self._primary._input_encoding,
+            cache=self._primary._cache,
+            base_url=self._primary.base_url,
+            use_gzip_compression=self._primary._use_gzip,
+            connection_pool=None,
+            rate_limiter=None,
+            decode_pool=self._primary._decode_pool,
+            lazy_models=self._primary._lazy_models)
+        self.setCacheTimeout(self._primary._cache_timeout)
+        self.setCredentials(self._primary._consumer_key, self._primary._consumer_secret,
+            self._primary._access_token_key, self._primary._access_token_secret)
+        self._in_flight = dict([(id(api), 0) for api in self._apis])
+        self._in_flight_lock = threading.Lock()
+
+    def getApis(self):
+        '''
+        Returns:
+            The list of twitter.Api instances in this pool, primary first.
+        '''
+        return list(self._apis)
 
-    def set(self, key, data, account_specific=False):
-       key = self._cleanKey(key)
-       path = self._getPath(key, account_specific)
-       directory = os.path.dirname(path)
-       if not os.path.exists(directory):
-           os.makedirs(directory)
-       if not os.path.isdir(directory):
-           raise _FileCacheError('%s exists but is not a directory' % directory)
-       temp_fd, temp_path = tempfile.mkstemp()
-       temp_fp = os.fdopen(temp_fd, 'w')
-       temp_fp.write(data)
-       temp_fp.close()
-       if not path.startswith(self._root_directory):
-           raise _FileCacheError('%s does not appear to live under %s' %
-               (path, self._root_directory))
-       if os.path.exists(path):
-           os.remove(path)
-       os.rename(temp_path, path)
+    def getRateLimitState(self):
+        '''
+        Return the combined rate limit state of the pool's accounts: the
+        sum of their limits and remaining hits, and the latest reset time.
+        Accounts that have not reported a limit yet are left out.
 
-    def remove(self, key, account_specific=False):
-       key = self._cleanKey(key)
-       path = self._getPath(key, account_specific)
-       if not path.startswith(self._root_directory):
-           raise _FileCacheError('%s does not appear to live under %s' %
-               (path, self._root_directory ))
+        Returns:
+            A twitter.RateLimitState instance
+        '''
+        limit = remaining = reset_time = None
+        for api in self._apis:
+            api_limit, api_remaining, api_reset_time = api.getRateLimitState().get()
+            if api_reset_time is None:
+                continue
+            limit = (limit or 0) + (api_limit or 0)
+            remaining = (remaining or 0) + (api_remaining or 0)
+            reset_time = max(reset_time, api_reset_time)
+        state = RateLimitState()
+        if reset_time is not None:
+            state.update(limit, remaining, reset_time)
+        return state
+
+    def _recordRateLimit(self, limit, remaining, reset_time):
+        # getRateLimitStatus is account specific, so it describes the primary.
+        self._primary._recordRateLimit(limit, remaining, reset_time)
+
+    def _fetchUrl(self, url, post_data=None, parameters=None, use_gzip_compression=None, **kw):
+        api = self._acquireApi(bool(post_data) or kw.get('account_specific', False))
+        try:
+            url_data = api._fetchUrl(url, post_data, parameters, use_gzip_compression, **kw)
+        finally:
+            self._releaseApi(api)
+        if api is not self._primary and not_authorized_re.search(url_data):
+            # Protected users are only visible to the accounts that follow
+            # them.  Ask as the primary, caching the answer as its own.
+            kw['account_specific'] = True
+            return self._fetchUrl(url, post_data, parameters, use_gzip_compression, **kw)
+        return url_data
+
+    def _acquireApi(self, account_specific):
+        '''
+        Choose the account for one request: the primary if the request is
+        account specific, otherwise the account with the most hits left
+        after those already in flight.
+        '''
+        self._in_flight_lock.acquire()
+        try:
+            if account_specific:
+                api = self._primary
+            else:
+                now = time.time()
+                best = None
+                for api_candidate in self._apis:
+                    score = self._getBudget(api_candidate, now) - self._in_flight[id(api_candidate)]
+                    if best is None or score > best[0]:
+                        best = (score, api_candidate)
+                api = best[1]
+            self._in_flight[id(api)] += 1
+            return api
+        finally:
+            self._in_flight_lock.release()
+
+    def _releaseApi(self, api):
+        self._in_flight_lock.acquire()
+        try:
+            self._in_flight[id(api)] -= 1
+        finally:
+            self._in_flight_lock.release()
+
+    def _getBudget(self, api, now):
+        # Accounts with no known limit, or whose limit has reset, are
+        # assumed to have their whole budget left.
+        limit, remaining, reset_time = api.getRateLimitState().get()
+        if reset_time is None or reset_time <= now:
+            return limit or sys.maxint
+        return remaining
+
+class ThreadedApi(object):
+    '''
+    A thread-pool adapter that runs the calls of a twitter.Api on worker
+    threads.
+
+    Every method of twitter.Api that talks to Twitter is available, takes
+    the same arguments, and returns a twitter.Future for its result.  The
+    I/O is not asynchronous: each call is the blocking twitter.Api method,
+    run on one of a bounded pool of worker threads, so at most max_workers
+    calls are in flight and each one occupies a thread while it waits.
+    Local accessors (the set*, clear* and iter* methods, getCacheStatistics
+    and the like) are passed straight through.
+
+    The calls share the wrapped Api's OAuth credentials, cache, connection
+    pool and rate limiter, so many requests can be in flight at once
+    without going over the rate limit or fetching a cached URL twice.
+
+    Example usage:
+
+        >>> api = twitter.ThreadedApi(twitter.Api(consumer_key=..., ...), max_workers=100)
+        >>> futures = [api.getUserTimeline(name) for name in screen_names]
+        >>> timelines = [future.get() for future in futures]
+    '''
+
+    DEFAULT_MAX_WORKERS = 32
+
+    # Methods that answer from local state and never block on Twitter.
+    _LOCAL_METHODS = set([
+        'getCacheStatistics',
+        'getRateLimitState',
+        'getSchedulerMetrics',
+        'getApis',
+    ])
+
+    def __init__(self, api=None, max_workers=None, **kw):
+        '''
+        Args:
+            api:
+                The twitter.Api (or twitter.ApiPool) to make the calls
+                through.  If None, one is created from the remaining
+                keyword arguments. [Optional]
+            max_workers:
+                The most calls to run at once.  Defaults to
+                ThreadedApi.DEFAULT_MAX_WORKERS. [Optional]
+        '''
+        if api is None:
+            api = Api(**kw)
+        if max_workers is None:
+            max_workers = ThreadedApi.DEFAULT_MAX_WORKERS
+        self._api = api
+        self._pool = _ThreadPool(max_workers)
+
+    def getApi(self):
+        '''
+        Returns:
+            The blocking twitter.Api the calls are made through.
+        '''
+        return self._api
+
+    def submit(self, function, *args, **kw):
+        '''
+        Run any callable on the worker pool, e.g. a function making several
+        dependent calls on getApi().
+
+        Returns:
+            A twitter.Future for the callable's result.
+        '''
+        return self._pool.submit(function, *args, **kw)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._api, name)
+        if (name.startswith('_') or not callable(attribute)
+            or name.startswith('set') or name.startswith('clear')
+            or name.startswith('iter') or name in ThreadedApi._LOCAL_METHODS):
+            return attribute
+
+        def call(*args, **kw):
+            return self._pool.submit(attribute, *args, **kw)
+        call.__name__ = name
+        call.__doc__ = attribute.__doc__
+        return call
+
+class _SearchResult(object):
+    '''
+    Builds a twitter.Status from an item of a search.json response, whose
+    author comes as from_user and profile_image_url instead of a nested
+    user.  Serves as the model of Api.getSearch's _fetchJson call.
+    '''
+
+    @staticmethod
+    def newFromJsonDict(data, lazy=False):
+        status = Status.newFromJsonDict(data, lazy=lazy)
+        status.user = User(screen_name=data['from_user'],
+            profile_image_url=data['profile_image_url'])
+        return status
+
+def _getModelFactory(model, lazy=False):
+    '''Return the callable building an instance of model from a JSON dict.'''
+    if lazy and model in (Status, User, _SearchResult):
+        return lambda x: model.newFromJsonDict(x, lazy=True)
+    return model.newFromJsonDict
+
+def _decodeJson(data, model=None, items_key=None, lazy=False):
+    '''
+    Decode a JSON response body, building model instances from its items
+    if model is given.  See Api._fetchJson.  This runs in the worker
+    processes of a DecodePool, so it must stay a module level function.
+    '''
+    data = simplejson.loads(data)
+    if isinstance(data, dict) and 'error' in data:
+        # Leave the error for _checkForTwitterError; there is nothing to build.
+        return data
+    if model is not None:
+        newFromJsonDict = _getModelFactory(model, lazy)
+        if items_key is None and isinstance(data, list):
+            data = [newFromJsonDict(x) for x in data]
+        elif items_key is not None and isinstance(data, dict) and items_key in data:
+            data[items_key] = [newFromJsonDict(x) for x in data[items_key]]
+    return data
+
+
+class DecodePool(object):
+    '''
+    A pool of worker processes that decode large JSON responses and build
+    their models, so that parsing a crawl scales with CPU cores instead of
+    running on the GIL-bound threads that fetch it.
+
+    The calling thread waits for its result without holding the GIL, so
+    other threads keep fetching meanwhile.  Small bodies are decoded in
+    place, since shipping them to a worker costs more than it saves.
+
+    Example usage:
+
+        >>> api = twitter.Api(decode_pool=twitter.DecodePool(processes=16))
+    '''
+
+    DEFAULT_MIN_SIZE = 32 * 1024
+
+    def __init__(self, processes=None, min_size=None):
+        '''
+        Args:
+            processes:
+                The number of worker processes.  Defaults to the number of
+                CPUs. [Optional]
+            min_size:
+                The smallest body, in bytes, that is sent to a worker.
+                Defaults to DecodePool.DEFAULT_MIN_SIZE. [Optional]
+        '''
+        if min_size is None:
+            min_size = DecodePool.DEFAULT_MIN_SIZE
+        self.processes = processes
+        self.min_size = min_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def decode(self, data, model=None, items_key=None, lazy=False):
+        '''
+        Decode a JSON response body.  See Api._fetchJson for the meaning of
+        model, items_key and lazy; models are built in the worker and
+        pickled back.
+
+        Returns:
+            The decoded JSON object.
+        '''
+        if len(data) < self.min_size:
+            return _decodeJson(data, model, items_key, lazy)
+        return self._getPool().apply(_decodeJson, (data, model, items_key, lazy))
+
+    def close(self):
+        '''Stop the worker processes.  The pool restarts them if used again.'''
+        self._lock.acquire()
+        try:
+            pool, self._pool = self._pool, None
+        finally:
+            self._lock.release()
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _getPool(self):
+        self._lock.acquire()
+        try:
+            if self._pool is None:
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+        finally:
+            self._lock.release()
+
+over_capacity_re = re.compile('<title>Twitter \/ Over capacity</title>', re.M)
+not_authorized_re = re.compile(r'"error"\s*:\s*"Not authorized')
+
+def _cleanCacheKey(key):
+    """Remove oauth parameters since they don't change query output."""
+    qmark_idx = key.find('?') + 1
+    if not qmark_idx:
+        return key
+    parsed = urlparse.parse_qs(key[qmark_idx:], keep_blank_values=False)
+    cleaned = []
+    for k in parsed:
+        if k[0:6].lower() != 'oauth_':
+            cleaned.append('%s=%s' % (k, parsed[k][0]))
+    return '%s%s' % (key[0:qmark_idx], '&'.join(cleaned))
+
+# Marks a cached value stored zlib-compressed.  JSON and HTML bodies never
+# start with a NUL byte, so entries written without it still read as-is.
+_COMPRESSED_CACHE_HEADER = '\x00zlib:'
+
+def _compressCacheValue(data, level):
+    '''Compress data for storage, unless level is None.'''
+    if level is None:
+        return data
+    return _COMPRESSED_CACHE_HEADER + zlib.compress(data, level)
+
+def _decompressCacheValue(data):
+    '''Undo _compressCacheValue, passing uncompressed entries through.'''
+    if data is not None and data.startswith(_COMPRESSED_CACHE_HEADER):
+        return zlib.decompress(data[len(_COMPRESSED_CACHE_HEADER):])
+    return data
+
+# Marks a cached value prefixed by a line of JSON holding its HTTP validators.
+_VALIDATORS_CACHE_HEADER = '\x00meta:'
+
+def _encodeCacheValue(data, level, validators=None):
+    '''Prepare data for storage, compressing it and prefixing any validators.'''
+    data = _compressCacheValue(data, level)
+    if validators:
+        data = '%s%s\n%s' % (_VALIDATORS_CACHE_HEADER, simplejson.dumps(validators), data)
+    return data
+
+def _decodeCacheValue(data):
+    '''
+    Undo _encodeCacheValue.
+
+    Returns:
+        A (data, validators) tuple; validators is None if none were stored.
+    '''
+    validators = None
+    if data is not None and data.startswith(_VALIDATORS_CACHE_HEADER):
+        end = data.index('\n')
+        validators = simplejson.loads(data[len(_VALIDATORS_CACHE_HEADER):end])
+        data = data[end + 1:]
+    return _decompressCacheValue(data), validators
+
+class _CacheKey(str):
+    '''
+    A cache key that remembers its cleaned and hashed forms, so that they
+    are computed at most once however many cache layers look at it.
+
+    It is still the original key string, so caches that only know about
+    plain strings keep working.
+    '''
+
+    def __new__(cls, key):
+        if isinstance(key, _CacheKey):
+            return key
+        return str.__new__(cls, key)
+
+    @property
+    def cleaned(self):
+        '''The key with its oauth parameters removed.'''
+        try:
+            return self._cleaned
+        except AttributeError:
+            self._cleaned = _cleanCacheKey(self)
+            return self._cleaned
+
+    @property
+    def hashed(self):
+        '''The md5 hex digest of the cleaned key.'''
+        try:
+            return self._hashed
+        except AttributeError:
+            try:
+                self._hashed = md5(self.cleaned).hexdigest()
+            except TypeError:
+                self._hashed = md5.new(self.cleaned).hexdigest()
+            return self._hashed
+
+def _cacheLookup(cache, key, account_specific=False):
+    '''
+    Return a (data, cached_time) tuple for key, or None on a miss.
+
+    Uses the cache's own lookup() when it has one, and falls back to
+    getCachedTime() followed by get() for caches that do not.
+    '''
+    lookup = getattr(cache, 'lookup', None)
+    if lookup is not None:
+        return lookup(key, account_specific)
+    cached_time = cache.getCachedTime(key, account_specific)
+    if not cached_time:
+        return None
+    data = cache.get(key, account_specific)
+    if data is None:
+        return None
+    return data, cached_time
+
+class _SingleFlight(object):
+    '''
+    Collapses concurrent calls that share a key into one: the first caller
+    runs the function while the others wait for it and then share its
+    result, or re-raise its exception.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function, *args):
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        finally:
+            self._lock.release()
+
+        if not leader:
+            return call.get()
+
+        try:
+            try:
+                call.result = function(*args)
+            except:
+                call.error = sys.exc_info()
+                raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.done.set()
+        return call.result
+
+class Future(object):
+    '''
+    The result of a call that is running, or has run, on another thread,
+    as returned by the methods of twitter.ThreadedApi.
+    '''
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def run(self, function, *args, **kw):
+        '''Call function, recording its result or exception, and mark done.'''
+        try:
+            try:
+                self.result = function(*args, **kw)
+            except:
+                self.error = sys.exc_info()
+        finally:
+            self._lock.acquire()
+            try:
+                self.done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            finally:
+                self._lock.release()
+            for callback in callbacks:
+                callback(self)
+
+    def isDone(self):
+        '''Returns True once the call has finished.'''
+        return self.done.isSet()
+
+    def get(self, timeout=None):
+        '''
+        Wait for the call to finish and return its result, or re-raise its
+        exception.
+
+        Args:
+            timeout:
+                The most seconds to wait.  Defaults to None, waiting as
+                long as needed. [Optional]
+
+        Raises:
+            TwitterError if the call has not finished within timeout.
+        '''
+        if not self.done.wait(timeout):
+            raise TwitterError('Timed out waiting for the result')
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.result
+
+    def addCallback(self, callback):
+        '''
+        Arrange for callback to be called with this Future once the call
+        finishes, or at once if it already has.  Callbacks run on the
+        thread that made the call, so they should be quick.
+        '''
+        self._lock.acquire()
+        try:
+            if not self.done.isSet():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+        callback(self)
+
+
+class _ThreadPool(object):
+    '''
+    A bounded pool of daemon worker threads, which are started as work
+    arrives and then kept waiting for more.  A new worker is started
+    whenever more calls are queued than there are idle workers to take
+    them, up to max_workers.
+    '''
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._work = Queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0
+        self._pending = 0
+
+    def submit(self, function, *args, **kw):
+        '''Queue a call of function and return the Future of its result.'''
+        future = Future()
+        self._lock.acquire()
+        try:
+            self._work.put((future, function, args, kw))
+            self._pending += 1
+            start = self._pending > self._idle and self._workers < self.max_workers
+            if start:
+                self._workers += 1
+        finally:
+            self._lock.release()
+        if start:
+            thread = threading.Thread(target=self._work_loop)
+            thread.setDaemon(True)
+            thread.start()
+        return future
+
+    def shutdown(self, cancel=False):
+        '''
+        Let each worker exit once the work queued so far is done, or if
+        cancel is True, once its current call is done; the Futures of
+        dropped calls then never finish.
+        '''
+        if cancel:
+            while True:
+                try:
+                    item = self._work.get_nowait()
+                except Queue.Empty:
+                    break
+                self._lock.acquire()
+                self._pending -= 1
+                self._lock.release()
+        self._lock.acquire()
+        try:
+            workers, self._workers = self._workers, 0
+        finally:
+            self._lock.release()
+        for i in xrange(workers):
+            self._work.put(None)
+
+    def _work_loop(self):
+        while True:
+            self._lock.acquire()
+            self._idle += 1
+            self._lock.release()
+            item = self._work.get()
+            self._lock.acquire()
+            self._idle -= 1
+            if item is not None:
+                self._pending -= 1
+            self._lock.release()
+            if item is None:
+                return
+            future, function, args, kw = item
+            future.run(function, *args, **kw)
+
+def _mapConcurrently(function, arguments, max_workers):
+    '''
+    Start calling function once for each of arguments, on at most
+    max_workers daemon threads, and return a list of Futures holding the
+    results in the same order as arguments.
+    '''
+    futures = [Future() for argument in arguments]
+    work = iter(zip(futures, arguments))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            lock.acquire()
+            try:
+                item = next(work, None)
+            finally:
+                lock.release()
+            if item is None:
+                return
+            item[0].run(function, item[1])
+
+    for i in xrange(min(max_workers, len(arguments))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+    return futures
+
+def _readPages(fetch_page, cursor):
+    '''Yield the decoded JSON of each page of a cursored resource in turn.'''
+    while cursor:
+        data = fetch_page(cursor)
+        yield data
+        cursor = data.get('next_cursor', 0)
+
+def _prefetchPages(fetch_page, cursor, depth):
+    '''
+    Yield the decoded JSON of each page of a cursored resource, fetching
+    pages on a background thread.  The request for the next page is made
+    as soon as its cursor is known, so it overlaps with whatever the caller
+    does with the current one; at most depth fetched pages are held waiting
+    for the caller.
+
+    Errors raised while fetching are re-raised to the caller in place of
+    the page that failed.  Closing the generator stops the fetching thread
+    once its current request finishes.
+    '''
+    pages = Queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.isSet():
+            try:
+                pages.put(item, True, 0.1)
+                return
+            except Queue.Full:
+                pass
+
+    def fetch(cursor):
+        try:
+            while cursor and not stopped.isSet():
+                data = fetch_page(cursor)
+                put((data, None))
+                cursor = data.get('next_cursor', 0)
+            put((None, None))
+        except:
+            put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=fetch, args=(cursor,))
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        while True:
+            data, error = pages.get()
+            if error is not None:
+                raise error[0], error[1], error[2]
+            if data is None:
+                return
+            yield data
+    finally:
+        stopped.set()
+
+def _getUsername():
+    '''Attempt to find the username in a cross-platform fashion.'''
+    try:
+        return os.getenv('USER') or \
+            os.getenv('LOGNAME') or \
+            os.getenv('USERNAME') or \
+            os.getlogin() or \
+            'nobody'
+    except (IOError, OSError), e:
+        return 'nobody'
+
+class _FileCacheError(Exception):
+    '''Base exception class for FileCache related errors'''
+
+class _BoundedCache(object):
+    '''
+    Base class for cache backends that evict entries by age, entry count
+    and total size.
+
+    Bounds left as None are not enforced, so a backend built with the
+    defaults never deletes anything.  Every gc_interval calls to set(), the
+    backend spends at most gc_time_slice seconds evicting entries in its
+    _collectGarbage(deadline); its prune() enforces the bounds fully in one
+    pass.
+    '''
+
+    DEFAULT_GC_INTERVAL = 100
+    DEFAULT_GC_TIME_SLICE = 0.05
+
+    def _initializeEviction(self,
+        max_bytes=None,
+        max_entries=None,
+        max_age=None,
+        gc_interval=None,
+        gc_time_slice=None):
+        if gc_interval is None:
+            gc_interval = _BoundedCache.DEFAULT_GC_INTERVAL
+        if gc_time_slice is None:
+            gc_time_slice = _BoundedCache.DEFAULT_GC_TIME_SLICE
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._gc_interval = gc_interval
+        self._gc_time_slice = gc_time_slice
+        self._gc_countdown = gc_interval
+
+    def _isBounded(self):
+        return self.max_bytes is not None or \
+            self.max_entries is not None or \
+            self.max_age is not None
+
+    def _maybeCollectGarbage(self):
+        '''Run one bounded garbage collection slice every gc_interval calls.'''
+        if not self._isBounded():
+            return
+        self._gc_countdown -= 1
+        if self._gc_countdown > 0:
+            return
+        self._gc_countdown = self._gc_interval
+        self._collectGarbage(time.time() + self._gc_time_slice)
+
+    def _mustEvict(self, cached_time, count, size, now, max_entries, max_bytes):
+        '''
+        Whether the oldest of count entries, totalling size bytes, must go.
+        '''
+        if self.max_age is not None and now - cached_time > self.max_age:
+            return True
+        if max_entries is not None and count > max_entries:
+            return True
+        if max_bytes is not None and size > max_bytes:
+            return True
+        return False
+
+    def _selectEvictions(self, entries, max_entries, max_bytes, now=None):
+        '''
+        Args:
+            entries:
+                A list of (cached_time, size, handle) tuples.
+            max_entries:
+                The entry count to shrink the list to, or None.
+            max_bytes:
+                The total size to shrink the list to, or None.
+
+        Returns:
+            The handles of the entries to remove, oldest first.
+        '''
+        if now is None:
+            now = time.time()
+        entries = sorted(entries, key=lambda entry: entry[0])
+        count = len(entries)
+        size = sum([entry[1] for entry in entries])
+        evicted = []
+        for cached_time, entry_size, handle in entries:
+            if not self._mustEvict(cached_time, count, size, now, max_entries, max_bytes):
+                break
+            evicted.append(handle)
+            count -= 1
+            size -= entry_size
+        return evicted
+
+
+class _FileCache(_BoundedCache):
+
+    DEPTH = 3
+
+    def __init__(self,
+        root_directory=None,
+        screen_name='',
+        max_bytes=None,
+        max_entries=None,
+        max_age=None,
+        gc_interval=None,
+        gc_time_slice=None,
+        compression_level=None):
+        '''
+        Args:
+            root_directory:
+                The directory to store cached responses in.  Defaults to
+                python.cache_<user> in the system temporary directory. [Optional]
+            screen_name:
+                The subdirectory used for account specific entries. [Optional]
+            max_bytes:
+                The maximum total size of the cached bodies. [Optional]
+            max_entries:
+                The maximum number of cached responses. [Optional]
+            max_age:
+                Time, in seconds, after which an entry is deleted. [Optional]
+            gc_interval:
+                The number of set() calls between garbage collection slices.
+                Defaults to _BoundedCache.DEFAULT_GC_INTERVAL. [Optional]
+            gc_time_slice:
+                The maximum number of seconds spent in one garbage collection
+                slice.  Defaults to _BoundedCache.DEFAULT_GC_TIME_SLICE. [Optional]
+            compression_level:
+                If set, bodies are stored zlib-compressed at this level (1-9).
+                Entries are read back whichever way they were stored.
+                Defaults to None, storing bodies uncompressed. [Optional]
+        '''
+        self._screen_name = screen_name
+        self._compression_level = compression_level
+        self._initializeRootDirectory(root_directory)
+        self._initializeEviction(max_bytes, max_entries, max_age, gc_interval, gc_time_slice)
+        self._gc_lock = threading.Lock()
+        self._gc_buckets = None
+        self._gc_position = 0
+        self._gc_stats = {}
+        self._gc_totals = [0, 0]
+        self._gc_carry = (0, 0)
+
+    def get(self, key, account_specific=False):
+        path = self._getPath(key, account_specific)
+        if os.path.exists(path):
+            return _decodeCacheValue(open(path, 'rb').read())[0]
+        else:
+            return None
+
+    def lookup(self, key, account_specific=False):
+        '''
+        Return a (data, cached_time) tuple for key, or None on a miss.
+        Equivalent to getCachedTime() followed by get(), with one open().
+        '''
+        path = self._getPath(key, account_specific)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            cached_time = os.fstat(fp.fileno()).st_mtime
+            return _decodeCacheValue(fp.read())[0], cached_time
+        finally:
+            fp.close()
+
+    def getValidators(self, key, account_specific=False):
+        '''
+        Return the HTTP validators stored with key, or None.  Only the
+        header record at the start of the file is read, not the body.
+        '''
+        path = self._getPath(key, account_specific)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            if fp.read(len(_VALIDATORS_CACHE_HEADER)) != _VALIDATORS_CACHE_HEADER:
+                return None
+            return simplejson.loads(fp.readline())
+        finally:
+            fp.close()
+
+    def touch(self, key, account_specific=False):
+        '''Mark the entry for key as cached now, keeping its body.'''
+        try:
+            os.utime(self._getPath(key, account_specific), None)
+        except OSError:
+            pass
+
+    def set(self, key, data, account_specific=False, validators=None):
+       path = self._getPath(key, account_specific)
+       directory = os.path.dirname(path)
+       if not os.path.exists(directory):
+           os.makedirs(directory)
+       if not os.path.isdir(directory):
+           raise _FileCacheError('%s exists but is not a directory' % directory)
+       temp_fd, temp_path = tempfile.mkstemp()
+       temp_fp = os.fdopen(temp_fd, 'wb')
+       temp_fp.write(_encodeCacheValue(data, self._compression_level, validators))
+       temp_fp.close()
+       if not path.startswith(self._root_directory):
+           raise _FileCacheError('%s does not appear to live under %s' %
+               (path, self._root_directory))
+       if os.path.exists(path):
+           os.remove(path)
+       os.rename(temp_path, path)
+       self._maybeCollectGarbage()
+
+    def remove(self, key, account_specific=False):
+       path = self._getPath(key, account_specific)
+       if not path.startswith(self._root_directory):
+           raise _FileCacheError('%s does not appear to live under %s' %
+               (path, self._root_directory ))
        if os.path.exists(path):
            os.remove(path)
 
     def getCachedTime(self, key, account_specific=False):
-        key = self._cleanKey(key)
-        #print '[DEBUG] %s' % key
         path = self._getPath(key, account_specific)
         if os.path.exists(path):
             return os.path.getmtime(path)
@@ -4142,21 +6226,10 @@ class _FileCache(object):
             return None
 
     def _cleanKey(self, key):
-        """Remove oauth parameters since they don't change query output."""
-        qmark_idx = key.find('?') + 1
-        parsed = urlparse.parse_qs(key[qmark_idx:], keep_blank_values=False)
-        cleaned = []
-        for k in parsed:
-            if k[0:6].lower() != 'oauth_':
-                cleaned.append('%s=%s' % (k, parsed[k][0]))
-        return '%s%s' % (key[0:qmark_idx], '&'.join(cleaned))
+        return _CacheKey(key).cleaned
 
     def _getPath(self, key, account_specific):
-        key = self._cleanKey(key)
-        try:
-            hashed_key = md5(key).hexdigest()
-        except TypeError:
-            hashed_key = md5.new(key).hexdigest()
+        hashed_key = _CacheKey(key).hashed
 
         if account_specific:
             root_dir = self._account_root_directory
@@ -4171,16 +6244,130 @@ class _FileCache(object):
     def _getPrefix(self, hashed_key):
         return os.path.sep.join(hashed_key[0:_FileCache.DEPTH])
 
-    def _getUsername(self):
-        '''Attempt to find the username in a cross-platform fashion.'''
+    def prune(self):
+        '''
+        Remove every entry needed to bring the cache within its bounds.
+
+        Returns:
+            The number of entries removed.
+        '''
+        self._gc_lock.acquire()
+        try:
+            entries = []
+            for bucket in self._getBuckets():
+                entries.extend(self._scanBucket(bucket))
+            evicted = self._selectEvictions(entries, self.max_entries, self.max_bytes)
+            for path in evicted:
+                self._removePath(path)
+            self._gc_stats = {}
+            self._gc_totals = [0, 0]
+            self._gc_carry = (0, 0)
+            return len(evicted)
+        finally:
+            self._gc_lock.release()
+
+    def _collectGarbage(self, deadline):
+        # The estimates below are shared with prune(); a slice that finds
+        # another collection running just skips its turn.
+        if not self._gc_lock.acquire(False):
+            return
         try:
-            return os.getenv('USER') or \
-                os.getenv('LOGNAME') or \
-                os.getenv('USERNAME') or \
-                os.getlogin() or \
-                'nobody'
-        except (IOError, OSError), e:
-            return 'nobody'
+            self._collectBuckets(deadline)
+        finally:
+            self._gc_lock.release()
+
+    def _collectBuckets(self, deadline):
+        # Called with self._gc_lock held.
+        buckets = self._getBuckets()
+        now = time.time()
+        # Never visit the same bucket twice in one slice.
+        for i in xrange(len(buckets)):
+            if time.time() >= deadline:
+                break
+            bucket = buckets[self._gc_position]
+            self._gc_position = (self._gc_position + 1) % len(buckets)
+            entries = self._scanBucket(bucket)
+            # md5 spreads keys evenly over the buckets, so the totals seen so
+            # far extrapolate to the whole cache.  When that estimate is over
+            # a bound, each bucket keeps the same fraction of its entries,
+            # carrying the rounding over to the next bucket.
+            self._recordBucketStats(bucket, entries)
+            scale = float(len(buckets)) / len(self._gc_stats)
+            ratio = 1.0
+            if self.max_entries is not None and self._gc_totals[0]:
+                ratio = min(ratio, self.max_entries / (self._gc_totals[0] * scale))
+            if self.max_bytes is not None and self._gc_totals[1]:
+                ratio = min(ratio, self.max_bytes / (self._gc_totals[1] * scale))
+            max_entries = max_bytes = None
+            if ratio < 1.0 and entries:
+                size = sum([entry[1] for entry in entries])
+                max_entries = len(entries) * ratio + self._gc_carry[0]
+                max_bytes = size * ratio + self._gc_carry[1]
+            evicted = set(self._selectEvictions(entries, max_entries, max_bytes, now))
+            if evicted:
+                for path in evicted:
+                    self._removePath(path)
+                kept = [entry for entry in entries if entry[2] not in evicted]
+                self._recordBucketStats(bucket, kept)
+            else:
+                kept = entries
+            if max_entries is not None:
+                # Carry at most one average entry's worth of allowance.
+                self._gc_carry = (
+                    min(max_entries - len(kept), 1.0),
+                    min(max_bytes - sum([entry[1] for entry in kept]), float(size) / len(entries)))
+
+    def _recordBucketStats(self, bucket, entries):
+        count, size = self._gc_stats.get(bucket, (0, 0))
+        self._gc_totals[0] -= count
+        self._gc_totals[1] -= size
+        count = len(entries)
+        size = sum([entry[1] for entry in entries])
+        self._gc_stats[bucket] = (count, size)
+        self._gc_totals[0] += count
+        self._gc_totals[1] += size
+
+    def _getBuckets(self):
+        '''Return every leaf directory that cached files can live in.'''
+        if self._gc_buckets is None:
+            roots = [self._root_directory]
+            account_root_directory = os.path.normpath(self._account_root_directory)
+            if account_root_directory != self._root_directory:
+                roots.append(account_root_directory)
+            buckets = []
+            for root in roots:
+                for prefix in itertools.product('0123456789abcdef', repeat=_FileCache.DEPTH):
+                    buckets.append(os.path.join(root, *prefix))
+            self._gc_buckets = buckets
+        return self._gc_buckets
+
+    def _scanBucket(self, bucket):
+        '''Return a (mtime, size, path) tuple for each file in bucket.'''
+        try:
+            names = os.listdir(bucket)
+        except OSError:
+            return []
+        entries = []
+        for name in names:
+            path = os.path.join(bucket, name)
+            try:
+                path_stat = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(path_stat.st_mode):
+                continue
+            entries.append((path_stat.st_mtime, path_stat.st_size, path))
+        return entries
+
+    def _removePath(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process or thread.
+            pass
+
+    def _getUsername(self):
+        return _getUsername()
 
     def _getTmpCachePath(self):
         username = self._getUsername()
@@ -4203,3 +6390,1051 @@ class _FileCache(object):
         if not os.path.isdir(self._account_root_directory):
             raise _FileCacheError('%s exists but is not a directory' % self._account_root_directory)
 
+
+
+class SqliteCache(_BoundedCache):
+    '''
+    A cache backed by a single SQLite database, usable anywhere a
+    twitter._FileCache is.
+
+    Every response lives in one row of one file instead of one file per
+    response, so large crawls do not exhaust inodes and can be cleaned up
+    with a single SQL statement.  The database runs in WAL mode and writes
+    are committed in batches: after batch_size pending writes or
+    commit_interval seconds, whichever comes first.  A timer commits the
+    batch once commit_interval has passed, so the write transaction is never
+    held open longer than that waiting for another write.  Uncommitted
+    writes are visible to this instance straight away; call flush() or
+    close() to make them durable at once.
+
+    Example usage:
+
+        >>> api = twitter.Api(cache=twitter.SqliteCache('/var/cache/twitter.db'))
+    '''
+
+    DEFAULT_BATCH_SIZE = 100
+    DEFAULT_COMMIT_INTERVAL = 5
+    GC_CHUNK_SIZE = 500
+
+    def __init__(self,
+        path=None,
+        screen_name='',
+        batch_size=None,
+        commit_interval=None,
+        max_bytes=None,
+        max_entries=None,
+        max_age=None,
+        gc_interval=None,
+        gc_time_slice=None,
+        compression_level=None):
+        '''
+        Args:
+            path:
+                The database file.  Defaults to python.cache_<user>.sqlite
+                in the system temporary directory. [Optional]
+            screen_name:
+                The namespace used for account specific entries. [Optional]
+            batch_size:
+                The number of writes to accumulate before committing.
+                Defaults to SqliteCache.DEFAULT_BATCH_SIZE. [Optional]
+            commit_interval:
+                The maximum number of seconds a write may stay uncommitted.
+                Defaults to SqliteCache.DEFAULT_COMMIT_INTERVAL. [Optional]
+            max_bytes, max_entries, max_age, gc_interval, gc_time_slice:
+                Eviction bounds, as for twitter._FileCache. [Optional]
+            compression_level:
+                Body compression, as for twitter._FileCache. [Optional]
+        '''
+        if sqlite3 is None:
+            raise ImportError, "SqliteCache requires the sqlite3 module"
+        if path is None:
+            path = os.path.join(tempfile.gettempdir(),
+                'python.cache_%s.sqlite' % _getUsername())
+        if batch_size is None:
+            batch_size = SqliteCache.DEFAULT_BATCH_SIZE
+        if commit_interval is None:
+            commit_interval = SqliteCache.DEFAULT_COMMIT_INTERVAL
+        self._path = os.path.abspath(path)
+        self._screen_name = screen_name
+        self._compression_level = compression_level
+        self._batch_size = batch_size
+        self._commit_interval = commit_interval
+        self._pending = 0
+        self._last_commit = time.time()
+        self._commit_timer = None
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self._path, check_same_thread=False)
+        self._connection.text_factory = str
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            '  namespace TEXT NOT NULL,'
+            '  key TEXT NOT NULL,'
+            '  body BLOB NOT NULL,'
+            '  fetched_at REAL NOT NULL,'
+            '  size INTEGER NOT NULL,'
+            '  PRIMARY KEY (namespace, key))')
+        columns = [row[1] for row in
+            self._connection.execute('PRAGMA table_info(cache)').fetchall()]
+        for column in ('etag', 'last_modified'):
+            if column not in columns:
+                self._connection.execute('ALTER TABLE cache ADD COLUMN %s TEXT' % column)
+        self._connection.execute(
+            'CREATE INDEX IF NOT EXISTS cache_fetched_at ON cache (fetched_at)')
+        self._connection.commit()
+        self._initializeEviction(max_bytes, max_entries, max_age, gc_interval, gc_time_slice)
+        # Running (count, bytes) totals, computed on the first collection.
+        self._totals = None
+
+    def get(self, key, account_specific=False):
+        entry = self.lookup(key, account_specific)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def lookup(self, key, account_specific=False):
+        row = self._queryOne(
+            'SELECT body, fetched_at FROM cache WHERE namespace = ? AND key = ?',
+            (self._getNamespace(account_specific), _CacheKey(key).cleaned))
+        if row is None:
+            return None
+        return _decompressCacheValue(str(row[0])), row[1]
+
+    def set(self, key, data, account_specific=False, validators=None):
+        where = (self._getNamespace(account_specific), _CacheKey(key).cleaned)
+        data = _compressCacheValue(data, self._compression_level)
+        if validators is None:
+            validators = {}
+        self._lock.acquire()
+        try:
+            self._adjustTotals(where, 1, len(data))
+            self._connection.execute(
+                'INSERT OR REPLACE INTO cache '
+                '(namespace, key, body, fetched_at, size, etag, last_modified) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                where + (sqlite3.Binary(data), time.time(), len(data),
+                    validators.get('ETag'), validators.get('Last-Modified')))
+            self._noteWrite()
+        finally:
+            self._lock.release()
+        self._maybeCollectGarbage()
+
+    def getValidators(self, key, account_specific=False):
+        '''Return the HTTP validators stored with key, or None.'''
+        row = self._queryOne(
+            'SELECT etag, last_modified FROM cache WHERE namespace = ? AND key = ?',
+            (self._getNamespace(account_specific), _CacheKey(key).cleaned))
+        if row is None:
+            return None
+        validators = {}
+        if row[0]:
+            validators['ETag'] = row[0]
+        if row[1]:
+            validators['Last-Modified'] = row[1]
+        return validators
+
+    def touch(self, key, account_specific=False):
+        '''Mark the entry for key as cached now, keeping its body.'''
+        self._lock.acquire()
+        try:
+            self._connection.execute(
+                'UPDATE cache SET fetched_at = ? WHERE namespace = ? AND key = ?',
+                (time.time(), self._getNamespace(account_specific), _CacheKey(key).cleaned))
+            self._noteWrite()
+        finally:
+            self._lock.release()
+
+    def remove(self, key, account_specific=False):
+        where = (self._getNamespace(account_specific), _CacheKey(key).cleaned)
+        self._lock.acquire()
+        try:
+            self._adjustTotals(where, 0, 0)
+            self._connection.execute(
+                'DELETE FROM cache WHERE namespace = ? AND key = ?', where)
+            self._noteWrite()
+        finally:
+            self._lock.release()
+
+    def getCachedTime(self, key, account_specific=False):
+        row = self._queryOne(
+            'SELECT fetched_at FROM cache WHERE namespace = ? AND key = ?',
+            (self._getNamespace(account_specific), _CacheKey(key).cleaned))
+        if row is None:
+            return None
+        return row[0]
+
+    def flush(self):
+        '''Commit any pending writes.'''
+        self._lock.acquire()
+        try:
+            self._commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        '''Commit any pending writes and close the database.'''
+        self._lock.acquire()
+        try:
+            self._commit()
+            self._connection.close()
+        finally:
+            self._lock.release()
+
+    def _queryOne(self, sql, parameters):
+        self._lock.acquire()
+        try:
+            return self._connection.execute(sql, parameters).fetchone()
+        finally:
+            self._lock.release()
+
+    def prune(self):
+        '''
+        Remove every entry needed to bring the cache within its bounds.
+
+        Returns:
+            The number of entries removed.
+        '''
+        self._lock.acquire()
+        try:
+            rows = self._connection.execute(
+                'SELECT fetched_at, size, rowid FROM cache').fetchall()
+            evicted = self._selectEvictions(rows, self.max_entries, self.max_bytes)
+            self._connection.executemany('DELETE FROM cache WHERE rowid = ?',
+                [(rowid,) for rowid in evicted])
+            self._commit(force=True)
+            self._totals = None
+            return len(evicted)
+        finally:
+            self._lock.release()
+
+    def compact(self):
+        '''
+        Prune the cache, then reclaim the space freed in the database file.
+
+        Returns:
+            The number of entries removed.
+        '''
+        removed = self.prune()
+        self._lock.acquire()
+        try:
+            self._connection.execute('VACUUM')
+            self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            self._lock.release()
+        return removed
+
+    def _collectGarbage(self, deadline):
+        self._lock.acquire()
+        try:
+            if self._totals is None:
+                count, size = self._connection.execute(
+                    'SELECT COUNT(*), TOTAL(size) FROM cache').fetchone()
+                self._totals = [count, size]
+            now = time.time()
+            # Walk the oldest entries in chunks, stopping at the first one
+            # that may stay: everything after it is newer.
+            while time.time() < deadline:
+                rows = self._connection.execute(
+                    'SELECT rowid, fetched_at, size FROM cache '
+                    'ORDER BY fetched_at LIMIT ?', (SqliteCache.GC_CHUNK_SIZE,)).fetchall()
+                evicted = []
+                for rowid, fetched_at, size in rows:
+                    if not self._mustEvict(fetched_at, self._totals[0], self._totals[1],
+                        now, self.max_entries, self.max_bytes):
+                        break
+                    evicted.append((rowid,))
+                    self._totals[0] -= 1
+                    self._totals[1] -= size
+                if evicted:
+                    self._connection.executemany('DELETE FROM cache WHERE rowid = ?', evicted)
+                    self._noteWrite()
+                if len(evicted) < SqliteCache.GC_CHUNK_SIZE:
+                    break
+        finally:
+            self._lock.release()
+
+    def _adjustTotals(self, where, count, size):
+        '''
+        Account for replacing the entry at where with count entries of
+        size bytes.  Callers must hold self._lock.
+        '''
+        if self._totals is None:
+            return
+        row = self._connection.execute(
+            'SELECT size FROM cache WHERE namespace = ? AND key = ?', where).fetchone()
+        if row is not None:
+            self._totals[0] -= 1
+            self._totals[1] -= row[0]
+        self._totals[0] += count
+        self._totals[1] += size
+
+    def _noteWrite(self):
+        # Callers must hold self._lock.
+        self._pending += 1
+        if self._pending >= self._batch_size or \
+            time.time() - self._last_commit >= self._commit_interval:
+            self._commit()
+        elif self._commit_timer is None:
+            # Nothing may write again for a while; commit the batch when
+            # its time is up rather than on the next write.
+            self._commit_timer = threading.Timer(self._commit_interval, self.flush)
+            self._commit_timer.setDaemon(True)
+            self._commit_timer.start()
+
+    def _commit(self, force=False):
+        # Callers must hold self._lock.
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        if self._pending or force:
+            self._connection.commit()
+        self._pending = 0
+        self._last_commit = time.time()
+
+    def _getNamespace(self, account_specific):
+        if account_specific:
+            return self._screen_name
+        return ''
+
+
+class LRUCache(object):
+    '''
+    A bounded in-memory cache that sits in front of another cache backend.
+
+    Entries are kept together with the time they were cached, so repeated
+    lookups of hot keys are answered without touching the backend.  Writes
+    go through to the backend.  The least recently used entries are
+    dropped once either the entry count or the total body size exceeds
+    its bound.
+
+    Example usage:
+
+        >>> cache = twitter.LRUCache(twitter._FileCache(), max_entries=500)
+        >>> api = twitter.Api(cache=cache)
+    '''
+
+    DEFAULT_MAX_ENTRIES = 1024
+    DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, backend=None, max_entries=None, max_bytes=None):
+        '''
+        Args:
+            backend:
+                An instance that supports the same API as the
+                twitter._FileCache, or None to keep entries in memory
+                only. [Optional]
+            max_entries:
+                The maximum number of entries held in memory.  Defaults to
+                LRUCache.DEFAULT_MAX_ENTRIES. [Optional]
+            max_bytes:
+                The maximum total size, in bytes, of the bodies held in
+                memory.  Defaults to LRUCache.DEFAULT_MAX_BYTES. [Optional]
+        '''
+        if max_entries is None:
+            max_entries = LRUCache.DEFAULT_MAX_ENTRIES
+        if max_bytes is None:
+            max_bytes = LRUCache.DEFAULT_MAX_BYTES
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._backend = backend
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Maps each key being read from the backend to the number of reads
+        # in progress and whether it has been written since they started.
+        self._reading = {}
+
+    def get(self, key, account_specific=False):
+        entry = self.lookup(key, account_specific)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def set(self, key, data, account_specific=False, validators=None):
+        key = _CacheKey(key)
+        if self._backend is not None:
+            if hasattr(self._backend, 'getValidators'):
+                self._backend.set(key, data, account_specific, validators=validators)
+            else:
+                self._backend.set(key, data, account_specific)
+        self._store((account_specific, key.cleaned), data, time.time())
+
+    def getValidators(self, key, account_specific=False):
+        '''Return the HTTP validators the backend stored with key, or None.'''
+        if self._backend is None or not hasattr(self._backend, 'getValidators'):
+            return None
+        return self._backend.getValidators(key, account_specific)
+
+    def touch(self, key, account_specific=False):
+        '''Mark the entry for key as cached now, keeping its body.'''
+        key = _CacheKey(key)
+        memory_key = (account_specific, key.cleaned)
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(memory_key)
+            if entry is not None:
+                self._entries[memory_key] = (entry[0], time.time())
+        finally:
+            self._lock.release()
+        if self._backend is not None and hasattr(self._backend, 'touch'):
+            self._backend.touch(key, account_specific)
+
+    def remove(self, key, account_specific=False):
+        key = _CacheKey(key)
+        self._discard((account_specific, key.cleaned))
+        if self._backend is not None:
+            self._backend.remove(key, account_specific)
+
+    def getCachedTime(self, key, account_specific=False):
+        entry = self.lookup(key, account_specific)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def prune(self):
+        '''
+        Prune the backend, when it supports it, and drop every in-memory
+        entry so that none outlives its backend copy.
+
+        Returns:
+            The number of entries removed from the backend.
+        '''
+        removed = 0
+        if self._backend is not None and hasattr(self._backend, 'prune'):
+            removed = self._backend.prune()
+        self.clear()
+        return removed
+
+    def clear(self):
+        '''Drop every in-memory entry.  The backend is left untouched.'''
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+            self._bytes = 0
+            for reading in self._reading.values():
+                reading[1] = True
+        finally:
+            self._lock.release()
+
+    def lookup(self, key, account_specific=False):
+        key = _CacheKey(key)
+        memory_key = (account_specific, key.cleaned)
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(memory_key, None)
+            if entry is not None:
+                # Re-insert to mark the entry as most recently used.
+                self._entries[memory_key] = entry
+                return entry
+            if self._backend is None:
+                return None
+            reading = self._reading.setdefault(memory_key, [0, False])
+            reading[0] += 1
+        finally:
+            self._lock.release()
+        entry = None
+        try:
+            entry = _cacheLookup(self._backend, key, account_specific)
+        finally:
+            self._lock.acquire()
+            try:
+                reading[0] -= 1
+                if not reading[0]:
+                    del self._reading[memory_key]
+                # A set() or remove() of the key during the read makes what
+                # the backend returned stale; keep it out of memory.
+                if entry is not None and not reading[1]:
+                    self._storeLocked(memory_key, entry[0], entry[1])
+            finally:
+                self._lock.release()
+        return entry
+
+    def _store(self, memory_key, data, cached_time):
+        self._lock.acquire()
+        try:
+            self._markWritten(memory_key)
+            self._storeLocked(memory_key, data, cached_time)
+        finally:
+            self._lock.release()
+
+    def _storeLocked(self, memory_key, data, cached_time):
+        # Called with the lock held.
+        size = len(data)
+        entry = self._entries.pop(memory_key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+        if size > self.max_bytes:
+            return
+        self._entries[memory_key] = (data, cached_time)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted[0])
+
+    def _discard(self, memory_key):
+        self._lock.acquire()
+        try:
+            self._markWritten(memory_key)
+            entry = self._entries.pop(memory_key, None)
+            if entry is not None:
+                self._bytes -= len(entry[0])
+        finally:
+            self._lock.release()
+
+    def _markWritten(self, memory_key):
+        # Called with the lock held.
+        reading = self._reading.get(memory_key)
+        if reading is not None:
+            reading[1] = True
+
+
+class ConnectionPool(object):
+    '''
+    A thread-safe pool of persistent HTTP/1.1 connections, keyed by host.
+
+    Connections are checked out for the duration of a single request and
+    handed back once the response body has been read, so that subsequent
+    requests to the same host skip the TCP and TLS handshakes.
+
+    The pool can also cap the number of connections in use per host, so
+    that many threads sharing one twitter.Api do not flood a host.
+
+    Example usage:
+
+        >>> pool = twitter.ConnectionPool(max_size=4, idle_timeout=30, max_active=16)
+        >>> api = twitter.Api(connection_pool=pool)
+    '''
+
+    DEFAULT_MAX_SIZE = 8
+    DEFAULT_IDLE_TIMEOUT = 60
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_size=None, idle_timeout=None, max_active=None):
+        '''
+        Args:
+            max_size:
+                The maximum number of idle connections kept per host.
+                Defaults to ConnectionPool.DEFAULT_MAX_SIZE. [Optional]
+            idle_timeout:
+                Time, in seconds, after which an idle connection is closed
+                instead of being reused.  Defaults to
+                ConnectionPool.DEFAULT_IDLE_TIMEOUT. [Optional]
+            max_active:
+                The maximum number of connections checked out per host at
+                once; acquire() waits for one to be handed back beyond
+                that.  Defaults to None, no limit. [Optional]
+        '''
+        if max_size is None:
+            max_size = ConnectionPool.DEFAULT_MAX_SIZE
+        if idle_timeout is None:
+            idle_timeout = ConnectionPool.DEFAULT_IDLE_TIMEOUT
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_active = max_active
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._idle = {}
+        self._active = {}
+
+    @staticmethod
+    def getShared():
+        '''Return the process-wide pool, creating it on first use.'''
+        ConnectionPool._shared_lock.acquire()
+        try:
+            if ConnectionPool._shared is None:
+                ConnectionPool._shared = ConnectionPool()
+            return ConnectionPool._shared
+        finally:
+            ConnectionPool._shared_lock.release()
+
+    def acquire(self, scheme, host):
+        '''
+        Check out a connection to the given host.
+
+        Args:
+            scheme:
+                Either 'http' or 'https'.
+            host:
+                The host, optionally followed by ':port'.
+
+        Returns:
+            A tuple of (connection, reused), where reused is True when the
+            connection was taken from the pool rather than freshly opened.
+            The connection must be handed back with release() or discard().
+        '''
+        key = (scheme, host)
+        stale = []
+        connection = None
+        self._lock.acquire()
+        try:
+            while self.max_active is not None and self._active.get(key, 0) >= self.max_active:
+                self._released.wait()
+            self._active[key] = self._active.get(key, 0) + 1
+            now = time.time()
+            idle = self._idle.get(key, [])
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used < self.idle_timeout and self._isHealthy(candidate):
+                    connection = candidate
+                    break
+                stale.append(candidate)
+        finally:
+            self._lock.release()
+        for candidate in stale:
+            candidate.close()
+        if connection is not None:
+            return connection, True
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host), False
+        return httplib.HTTPConnection(host), False
+
+    def release(self, scheme, host, connection):
+        '''
+        Return a connection whose response has been fully read to the pool.
+        The connection is closed instead if the pool for that host is full.
+        '''
+        key = (scheme, host)
+        self._lock.acquire()
+        try:
+            self._deactivate(key)
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_size:
+                idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def discard(self, scheme, host, connection):
+        '''Close a checked out connection that cannot be reused.'''
+        connection.close()
+        self._lock.acquire()
+        try:
+            self._deactivate((scheme, host))
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        '''Close every idle connection held by the pool.'''
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, {}
+        finally:
+            self._lock.release()
+        for connections in idle.values():
+            for connection, last_used in connections:
+                connection.close()
+
+    def _deactivate(self, key):
+        # Called with the lock held.
+        self._active[key] -= 1
+        self._released.notify()
+
+    def _isHealthy(self, connection):
+        '''
+        An idle keep-alive socket has nothing to read; if it is readable the
+        server has either closed it or sent something unsolicited.
+        '''
+        sock = connection.sock
+        if sock is None:
+            return False
+        try:
+            readable = select.select([sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+        return not readable
+
+
+def _keepAliveOpen(handler, scheme, req):
+    '''
+    Perform a urllib2 request over a pooled connection.
+
+    The body is read eagerly so that the connection can be handed back to
+    the pool before the response is returned to the caller.
+
+    A GET or HEAD that fails on a reused connection, which the server may
+    have dropped while it sat idle, is retried on another connection.
+    Other methods are never retried, since the server may already have
+    acted on the request (posting a status twice, say).
+    '''
+    host = req.get_host()
+    if not host:
+        raise urllib2.URLError('no host given')
+
+    headers = dict(req.unredirected_hdrs)
+    headers.update(dict((k, v) for k, v in req.headers.items()
+        if k not in headers))
+    headers = dict((name.title(), val) for name, val in headers.items())
+
+    method = req.get_method()
+    pool = handler._connection_pool
+    while True:
+        connection, reused = pool.acquire(scheme, host)
+        try:
+            connection.set_debuglevel(handler._debuglevel)
+            connection.request(method, req.get_selector(), req.data, headers)
+            r = connection.getresponse()
+            body = r.read()
+        except (socket.error, httplib.HTTPException), e:
+            pool.discard(scheme, host, connection)
+            if reused and method in ('GET', 'HEAD'):
+                # The server dropped a kept-alive connection; try a fresh one.
+                continue
+            raise urllib2.URLError(e)
+        except:
+            # The connection is in an unknown state, but its slot in the
+            # pool must still be given back.
+            pool.discard(scheme, host, connection)
+            raise
+        break
+
+    if r.will_close:
+        pool.discard(scheme, host, connection)
+    else:
+        pool.release(scheme, host, connection)
+
+    response = urllib.addinfourl(StringIO.StringIO(body), r.msg, req.get_full_url())
+    response.code = r.status
+    response.msg = r.reason
+    return response
+
+
+class _KeepAliveHTTPHandler(urllib2.HTTPHandler):
+    '''urllib2 handler that sends http requests over a ConnectionPool.'''
+
+    def __init__(self, connection_pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self._connection_pool = connection_pool
+
+    def http_open(self, req):
+        return _keepAliveOpen(self, 'http', req)
+
+
+class _KeepAliveHTTPSHandler(urllib2.HTTPSHandler):
+    '''urllib2 handler that sends https requests over a ConnectionPool.'''
+
+    def __init__(self, connection_pool, debuglevel=0):
+        urllib2.HTTPSHandler.__init__(self, debuglevel)
+        self._connection_pool = connection_pool
+
+    def https_open(self, req):
+        return _keepAliveOpen(self, 'https', req)
+
+
+class RateLimitState(object):
+    '''
+    The rate limit of an account as last reported by Twitter.
+
+    Each twitter.Api keeps one, updated from the X-RateLimit-* headers of
+    every response, so reading it costs no request.
+
+    The RateLimitState structure exposes the following properties:
+
+      state.limit
+      state.remaining
+      state.reset_time
+      state.updated_at
+    '''
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset_time = None
+        self.updated_at = None
+        self._lock = threading.Lock()
+
+    def update(self, limit, remaining, reset_time):
+        '''
+        Record the rate limit state reported by Twitter.
+
+        Args:
+            limit:
+                The number of hits allowed per period.
+            remaining:
+                The number of hits left before reset_time.
+            reset_time:
+                The time the limit resets, in seconds since the Epoch.
+        '''
+        self._lock.acquire()
+        try:
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_time = reset_time
+            self.updated_at = time.time()
+        finally:
+            self._lock.release()
+
+    def get(self):
+        '''
+        Returns:
+            A consistent (limit, remaining, reset_time) tuple.
+        '''
+        self._lock.acquire()
+        try:
+            return self.limit, self.remaining, self.reset_time
+        finally:
+            self._lock.release()
+
+    def asDict(self):
+        '''
+        A dict representation of this state, using the keys returned by
+        Api.getRateLimitStatus.
+
+        Returns:
+            A dict representing this twitter.RateLimitState instance
+        '''
+        limit, remaining, reset_time = self.get()
+        data = {}
+        if limit is not None:
+            data['hourly_limit'] = limit
+        if remaining is not None:
+            data['remaining_hits'] = remaining
+        if reset_time is not None:
+            data['reset_time_in_seconds'] = reset_time
+            data['reset_time'] = rfc822.formatdate(reset_time)
+        return data
+
+
+class RateLimiter(object):
+    '''
+    A thread-safe token bucket that meters and prioritizes requests to
+    Twitter.
+
+    The limiter learns the hourly limit, the hits remaining and the reset
+    time from the X-RateLimit-* headers of each response, or from
+    Api.getRateLimitStatus.  The bucket holds at most burst tokens, by
+    default DEFAULT_BURST_SHARE of the hourly limit, and refills at the
+    rate that spreads the remaining hits evenly until the reset.  Short
+    bursts go straight through, while a sustained stream of requests runs
+    at the allowed ceiling instead of spending the whole budget at once and
+    then stalling until the reset.  Until the limiter has heard from
+    Twitter, and once the reset time has passed, requests are not
+    metered.
+
+    Requests belong to a priority class: PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL or PRIORITY_BULK.  Waiting requests get tokens in
+    class order, and each class may only spend the budget above its
+    reserve, so a bulk crawl cannot use up the hits interactive calls
+    need.  A request that would be held back longer than its class's
+    max_wait raises a TwitterError instead; by default interactive and
+    normal requests give up after a minute, while bulk requests wait as
+    long as it takes.
+
+    Example usage:
+
+        >>> limiter = twitter.RateLimiter(burst=10)
+        >>> api = twitter.Api(rate_limiter=limiter)
+        >>> limiter.getMetrics()['bulk']['queued']
+    '''
+
+    DEFAULT_BURST = None
+    DEFAULT_BURST_SHARE = 0.1  # The burst used when none is given.
+
+    # The share of the hourly limit each class must leave unspent.
+    DEFAULT_RESERVE = {
+        PRIORITY_INTERACTIVE: 0.0,
+        PRIORITY_NORMAL: 0.05,
+        PRIORITY_BULK: 0.2,
+    }
+
+    # The longest each class may be held back; None waits as long as needed.
+    DEFAULT_MAX_WAIT = {
+        PRIORITY_INTERACTIVE: 60,
+        PRIORITY_NORMAL: 60,
+        PRIORITY_BULK: None,
+    }
+
+    PRIORITY_NAMES = {
+        PRIORITY_INTERACTIVE: 'interactive',
+        PRIORITY_NORMAL: 'normal',
+        PRIORITY_BULK: 'bulk',
+    }
+
+    def __init__(self, burst=None, max_wait=None, reserve=None):
+        '''
+        Args:
+            burst:
+                The most requests that may be sent back to back once the
+                bucket has filled.  Defaults to RateLimiter.DEFAULT_BURST;
+                if that is None, to RateLimiter.DEFAULT_BURST_SHARE of the
+                hourly limit, and at least 1. [Optional]
+            max_wait:
+                Time, in seconds, a request may be held back, or a dict
+                mapping each priority class to one, where None waits as
+                long as needed.  A request that would wait longer raises a
+                TwitterError instead.  Defaults to
+                RateLimiter.DEFAULT_MAX_WAIT. [Optional]
+            reserve:
+                A dict mapping each priority class to the share of the
+                hourly limit, between 0 and 1, that its requests must
+                leave unspent.  Defaults to RateLimiter.DEFAULT_RESERVE.
+                [Optional]
+        '''
+        if burst is None:
+            burst = RateLimiter.DEFAULT_BURST
+        if max_wait is None:
+            max_wait = RateLimiter.DEFAULT_MAX_WAIT
+        if reserve is None:
+            reserve = RateLimiter.DEFAULT_RESERVE
+        if isinstance(max_wait, dict):
+            max_wait = dict(max_wait)
+        self.burst = burst
+        self.max_wait = max_wait
+        self.reserve = dict(reserve)
+        self.limit = None
+        self.remaining = None
+        self.reset_time = None
+        self._condition = threading.Condition(threading.Lock())
+        # None while unmetered: the bucket starts full once metering does.
+        self._tokens = None
+        self._refilled = time.time()
+        self._queued = dict([(p, 0) for p in RateLimiter.PRIORITY_NAMES])
+        self._metrics = dict([(p, [0, 0.0, 0.0]) for p in RateLimiter.PRIORITY_NAMES])
+
+    def update(self, limit, remaining, reset_time):
+        '''
+        Record the rate limit state reported by Twitter.
+
+        Args:
+            limit:
+                The number of hits allowed per period.
+            remaining:
+                The number of hits left before reset_time.
+            reset_time:
+                The time the limit resets, in seconds since the Epoch.
+        '''
+        self._condition.acquire()
+        try:
+            self._refill(time.time())
+            self.limit = limit
+            self.remaining = remaining
+            self.reset_time = reset_time
+            capacity = self._getCapacity()
+            if self._tokens is None:
+                self._tokens = capacity
+            self._tokens = float(min(self._tokens, capacity, remaining))
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        '''
+        Take a token for one request, waiting until one is available to
+        its priority class.
+
+        Args:
+            priority:
+                The request's priority class.  Defaults to PRIORITY_NORMAL.
+                [Optional]
+
+        Raises:
+            TwitterError if the wait would be longer than max_wait.
+        '''
+        max_wait = self.max_wait
+        if isinstance(max_wait, dict):
+            max_wait = max_wait.get(priority)
+        started = time.time()
+        self._condition.acquire()
+        try:
+            self._queued[priority] += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._refill(now)
+                    wait = self._getWait(priority, now)
+                    if wait is None:
+                        break
+                    if max_wait is not None and now - started + wait > max_wait:
+                        raise TwitterError('Rate limit exceeded; next %s request allowed in %.1f seconds'
+                            % (RateLimiter.PRIORITY_NAMES[priority], wait))
+                    self._condition.wait(wait)
+                if self.remaining is not None:
+                    self._tokens -= 1
+                    self.remaining -= 1
+            finally:
+                self._queued[priority] -= 1
+                self._condition.notifyAll()
+            metrics = self._metrics[priority]
+            waited = time.time() - started
+            metrics[0] += 1
+            metrics[1] += waited
+            metrics[2] = max(metrics[2], waited)
+        finally:
+            self._condition.release()
+
+    def getMetrics(self):
+        '''
+        Returns:
+            A dict keyed by priority class name ('interactive', 'normal'
+            and 'bulk').  Each value is a dict holding the number of
+            requests waiting now (queued), the number let through
+            (requests), and their mean and longest wait in seconds
+            (mean_wait and max_wait).
+        '''
+        self._condition.acquire()
+        try:
+            metrics = {}
+            for priority, name in RateLimiter.PRIORITY_NAMES.items():
+                requests, total_wait, max_wait = self._metrics[priority]
+                metrics[name] = {
+                    'queued': self._queued[priority],
+                    'requests': requests,
+                    'mean_wait': requests and total_wait / requests or 0.0,
+                    'max_wait': max_wait,
+                }
+            return metrics
+        finally:
+            self._condition.release()
+
+    def _refill(self, now):
+        # Called with the lock held.
+        if self.reset_time is not None and now >= self.reset_time:
+            # The period has rolled over; meter again once Twitter reports
+            # the new one.
+            self.remaining = None
+            self.reset_time = None
+            self._tokens = None
+        rate = self._getRate(now)
+        if rate:
+            self._tokens = min(self._tokens + (now - self._refilled) * rate,
+                self._getCapacity(), self.remaining)
+        self._refilled = now
+
+    def _getCapacity(self):
+        # The most tokens the bucket holds, once the limit is known.
+        if self.burst is not None:
+            return self.burst
+        return max(int(self.limit * RateLimiter.DEFAULT_BURST_SHARE), 1)
+
+    def _getRate(self, now):
+        # Tokens per second that use up the remaining hits by the reset.
+        if self.remaining is None:
+            return None
+        return float(self.remaining) / max(self.reset_time - now, 1)
+
+    def _getWait(self, priority, now):
+        # Called with the lock held.  Returns None if a request of this
+        # priority may go now, otherwise how long to wait before checking
+        # again.
+        if self.remaining is None:
+            return None
+        until_reset = max(self.reset_time - now, 0) + 1
+        if self.remaining - 1 < self.reserve.get(priority, 0) * (self.limit or 0):
+            return until_reset
+        for other in self._queued:
+            if other < priority and self._queued[other]:
+                # A more urgent request is waiting; it is woken as soon as
+                # a token is taken or the state changes.
+                return min(self._getTokenWait(now, until_reset), 1.0)
+        if self._tokens >= 1:
+            return None
+        return self._getTokenWait(now, until_reset)
+
+    def _getTokenWait(self, now, until_reset):
+        rate = self._getRate(now)
+        if not rate:
+            return until_reset
+        return max((1 - self._tokens) / rate, 0.01)
@@ -0,0 +1,2187 @@
+#!/usr/bin/python2.4
+#
+# Copyright 2007 The Python-Twitter Developers
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Unit tests for the twitter.py library'''
+
+import BaseHTTPServer
+import os
+import pickle
+import SocketServer
+import shutil
+import socket
+import sqlite3
+import StringIO
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+import urlparse
+import warnings
+
+import twitter
+import TwitterCache
+from twitter import simplejson
+
+
+class _TestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server._serve(self)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class _TestServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+    A local HTTP/1.1 server for the tests.  Every request is recorded in
+    requests as a (method, path, headers, body, client_address) tuple and
+    answered by respond(handler), which returns (status, headers, body).
+    By default it answers a JSON object echoing the request path.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, respond=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _TestHandler)
+        if respond is not None:
+            self.respond = respond
+        self.requests = []
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def getBaseUrl(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def respond(self, handler):
+        return 200, {}, simplejson.dumps({'path': handler.path})
+
+    def handle_error(self, request, client_address):
+        # Clients drop their kept-alive connections when a test ends.
+        pass
+
+    def _serve(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length)
+        self._lock.acquire()
+        try:
+            self.requests.append((handler.command, handler.path,
+                dict(handler.headers), body, handler.client_address))
+        finally:
+            self._lock.release()
+        status, headers, data = self.respond(handler)
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class _FakeResponse(object):
+    status = 200
+    reason = 'OK'
+    msg = None
+    will_close = False
+
+    def read(self):
+        return '{}'
+
+
+class _FakeConnection(object):
+    '''A connection whose requests fail if fail is set.'''
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.methods = []
+        self.closed = False
+
+    def set_debuglevel(self, level):
+        pass
+
+    def request(self, method, selector, data, headers):
+        self.methods.append(method)
+        if self.fail:
+            raise socket.error(104, 'Connection reset by peer')
+
+    def getresponse(self):
+        return _FakeResponse()
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeConnectionPool(twitter.ConnectionPool):
+    '''Hands out a dropped kept-alive connection, then fresh ones.'''
+
+    def __init__(self):
+        twitter.ConnectionPool.__init__(self)
+        self.stale = _FakeConnection(fail=True)
+        self.fresh = _FakeConnection(fail=False)
+
+    def acquire(self, scheme, host):
+        self._active[(scheme, host)] = self._active.get((scheme, host), 0) + 1
+        if not self.stale.closed:
+            return self.stale, True
+        return self.fresh, False
+
+
+class _FakeHandler(object):
+    _debuglevel = 0
+
+    def __init__(self, connection_pool):
+        self._connection_pool = connection_pool
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = _TestServer()
+        self._pool = twitter.ConnectionPool()
+        self._opener = urllib2.build_opener(twitter._KeepAliveHTTPHandler(self._pool))
+
+    def tearDown(self):
+        self._pool.clear()
+        self._server.stop()
+
+    def testReusesConnection(self):
+        '''Test that a second request goes over the first one's connection'''
+        for path in ('/a', '/b'):
+            data = simplejson.loads(self._opener.open(self._server.getBaseUrl() + path).read())
+            self.assertEqual(path, data['path'])
+        self.assertEqual(2, len(self._server.requests))
+        self.assertEqual(self._server.requests[0][4], self._server.requests[1][4])
+
+    def testClearClosesIdleConnections(self):
+        '''Test that clear() drops the idle connections'''
+        self._opener.open(self._server.getBaseUrl() + '/a').read()
+        self._pool.clear()
+        self._opener.open(self._server.getBaseUrl() + '/b').read()
+        self.assertNotEqual(self._server.requests[0][4], self._server.requests[1][4])
+
+    def testRetriesGetOnDroppedConnection(self):
+        '''Test that a GET on a dropped kept-alive connection is retried'''
+        pool = _FakeConnectionPool()
+        response = twitter._keepAliveOpen(_FakeHandler(pool), 'http',
+            urllib2.Request('http://example.com/a'))
+        self.assertEqual('{}', response.read())
+        self.assertEqual(['GET'], pool.stale.methods)
+        self.assertEqual(['GET'], pool.fresh.methods)
+
+    def testDoesNotRetryPost(self):
+        '''Test that a POST on a dropped connection is not sent twice'''
+        pool = _FakeConnectionPool()
+        request = urllib2.Request('http://example.com/a', data='status=hi')
+        self.assertRaises(urllib2.URLError, twitter._keepAliveOpen,
+            _FakeHandler(pool), 'http', request)
+        self.assertEqual(['POST'], pool.stale.methods)
+        self.assertEqual([], pool.fresh.methods)
+
+
+def _statusDict(id, screen_name='bob', **kw):
+    data = {'id': id, 'text': 'status %d' % id,
+        'created_at': 'Fri Jan 07 18:01:37 +0000 2011',
+        'user': {'id': 7, 'screen_name': screen_name}}
+    data.update(kw)
+    return data
+
+
+class _ApiTestCase(unittest.TestCase):
+    '''
+    Base class for tests that talk to a local server through a twitter.Api.
+    Tests set self._respond to a function taking the request handler and
+    returning (status, headers, body).
+    '''
+
+    def setUp(self):
+        self._respond = lambda handler: (200, {}, simplejson.dumps({'path': handler.path}))
+        self._server = _TestServer(lambda handler: self._respond(handler))
+        self._apis = []
+
+    def tearDown(self):
+        # Close the kept-alive connections so that no server thread is left
+        # waiting on one.
+        for api in self._apis:
+            if api._connection_pool is not None:
+                api._connection_pool.clear()
+        self._server.stop()
+
+    def _newApi(self, **kw):
+        kw.setdefault('base_url', self._server.getBaseUrl())
+        kw.setdefault('cache', None)
+        kw.setdefault('rate_limiter', None)
+        api = twitter.Api(**kw)
+        self._apis.append(api)
+        return api
+
+    def _newAuthenticatedApi(self, access_token_key='token', **kw):
+        return self._newApi(consumer_key='key', consumer_secret='secret',
+            access_token_key=access_token_key, access_token_secret='token secret', **kw)
+
+    def _respondWith(self, data, headers=None):
+        body = simplejson.dumps(data)
+        self._respond = lambda handler: (200, headers or {}, body)
+
+    def _getPaths(self):
+        return [request[1] for request in self._server.requests]
+
+
+class _CountingJson(object):
+    '''Stands in for simplejson, counting the calls to loads().'''
+
+    def __init__(self):
+        self.loads_count = 0
+
+    def loads(self, data):
+        self.loads_count += 1
+        return simplejson.loads(data)
+
+    def __getattr__(self, name):
+        return getattr(simplejson, name)
+
+
+class FetchJsonTest(_ApiTestCase):
+
+    def testDecodesResponseOnce(self):
+        '''Test that a timeline response is parsed a single time'''
+        self._respondWith([_statusDict(1), _statusDict(2)])
+        counting = _CountingJson()
+        twitter.simplejson = counting
+        try:
+            statuses = self._newApi().getUserTimeline('bob')
+        finally:
+            twitter.simplejson = simplejson
+        self.assertEqual(1, counting.loads_count)
+        self.assertEqual([1, 2], [s.id for s in statuses])
+        self.assertEqual('bob', statuses[0].user.screen_name)
+
+    def testFetchUrlReturnsRawBody(self):
+        '''Test that _fetchUrl still returns the undecoded string'''
+        self._respondWith({'id': 1})
+        self.assertEqual('{"id": 1}', self._newApi()._fetchUrl(self._server.getBaseUrl() + '/a'))
+
+    def testGetHomeTimeline(self):
+        '''Test that getHomeTimeline fetches and builds statuses'''
+        self._respondWith([_statusDict(3)])
+        statuses = self._newAuthenticatedApi().getHomeTimeline(count=1)
+        self.assertEqual([3], [s.id for s in statuses])
+        self.assertTrue(self._getPaths()[0].startswith('/statuses/home_timeline.json?'))
+
+    def testTwitterErrorIsRaised(self):
+        '''Test that an error body raises TwitterError'''
+        self._respondWith({'error': 'Not found'})
+        self.assertRaises(twitter.TwitterError, self._newApi().getStatus, 1)
+
+    def testErrorCheckSkipsModels(self):
+        '''Test that checking a page of models for an error compares none of them'''
+        self._respondWith([_statusDict(1), _statusDict(2)])
+        compared = []
+        __eq__ = twitter.Status.__eq__
+        twitter.Status.__eq__ = lambda status, other: compared.append(other) or False
+        try:
+            statuses = self._newApi().getUserTimeline('bob')
+        finally:
+            twitter.Status.__eq__ = __eq__
+        self.assertEqual(2, len(statuses))
+        self.assertEqual([], compared)
+
+    def testErrorNotBuilt(self):
+        '''Test that an error body is returned as decoded, without models'''
+        data = twitter._decodeJson('{"error": "Not found", "users": [{"id": 1}]}',
+            twitter.User, 'users')
+        self.assertEqual([{'id': 1}], data['users'])
+
+
+class _CountingCache(object):
+    '''A dict backed cache that counts the calls made to it.'''
+
+    def __init__(self):
+        self.entries = {}
+        self.calls = []
+
+    def get(self, key, account_specific=False):
+        self.calls.append('get')
+        entry = self.entries.get((account_specific, key))
+        return entry and entry[0]
+
+    def set(self, key, data, account_specific=False):
+        self.calls.append('set')
+        self.entries[(account_specific, key)] = (data, time.time())
+
+    def remove(self, key, account_specific=False):
+        self.calls.append('remove')
+        self.entries.pop((account_specific, key), None)
+
+    def getCachedTime(self, key, account_specific=False):
+        self.calls.append('getCachedTime')
+        entry = self.entries.get((account_specific, key))
+        return entry and entry[1]
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._backend = _CountingCache()
+
+    def testHitsAreServedFromMemory(self):
+        '''Test that a cached key is read without touching the backend'''
+        cache = twitter.LRUCache(self._backend)
+        cache.set('http://example.com/a', 'body')
+        self.assertEqual(['set'], self._backend.calls)
+        self.assertEqual('body', cache.get('http://example.com/a'))
+        self.assertTrue(cache.getCachedTime('http://example.com/a'))
+        self.assertEqual(['set'], self._backend.calls)
+
+    def testMissesFallBackToBackend(self):
+        '''Test that a key missing from memory is read from the backend once'''
+        self._backend.set('http://example.com/a', 'body')
+        cache = twitter.LRUCache(self._backend)
+        self.assertEqual('body', cache.get('http://example.com/a'))
+        self.assertEqual('body', cache.get('http://example.com/a'))
+        self.assertEqual(['set', 'getCachedTime', 'get'], self._backend.calls)
+
+    def testEvictsLeastRecentlyUsed(self):
+        '''Test that the least recently read entry goes first'''
+        cache = twitter.LRUCache(max_entries=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        cache.get('a')
+        cache.set('c', '3')
+        self.assertEqual('1', cache.get('a'))
+        self.assertEqual(None, cache.get('b'))
+        self.assertEqual('3', cache.get('c'))
+
+    def testEvictsBySize(self):
+        '''Test that max_bytes bounds the bodies held in memory'''
+        cache = twitter.LRUCache(max_bytes=10)
+        cache.set('a', 'x' * 6)
+        cache.set('b', 'y' * 6)
+        cache.set('c', 'z' * 11)
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual('y' * 6, cache.get('b'))
+        self.assertEqual(None, cache.get('c'))
+
+    def testReadRacingSetKeepsNewValue(self):
+        '''Test that a backend read overtaken by a set is not kept in memory'''
+        self._backend.set('http://example.com/a', 'old')
+        cache = twitter.LRUCache(self._backend)
+        reading = threading.Event()
+        resume = threading.Event()
+        get = self._backend.get
+        def slowGet(key, account_specific=False):
+            data = get(key, account_specific)
+            reading.set()
+            resume.wait(5)
+            return data
+        self._backend.get = slowGet
+        results = []
+        reader = threading.Thread(
+            target=lambda: results.append(cache.get('http://example.com/a')))
+        reader.start()
+        reading.wait(5)
+        self._backend.get = get
+        cache.set('http://example.com/a', 'new')
+        resume.set()
+        reader.join(5)
+        self.assertEqual(['old'], results)
+        self.assertEqual('new', cache.get('http://example.com/a'))
+
+    def testRemove(self):
+        '''Test that remove() drops the key from memory and the backend'''
+        cache = twitter.LRUCache(self._backend)
+        cache.set('a', '1')
+        cache.remove('a')
+        self.assertEqual(None, cache.get('a'))
+        self.assertEqual({}, self._backend.entries)
+
+    def testDefaultCache(self):
+        '''Test that Api caches in memory in front of a file cache by default'''
+        api = twitter.Api(connection_pool=None, rate_limiter=None)
+        self.assertTrue(isinstance(api._cache, twitter.LRUCache))
+        self.assertTrue(isinstance(api._cache._backend, twitter._FileCache))
+
+
+class CacheKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testCleanedDropsOAuthParameters(self):
+        '''Test that the oauth parameters do not take part in the key'''
+        first = twitter._CacheKey('http://example.com/a.json?oauth_nonce=1&count=2')
+        second = twitter._CacheKey('http://example.com/a.json?count=2&oauth_nonce=3')
+        self.assertEqual('http://example.com/a.json?count=2', first.cleaned)
+        self.assertEqual(first.hashed, second.hashed)
+
+    def testCleanedOnce(self):
+        '''Test that the cleaned form is computed once per key'''
+        calls = []
+        clean = twitter._cleanCacheKey
+        def counting(key):
+            calls.append(key)
+            return clean(key)
+        twitter._cleanCacheKey = counting
+        try:
+            key = twitter._CacheKey('http://example.com/a.json?count=2')
+            key.cleaned
+            key.hashed
+            self.assertTrue(twitter._CacheKey(key) is key)
+            twitter._CacheKey(key).hashed
+        finally:
+            twitter._cleanCacheKey = clean
+        self.assertEqual(1, len(calls))
+
+    def testFileCacheLookup(self):
+        '''Test that lookup() returns the body and its cached time'''
+        cache = twitter._FileCache(self._directory)
+        self.assertEqual(None, cache.lookup('http://example.com/a'))
+        before = time.time()
+        cache.set('http://example.com/a', 'body')
+        data, cached_time = cache.lookup('http://example.com/a')
+        self.assertEqual('body', data)
+        self.assertTrue(cached_time >= int(before))
+
+    def testLookupFallsBackToGet(self):
+        '''Test that caches without lookup() are read through get()'''
+        cache = _CountingCache()
+        self.assertEqual(None, twitter._cacheLookup(cache, 'a'))
+        cache.set('a', 'body')
+        self.assertEqual('body', twitter._cacheLookup(cache, 'a')[0])
+
+
+class ApiCacheTest(_ApiTestCase):
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+        _ApiTestCase.tearDown(self)
+
+    def testSignedRequestsShareCacheEntry(self):
+        '''Test that a signed request is answered from the cache the second time'''
+        self._respondWith([_statusDict(1)])
+        api = self._newAuthenticatedApi(cache=twitter._FileCache(self._directory))
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(1, len(self._server.requests))
+        self.assertEqual(1, api.getCacheStatistics()['hits'])
+
+
+class SqliteCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'cache.db')
+        self._cache = twitter.SqliteCache(self._path, screen_name='bob',
+            batch_size=3, commit_interval=1000)
+
+    def tearDown(self):
+        self._cache.close()
+        shutil.rmtree(self._directory)
+
+    def _countCommittedRows(self):
+        connection = sqlite3.connect(self._path)
+        try:
+            return connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        finally:
+            connection.close()
+
+    def testSetAndGet(self):
+        '''Test the _FileCache contract'''
+        self.assertEqual(None, self._cache.get('http://example.com/a'))
+        self.assertEqual(None, self._cache.getCachedTime('http://example.com/a'))
+        self._cache.set('http://example.com/a', 'body')
+        self.assertEqual('body', self._cache.get('http://example.com/a'))
+        self.assertEqual('body', self._cache.lookup('http://example.com/a')[0])
+        self.assertTrue(self._cache.getCachedTime('http://example.com/a'))
+        self._cache.remove('http://example.com/a')
+        self.assertEqual(None, self._cache.get('http://example.com/a'))
+
+    def testAccountSpecificEntries(self):
+        '''Test that account specific entries live in their own namespace'''
+        self._cache.set('http://example.com/a', 'mine', account_specific=True)
+        self.assertEqual(None, self._cache.get('http://example.com/a'))
+        self.assertEqual('mine', self._cache.get('http://example.com/a', account_specific=True))
+
+    def testWritesAreCommittedInBatches(self):
+        '''Test that writes are committed every batch_size, or on flush()'''
+        self._cache.set('a', '1')
+        self.assertEqual(0, self._countCommittedRows())
+        self._cache.flush()
+        self.assertEqual(1, self._countCommittedRows())
+        for key in ('b', 'c', 'd'):
+            self._cache.set(key, key)
+        self.assertEqual(4, self._countCommittedRows())
+
+    def testWritesAreCommittedWithoutFurtherWrites(self):
+        '''Test that a lone write is committed once commit_interval passes'''
+        self._cache.close()
+        self._cache = twitter.SqliteCache(self._path, batch_size=100,
+            commit_interval=0.1)
+        self._cache.set('a', '1')
+        deadline = time.time() + 5
+        while not self._countCommittedRows() and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(1, self._countCommittedRows())
+
+    def testEntriesSurviveReopening(self):
+        '''Test that closed caches keep their entries'''
+        self._cache.set('a', '1')
+        self._cache.close()
+        self._cache = twitter.SqliteCache(self._path)
+        self.assertEqual('1', self._cache.get('a'))
+
+
+class BoundedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _fill(self, cache, keys, getPath=None):
+        '''Cache each of keys, the first the oldest by a minute apiece.'''
+        now = time.time()
+        for i, key in enumerate(keys):
+            cache.set(key, 'x' * 10)
+            age = 60 * (len(keys) - i)
+            if isinstance(cache, twitter._FileCache):
+                os.utime(cache._getPath(key, False), (now - age, now - age))
+            else:
+                cache._connection.execute('UPDATE cache SET fetched_at = ? WHERE key = ?',
+                    (now - age, key))
+
+    def _getKeys(self, cache, keys):
+        return [key for key in keys if cache.get(key) is not None]
+
+    def testFileCachePruneByCount(self):
+        '''Test that prune() removes the oldest entries beyond max_entries'''
+        cache = twitter._FileCache(self._directory, max_entries=2)
+        self._fill(cache, ['a', 'b', 'c', 'd'])
+        self.assertEqual(2, cache.prune())
+        self.assertEqual(['c', 'd'], self._getKeys(cache, ['a', 'b', 'c', 'd']))
+
+    def testFileCachePruneByAgeAndSize(self):
+        '''Test that prune() enforces max_age and max_bytes'''
+        cache = twitter._FileCache(self._directory, max_age=150)
+        self._fill(cache, ['a', 'b', 'c', 'd'])
+        cache.prune()
+        self.assertEqual(['c', 'd'], self._getKeys(cache, ['a', 'b', 'c', 'd']))
+        cache = twitter._FileCache(self._directory, max_bytes=10)
+        cache.prune()
+        self.assertEqual(['d'], self._getKeys(cache, ['a', 'b', 'c', 'd']))
+
+    def testFileCacheUnboundedKeepsEverything(self):
+        '''Test that a cache without bounds never evicts'''
+        cache = twitter._FileCache(self._directory, gc_interval=1)
+        self._fill(cache, ['a', 'b', 'c'])
+        self.assertEqual(0, cache.prune())
+        self.assertEqual(['a', 'b', 'c'], self._getKeys(cache, ['a', 'b', 'c']))
+
+    def testFileCacheCollectsGarbageOnSet(self):
+        '''Test that set() runs collection slices that expire old entries'''
+        cache = twitter._FileCache(self._directory, max_age=150, gc_interval=1,
+            gc_time_slice=10)
+        self._fill(cache, ['a', 'b', 'c', 'd'])
+        cache.set('e', 'x')
+        self.assertEqual(['c', 'd', 'e'], self._getKeys(cache, ['a', 'b', 'c', 'd', 'e']))
+
+    def testFileCacheConcurrentCollection(self):
+        '''Test that prune() and collection slices can run at once'''
+        cache = twitter._FileCache(self._directory, max_entries=50, gc_time_slice=10)
+        for i in xrange(100):
+            cache.set(str(i), 'x')
+        errors = []
+        stop = time.time() + 1
+        def run(function, *args):
+            try:
+                while time.time() < stop:
+                    function(*args)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=run, args=(cache.prune,)),
+            threading.Thread(target=run, args=(cache._collectGarbage, stop))]
+        # Switch threads as often as possible to expose races.
+        check_interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(check_interval)
+        self.assertEqual([], errors)
+
+    def testSqliteCachePrune(self):
+        '''Test that SqliteCache.prune() removes the oldest entries'''
+        cache = twitter.SqliteCache(os.path.join(self._directory, 'cache.db'),
+            max_entries=3, max_bytes=25)
+        try:
+            self._fill(cache, ['a', 'b', 'c', 'd'])
+            self.assertEqual(2, cache.prune())
+            self.assertEqual(['c', 'd'], self._getKeys(cache, ['a', 'b', 'c', 'd']))
+        finally:
+            cache.close()
+
+    def testSqliteCacheCollectsGarbageOnSet(self):
+        '''Test that SqliteCache.set() runs collection slices'''
+        cache = twitter.SqliteCache(os.path.join(self._directory, 'cache.db'),
+            max_entries=2, gc_interval=1, gc_time_slice=10)
+        try:
+            self._fill(cache, ['a', 'b', 'c', 'd'])
+            self.assertEqual(['c', 'd'], self._getKeys(cache, ['a', 'b', 'c', 'd']))
+        finally:
+            cache.close()
+
+    def testCleanCacheKeyWithoutQuery(self):
+        '''Test that keys without a query string stay distinct'''
+        self.assertEqual('http://example.com/a.json',
+            twitter._cleanCacheKey('http://example.com/a.json'))
+        self.assertNotEqual(twitter._CacheKey('http://example.com/a.json').hashed,
+            twitter._CacheKey('http://example.com/b.json').hashed)
+
+
+class CompressedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._body = simplejson.dumps([_statusDict(i) for i in xrange(20)])
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def testFileCacheStoresCompressed(self):
+        '''Test that bodies are stored compressed and read back whole'''
+        cache = twitter._FileCache(self._directory, compression_level=6)
+        cache.set('http://example.com/a', self._body)
+        stored = open(cache._getPath('http://example.com/a', False), 'rb').read()
+        self.assertTrue(stored.startswith(twitter._COMPRESSED_CACHE_HEADER))
+        self.assertTrue(len(stored) < len(self._body))
+        self.assertEqual(self._body, cache.get('http://example.com/a'))
+        self.assertEqual(self._body, cache.lookup('http://example.com/a')[0])
+
+    def testFileCacheReadsEitherWay(self):
+        '''Test that a cache reads entries stored with other settings'''
+        twitter._FileCache(self._directory).set('a', self._body)
+        twitter._FileCache(self._directory, compression_level=9).set('b', self._body)
+        for cache in (twitter._FileCache(self._directory),
+            twitter._FileCache(self._directory, compression_level=1)):
+            self.assertEqual(self._body, cache.get('a'))
+            self.assertEqual(self._body, cache.get('b'))
+
+    def testSqliteCacheStoresCompressed(self):
+        '''Test that SqliteCache compresses bodies too'''
+        cache = twitter.SqliteCache(os.path.join(self._directory, 'cache.db'),
+            compression_level=6)
+        try:
+            cache.set('a', self._body)
+            size = cache._connection.execute('SELECT size FROM cache').fetchone()[0]
+            self.assertTrue(size < len(self._body))
+            self.assertEqual(self._body, cache.get('a'))
+        finally:
+            cache.close()
+
+
+class SingleFlightTest(_ApiTestCase):
+
+    def _runConcurrently(self, function, count):
+        results = []
+        def run():
+            try:
+                results.append(function())
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=run) for i in xrange(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def testConcurrentCallsShareOneCall(self):
+        '''Test that concurrent calls with one key run the function once'''
+        single_flight = twitter._SingleFlight()
+        calls = []
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+        results = self._runConcurrently(lambda: single_flight.do('key', slow), 5)
+        self.assertEqual(['result'] * 5, results)
+        self.assertEqual(1, len(calls))
+
+    def testErrorsAreShared(self):
+        '''Test that every waiting caller sees the leader's exception'''
+        single_flight = twitter._SingleFlight()
+        def fail():
+            time.sleep(0.2)
+            raise twitter.TwitterError('failed')
+        results = self._runConcurrently(lambda: single_flight.do('key', fail), 3)
+        self.assertEqual(3, len([r for r in results if isinstance(r, twitter.TwitterError)]))
+        self.assertEqual({}, single_flight._calls)
+
+    def testConcurrentApiGetsShareOneRequest(self):
+        '''Test that identical concurrent GETs make one request'''
+        body = simplejson.dumps([_statusDict(1)])
+        def respond(handler):
+            time.sleep(0.2)
+            return 200, {}, body
+        self._respond = respond
+        api = self._newAuthenticatedApi()
+        results = self._runConcurrently(lambda: api.getUserTimeline('bob'), 4)
+        self.assertEqual([1] * 4, [statuses[0].id for statuses in results])
+        self.assertEqual(1, len(self._server.requests))
+
+    def testPostsAreNotShared(self):
+        '''Test that POSTs are always sent'''
+        self._respondWith(_statusDict(1))
+        api = self._newAuthenticatedApi()
+        self._runConcurrently(lambda: api.postUpdate('hi'), 2)
+        self.assertEqual(2, len(self._server.requests))
+
+
+class _CachingApiTestCase(_ApiTestCase):
+    '''
+    Base class for tests of cached Api fetches.  The server answers each
+    request with a timeline holding one status whose id counts the
+    requests made so far.
+    '''
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._directory = tempfile.mkdtemp()
+        self._cache = twitter._FileCache(self._directory)
+        self._respond = lambda handler: (200, {},
+            simplejson.dumps([_statusDict(len(self._server.requests))]))
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+        _ApiTestCase.tearDown(self)
+
+    def _age(self, seconds):
+        '''Make every cached entry look seconds older.'''
+        for bucket in self._cache._getBuckets():
+            for mtime, size, path in self._cache._scanBucket(bucket):
+                os.utime(path, (mtime - seconds, mtime - seconds))
+
+    def _waitForRequests(self, count):
+        deadline = time.time() + 5
+        while len(self._server.requests) < count and time.time() < deadline:
+            time.sleep(0.01)
+        # Let the revalidation store its response.
+        time.sleep(0.1)
+
+
+class StaleWhileRevalidateTest(_CachingApiTestCase):
+
+    def _newCachingApi(self):
+        api = self._newApi(cache=self._cache)
+        api.setCacheTimeout(60)
+        api.setStaleWhileRevalidate(600)
+        return api
+
+    def testFreshEntryIsAHit(self):
+        '''Test that an entry within the cache timeout is served as is'''
+        api = self._newCachingApi()
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(1, len(self._server.requests))
+        self.assertEqual(1, api.getCacheStatistics()['hits'])
+
+    def testStaleEntryIsServedAndRefreshed(self):
+        '''Test that a stale entry is served while it is refetched'''
+        api = self._newCachingApi()
+        api.getUserTimeline('bob')
+        self._age(120)
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self._waitForRequests(2)
+        self.assertEqual(2, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(2, len(self._server.requests))
+        statistics = api.getCacheStatistics()
+        self.assertEqual(1, statistics['stale_hits'])
+        self.assertEqual(1, statistics['hits'])
+
+    def testEntryBeyondWindowIsRefetched(self):
+        '''Test that an entry older than the window is fetched in line'''
+        api = self._newCachingApi()
+        api.getUserTimeline('bob')
+        self._age(1000)
+        self.assertEqual(2, api.getUserTimeline('bob')[0].id)
+        self.assertEqual(0, api.getCacheStatistics()['stale_hits'])
+
+    def testPerCallOverride(self):
+        '''Test that stale_while_revalidate=0 refetches expired entries in line'''
+        api = self._newCachingApi()
+        api.getUserTimeline('bob')
+        self._age(120)
+        self.assertEqual(2, api.getUserTimeline('bob', stale_while_revalidate=0)[0].id)
+
+    def testFailedRefreshLeavesEntryStale(self):
+        '''Test that a failed background refresh is counted, not printed'''
+        api = self._newCachingApi()
+        api.getUserTimeline('bob')
+        self._age(120)
+        def fail(*args):
+            raise twitter.TwitterError('Over capacity')
+        api._refreshCache = fail
+        stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+        try:
+            self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+            deadline = time.time() + 5
+            while not api.getCacheStatistics()['revalidation_errors'] and \
+                time.time() < deadline:
+                time.sleep(0.01)
+            output = sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+        self.assertEqual('', output)
+        self.assertEqual(1, api.getCacheStatistics()['revalidation_errors'])
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+
+    def testRefreshesAreBounded(self):
+        '''Test that at most MAX_REVALIDATIONS stale entries refresh at once'''
+        api = self._newCachingApi()
+        users = ['user%d' % i for i in range(twitter.Api.MAX_REVALIDATIONS + 2)]
+        for user in users:
+            api.getUserTimeline(user)
+        self._age(120)
+        started = []
+        release = threading.Event()
+        def refresh(*args):
+            started.append(args[1])
+            release.wait(5)
+        api._refreshCache = refresh
+        try:
+            for user in users:
+                api.getUserTimeline(user)
+            time.sleep(0.2)
+            self.assertEqual(twitter.Api.MAX_REVALIDATIONS, len(started))
+        finally:
+            release.set()
+
+
+class _CountingFile(object):
+    '''Wraps a file, counting the bytes read from it.'''
+
+    def __init__(self, fp, counts):
+        self._fp = fp
+        self._counts = counts
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self._counts.append(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self._fp.readline(*args)
+        self._counts.append(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class ConditionalGetTest(_CachingApiTestCase):
+
+    def setUp(self):
+        _CachingApiTestCase.setUp(self)
+        self._body = simplejson.dumps([_statusDict(1)])
+        def respond(handler):
+            if handler.headers.get('If-None-Match') == '"v1"':
+                return 304, {}, ''
+            return 200, {'ETag': '"v1"', 'Last-Modified': 'Fri, 07 Jan 2011 18:01:37 GMT'}, self._body
+        self._respond = respond
+
+    def _testRevalidation(self, cache):
+        api = self._newApi(cache=cache)
+        api.setCacheTimeout(60)
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        key = self._server.getBaseUrl() + '/statuses/user_timeline/bob.json'
+        self.assertEqual('"v1"', cache.getValidators(key)['ETag'])
+        self._age(120)
+        if isinstance(cache, twitter.SqliteCache):
+            cache._connection.execute('UPDATE cache SET fetched_at = fetched_at - 120')
+        self.assertEqual(1, api.getUserTimeline('bob')[0].id)
+        self.assertEqual('"v1"', self._server.requests[1][2].get('if-none-match'))
+        self.assertEqual(1, api.getCacheStatistics()['not_modified'])
+        # The 304 refreshed the entry, so it is a hit again.
+        api.getUserTimeline('bob')
+        self.assertEqual(2, len(self._server.requests))
+
+    def testFileCacheRevalidation(self):
+        '''Test that an expired file cache entry is revalidated with a 304'''
+        self._testRevalidation(self._cache)
+
+    def testCompressedFileCacheRevalidation(self):
+        '''Test revalidation of compressed file cache entries'''
+        self._cache = twitter._FileCache(self._directory, compression_level=6)
+        self._testRevalidation(self._cache)
+
+    def testSqliteCacheRevalidation(self):
+        '''Test that an expired SqliteCache entry is revalidated with a 304'''
+        cache = twitter.SqliteCache(os.path.join(self._directory, 'cache.db'))
+        try:
+            self._testRevalidation(cache)
+        finally:
+            cache.close()
+
+    def testChangedResourceIsRefetched(self):
+        '''Test that a 200 to a conditional GET replaces the entry'''
+        api = self._newApi(cache=self._cache)
+        api.setCacheTimeout(60)
+        api.getUserTimeline('bob')
+        self._body = simplejson.dumps([_statusDict(2)])
+        self._respond = lambda handler: (200, {'ETag': '"v2"'}, self._body)
+        self._age(120)
+        self.assertEqual(2, api.getUserTimeline('bob')[0].id)
+        statistics = api.getCacheStatistics()
+        self.assertEqual(2, statistics['refetched'])
+        self.assertEqual(0, statistics['not_modified'])
+
+    def testGetValidatorsReadsOnlyTheHeader(self):
+        '''Test that _FileCache.getValidators does not read the body'''
+        body = 'x' * 100000
+        self._cache.set('a', body, validators={'ETag': '"v1"'})
+        self._cache.set('b', body)
+        counts = []
+        real_open = open
+        def counting_open(path, mode='r'):
+            return _CountingFile(real_open(path, mode), counts)
+        twitter.open = counting_open
+        try:
+            self.assertEqual({'ETag': '"v1"'}, self._cache.getValidators('a'))
+            self.assertEqual(None, self._cache.getValidators('b'))
+        finally:
+            del twitter.open
+        self.assertTrue(sum(counts) < 100, counts)
+        self.assertEqual(body, self._cache.get('a'))
+
+
+class _PagingTestCase(_ApiTestCase):
+    '''
+    Base class for tests of cursored resources.  The server pages the ids
+    1 to 5 as [1, 2], [3, 4], [5], under 'ids', or as users under 'users'.
+    '''
+
+    PAGES = {'-1': ([1, 2], 5), '5': ([3, 4], 9), '9': ([5], 0)}
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._respond = self._respondWithPage
+
+    def _respondWithPage(self, handler):
+        query = urlparse.parse_qs(urlparse.urlparse(handler.path).query)
+        cursor = query.get('cursor', ['-1'])[0]
+        ids, next_cursor = self.PAGES[cursor]
+        data = {'next_cursor': next_cursor, 'previous_cursor': 0}
+        if '/ids' in handler.path:
+            data['ids'] = ids
+        else:
+            data['users'] = [{'id': i, 'screen_name': 'user%d' % i} for i in ids]
+        return 200, {}, simplejson.dumps(data)
+
+    def _getCursors(self):
+        return [urlparse.parse_qs(urlparse.urlparse(path).query)['cursor'][0]
+            for path in self._getPaths()]
+
+
+class CursorIteratorTest(_PagingTestCase):
+
+    def testIterFollowerIDs(self):
+        '''Test that iterFollowerIDs walks every page'''
+        api = self._newAuthenticatedApi()
+        self.assertEqual([1, 2, 3, 4, 5], list(api.iterFollowerIDs()))
+        self.assertEqual(['-1', '5', '9'], self._getCursors())
+
+    def testIterFriendsBuildsUsers(self):
+        '''Test that iterFriends yields twitter.User instances'''
+        api = self._newAuthenticatedApi()
+        users = list(api.iterFriends('bob'))
+        self.assertEqual([1, 2, 3, 4, 5], [u.id for u in users])
+
+    def testPrefetchFetchesJson(self):
+        '''Test that with no decode pool, models are built by the consumer'''
+        api = self._newAuthenticatedApi()
+        getFriendsData = api._getFriendsData
+        models = []
+        def recording(user, cursor, **kw):
+            models.append(kw.get('model'))
+            return getFriendsData(user, cursor, **kw)
+        api._getFriendsData = recording
+        users = list(api.iterFriends('bob', read_ahead=2))
+        self.assertTrue(isinstance(users[0], twitter.User))
+        self.assertEqual([None] * 3, models)
+        self.assertTrue(isinstance(users[0], twitter.User))
+
+    def testStartCursor(self):
+        '''Test that iteration can start part way'''
+        api = self._newAuthenticatedApi()
+        self.assertEqual([3, 4, 5], list(api.iterFriendIDs('bob', cursor=5)))
+
+    def testIteratorsAreIndependent(self):
+        '''Test that interleaved iterators on one Api keep their own cursors'''
+        api = self._newAuthenticatedApi()
+        first = api.iterFollowerIDs()
+        second = api.iterFriendIDs('bob')
+        self.assertEqual([1, 2, 3], [first.next(), first.next(), first.next()])
+        self.assertEqual([1, 2, 3, 4, 5], list(second))
+        self.assertEqual([4, 5], list(first))
+
+    def testTwitterCache(self):
+        '''Test that TwitterCache collects a whole crawl'''
+        api = self._newAuthenticatedApi()
+        self.assertEqual([1, 2, 3, 4, 5], TwitterCache.TwitterCache(api).getFollowerIDs())
+        self.assertEqual([1, 2, 3, 4, 5], [u.id for u in TwitterCache.TwitterCache(api).getFriends('bob')])
+
+
+class PageTest(_PagingTestCase):
+
+    def testGetFriendsReturnsPage(self):
+        '''Test that getFriends returns a twitter.Page carrying the cursors'''
+        api = self._newAuthenticatedApi()
+        page = api.getFriends('bob')
+        self.assertTrue(isinstance(page, twitter.Page))
+        self.assertEqual([1, 2], [u.id for u in page])
+        self.assertEqual(5, page.next_cursor)
+        self.assertEqual(0, page.previous_cursor)
+        page = api.getFriends('bob', cursor=page.next_cursor)
+        self.assertEqual([3, 4], [u.id for u in page])
+
+    def testApiCursorsAreDeprecated(self):
+        '''Test that Api.next_cursor still reads the last page, with a warning'''
+        api = self._newAuthenticatedApi()
+        page = api.getFriends('bob')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(page.next_cursor, api.next_cursor)
+            self.assertEqual(page.previous_cursor, api.previous_cursor)
+        self.assertEqual([DeprecationWarning] * 2,
+            [warning.category for warning in caught])
+
+    def testGetFollowerIDsReturnsData(self):
+        '''Test that getFollowerIDs returns the decoded page'''
+        api = self._newAuthenticatedApi()
+        data = api.getFollowerIDs(cursor=5)
+        self.assertEqual([3, 4], data['ids'])
+        self.assertEqual(9, data['next_cursor'])
+
+    def testNewFromJsonDict(self):
+        '''Test building a Page with and without a factory'''
+        data = {'users': [{'id': 1}], 'next_cursor': 7, 'previous_cursor': 3}
+        page = twitter.Page.newFromJsonDict(data, 'users')
+        self.assertEqual([{'id': 1}], list(page))
+        self.assertEqual((7, 3), (page.next_cursor, page.previous_cursor))
+        page = twitter.Page.newFromJsonDict(data, 'users', twitter.User.newFromJsonDict)
+        self.assertEqual(1, page[0].id)
+
+
+class PrefetchTest(unittest.TestCase):
+
+    def _pages(self, count):
+        pages = {}
+        for i in xrange(1, count + 1):
+            pages[i] = {'ids': [i], 'next_cursor': i < count and i + 1 or 0}
+        return pages
+
+    def testYieldsEveryPage(self):
+        '''Test that _prefetchPages yields each page in order'''
+        pages = self._pages(4)
+        result = list(twitter._prefetchPages(pages.__getitem__, 1, 2))
+        self.assertEqual([[1], [2], [3], [4]], [data['ids'] for data in result])
+
+    def testFetchesAhead(self):
+        '''Test that the next page is requested before the caller asks for it'''
+        pages = self._pages(3)
+        fetched = []
+        requested = threading.Event()
+        def fetch_page(cursor):
+            fetched.append(cursor)
+            if cursor == 2:
+                requested.set()
+            return pages[cursor]
+        iterator = twitter._prefetchPages(fetch_page, 1, 1)
+        self.assertEqual([1], iterator.next()['ids'])
+        requested.wait(5)
+        self.assertTrue(2 in fetched)
+        self.assertEqual([[2], [3]], [data['ids'] for data in iterator])
+
+    def testReraisesErrors(self):
+        '''Test that an error fetching a page is raised to the caller'''
+        pages = self._pages(3)
+        def fetch_page(cursor):
+            if cursor == 2:
+                raise twitter.TwitterError('failed')
+            return pages[cursor]
+        iterator = twitter._prefetchPages(fetch_page, 1, 2)
+        self.assertEqual([1], iterator.next()['ids'])
+        self.assertRaises(twitter.TwitterError, iterator.next)
+
+    def testCloseStopsFetching(self):
+        '''Test that closing the generator stops the fetching thread'''
+        fetched = []
+        def fetch_page(cursor):
+            fetched.append(cursor)
+            return {'ids': [cursor], 'next_cursor': cursor + 1}
+        iterator = twitter._prefetchPages(fetch_page, 1, 1)
+        iterator.next()
+        iterator.close()
+        time.sleep(0.3)
+        count = len(fetched)
+        time.sleep(0.3)
+        self.assertEqual(count, len(fetched))
+        self.assertTrue(count < 10)
+
+    def testReadAhead(self):
+        '''Test that Api iterators accept read_ahead'''
+        pages = self._pages(3)
+        api = twitter.Api(cache=None, rate_limiter=None)
+        api._getFriendIDsData = lambda user, cursor, **kw: pages[cursor]
+        self.assertEqual([1, 2, 3], list(api.iterFriendIDs('bob', cursor=1, read_ahead=2)))
+
+
+class PagingCheckpointTest(_PagingTestCase):
+
+    def setUp(self):
+        _PagingTestCase.setUp(self)
+        self._store = twitter.LRUCache()
+
+    def _failAfter(self, count):
+        '''Make the server fail every request after the first count.'''
+        respond = self._respond
+        def failing(handler):
+            if len(self._server.requests) > count:
+                return 500, {}, simplejson.dumps({'error': 'failed'})
+            return respond(handler)
+        self._respond = failing
+
+    def testSaveAndLoad(self):
+        '''Test that a saved checkpoint is read back by a new instance'''
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store)
+        self.assertFalse(checkpoint.load())
+        checkpoint.save(5, [1, 2])
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store)
+        self.assertTrue(checkpoint.load())
+        self.assertEqual((5, 1, 2), (checkpoint.cursor, checkpoint.pages, checkpoint.count))
+
+    def testKeepItems(self):
+        '''Test that keep_items stores each page's items'''
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store, keep_items=True)
+        checkpoint.save(5, [{'id': 1}, {'id': 2}])
+        checkpoint.save(9, [{'id': 3}])
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store, keep_items=True)
+        self.assertEqual([1, 2, 3], [item['id'] for item in checkpoint.getItems()])
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store)
+        self.assertRaises(twitter.TwitterError, lambda: list(checkpoint.getItems()))
+
+    def testResume(self):
+        '''Test that an interrupted crawl resumes from the last page'''
+        api = self._newAuthenticatedApi()
+        self._failAfter(1)
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store)
+        ids = []
+        try:
+            for id in api.iterFollowerIDs(checkpoint=checkpoint):
+                ids.append(id)
+        except twitter.TwitterError:
+            pass
+        self.assertEqual([1, 2], ids)
+        self._respond = self._respondWithPage
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store)
+        self.assertEqual([3, 4, 5], list(api.iterFollowerIDs(checkpoint=checkpoint)))
+        self.assertEqual(['-1', '5', '5', '9'], self._getCursors())
+
+    def testClearedOnCompletion(self):
+        '''Test that a completed crawl removes its checkpoint'''
+        api = self._newAuthenticatedApi()
+        checkpoint = twitter.PagingCheckpoint('crawl', self._store, keep_items=True)
+        list(api.iterFollowerIDs(checkpoint=checkpoint))
+        self.assertEqual(None, self._store.get('checkpoint:crawl:0'))
+        self.assertFalse(twitter.PagingCheckpoint('crawl', self._store).load())
+
+    def testTwitterCacheResume(self):
+        '''Test that TwitterCache returns the whole crawl after a resume'''
+        api = self._newAuthenticatedApi()
+        self._failAfter(1)
+        cache = TwitterCache.TwitterCache(api, checkpoint_store=self._store)
+        self.assertRaises(twitter.TwitterError, cache.getFollowerIDs)
+        self._respond = self._respondWithPage
+        self.assertEqual([1, 2, 3, 4, 5], cache.getFollowerIDs())
+
+    def testTwitterCacheResumeKeepsUserFields(self):
+        '''Test that users read back after a resume are those Twitter sent'''
+        api = self._newAuthenticatedApi()
+        def respond(handler):
+            status, headers, body = self._respondWithPage(handler)
+            data = simplejson.loads(body)
+            for user in data['users']:
+                user.update({'followers_count': 0, 'profile_sidebar_fill_color': 'eeeeee',
+                    'profile_background_image_url': 'http://a/bg.png'})
+            return status, headers, simplejson.dumps(data)
+        self._respond = respond
+        self._failAfter(1)
+        cache = TwitterCache.TwitterCache(api, checkpoint_store=self._store)
+        self.assertRaises(twitter.TwitterError, cache.getFollowers)
+        self._respond = respond
+        users = cache.getFollowers()
+        self.assertEqual([1, 2, 3, 4, 5], [user.id for user in users])
+        self.assertEqual([0] * 5, [user.followers_count for user in users])
+        self.assertEqual(['eeeeee'] * 5, [user.profile_sidebar_fill_color for user in users])
+
+    def testTwitterCacheAccounts(self):
+        '''Test that accounts sharing a consumer key keep separate checkpoints'''
+        self._failAfter(1)
+        first = self._newAuthenticatedApi(access_token_key='first')
+        second = self._newAuthenticatedApi(access_token_key='second')
+        self.assertRaises(twitter.TwitterError,
+            TwitterCache.TwitterCache(first, checkpoint_store=self._store).getFollowerIDs)
+        self._respond = self._respondWithPage
+        self.assertEqual([1, 2, 3, 4, 5],
+            TwitterCache.TwitterCache(second, checkpoint_store=self._store).getFollowerIDs())
+        self.assertEqual(['-1', '5', '-1', '5', '9'], self._getCursors())
+
+
+class _UsersLookupTestCase(_ApiTestCase):
+    '''
+    Base class for tests of users/lookup.  The server returns a user for
+    every requested user_id and screen_name except those starting with
+    'gone'; the user with id n is named 'usern'.
+    '''
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._respond = self._respondWithUsers
+
+    def _respondWithUsers(self, handler):
+        query = urlparse.parse_qs(urlparse.urlparse(handler.path).query)
+        users = []
+        for id in ','.join(query.get('user_id', [])).split(','):
+            if id and not id.startswith('gone'):
+                users.append({'id': int(id), 'screen_name': 'user%s' % id})
+        for name in ','.join(query.get('screen_name', [])).split(','):
+            if name and not name.startswith('gone'):
+                users.append({'id': int(name[4:]), 'screen_name': name})
+        return 200, {}, simplejson.dumps(users)
+
+    def _getQueries(self):
+        return [urlparse.parse_qs(urlparse.urlparse(path).query) for path in self._getPaths()]
+
+
+class UsersLookupTest(_UsersLookupTestCase):
+
+    def testOrder(self):
+        '''Test that users come back in the order they were requested'''
+        api = self._newAuthenticatedApi()
+        users = api.usersLookup(user_id=[3, 1], screen_name=['user7'],
+            users=[twitter.User(id=5)])
+        self.assertEqual([3, 1, 5, 7], [u.id for u in users])
+
+    def testChunks(self):
+        '''Test that large lookups are split into chunks'''
+        api = self._newAuthenticatedApi()
+        api.USERS_LOOKUP_CHUNK_SIZE = 3
+        users = api.usersLookup(user_id=range(1, 9))
+        self.assertEqual(range(1, 9), [u.id for u in users])
+        chunks = sorted([query['user_id'][0] for query in self._getQueries()])
+        self.assertEqual(['1,2,3', '4,5,6', '7,8'], chunks)
+
+    def testDuplicates(self):
+        '''Test that a user requested twice is fetched once'''
+        api = self._newAuthenticatedApi()
+        users = api.usersLookup(user_id=[1, 1], screen_name=['User2', 'user2'])
+        self.assertEqual([1, 1, 2, 2], [u.id for u in users])
+        queries = self._getQueries()
+        self.assertEqual([['1']], [query['user_id'] for query in queries if 'user_id' in query])
+        self.assertEqual([['User2']], [query['screen_name'] for query in queries if 'screen_name' in query])
+
+    def testMissing(self):
+        '''Test that users Twitter does not return are reported'''
+        api = self._newAuthenticatedApi()
+        missing = []
+        users = api.usersLookup(screen_name=['user1', 'gone2', 'user3'], missing=missing)
+        self.assertEqual([1, 3], [u.id for u in users])
+        self.assertEqual(['gone2'], missing)
+
+    def testArgumentsCheckedAtCall(self):
+        '''Test that iterUsersLookup rejects bad arguments before iteration'''
+        self.assertRaises(twitter.TwitterError,
+            self._newAuthenticatedApi().iterUsersLookup)
+        self.assertRaises(twitter.TwitterError,
+            self._newApi().iterUsersLookup, user_id=[1])
+
+    def testCachedUsers(self):
+        '''Test that recently looked-up users are not requested again'''
+        api = self._newAuthenticatedApi(cache=twitter.LRUCache())
+        api.usersLookup(user_id=[1, 2])
+        users = api.usersLookup(user_id=[2, 3], screen_name=['user1'])
+        self.assertEqual([2, 3, 1], [u.id for u in users])
+        self.assertEqual(2, len(self._getPaths()))
+        self.assertEqual(['3'], self._getQueries()[1]['user_id'])
+
+    def testRequiresAuthentication(self):
+        '''Test that usersLookup needs an authenticated Api'''
+        api = self._newApi()
+        self.assertRaises(twitter.TwitterError, api.usersLookup, user_id=[1])
+
+
+class SearchUsersTest(_UsersLookupTestCase):
+
+    def _searchResults(self, api, names):
+        '''Make api's searches return a status from each of names.'''
+        results = [_statusDict(i, from_user=name, profile_image_url='http://a/%s' % name)
+            for i, name in enumerate(names)]
+        body = simplejson.dumps({'results': results})
+        def respond(handler):
+            if handler.path.startswith('/search.json'):
+                return 200, {}, body
+            return self._respondWithUsers(handler)
+        self._respond = respond
+        # Send the searches to the test server too.
+        fetchJson = api._fetchJson
+        def fetch(url, **kw):
+            if url.startswith('http://search.twitter.com/'):
+                url = self._server.getBaseUrl() + '/search.json'
+            return fetchJson(url, **kw)
+        api._fetchJson = fetch
+
+    def _getPaths(self):
+        return [path for path in _UsersLookupTestCase._getPaths(self)
+            if not path.startswith('/search.json')]
+
+    def testHydratesUsers(self):
+        '''Test that query_users fetches the authors in one batch'''
+        api = self._newAuthenticatedApi()
+        self._searchResults(api, ['user1', 'User2', 'user1', 'gone3'])
+        statuses = api.getSearch('term', query_users=True)
+        self.assertEqual([1, 2, 1], [s.user.id for s in statuses[:3]])
+        self.assertEqual('gone3', statuses[3].user.screen_name)
+        self.assertEqual(None, statuses[3].user.id)
+        self.assertEqual(1, len(self._getPaths()))
+        self.assertEqual(['user1,User2,gone3'], self._getQueries()[0]['screen_name'])
+
+    def testForwardsKeywords(self):
+        '''Test that getSearch passes its keywords on to users/lookup'''
+        api = self._newAuthenticatedApi(cache=twitter.LRUCache())
+        self._searchResults(api, ['user1'])
+        api.getSearch('term', query_users=True, cache_timeout=0)
+        api.getSearch('term', query_users=True, cache_timeout=0)
+        self.assertEqual(2, len(self._getPaths()))
+
+    def testIncludeEntities(self):
+        '''Test that include_entities is sent with every users/lookup chunk'''
+        api = self._newAuthenticatedApi()
+        api.USERS_LOOKUP_CHUNK_SIZE = 2
+        api.usersLookup(user_id=[1, 2, 3], include_entities=True)
+        queries = self._getQueries()
+        self.assertEqual(2, len(queries))
+        for query in queries:
+            self.assertEqual(['1'], query['include_entities'])
+
+    def testIncludeEntitiesCachedApart(self):
+        '''Test that users cached without entities are not returned with them'''
+        api = self._newAuthenticatedApi(cache=twitter.LRUCache())
+        api.usersLookup(user_id=[1])
+        api.usersLookup(user_id=[1], include_entities=True)
+        api.usersLookup(user_id=[1], include_entities=True)
+        self.assertEqual(2, len(self._getPaths()))
+
+
+class RateLimiterTest(_ApiTestCase):
+
+    def _respondWithLimit(self, remaining, reset_in=3600):
+        headers = {'X-RateLimit-Limit': '150', 'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(int(time.time() + reset_in))}
+        self._respondWith(_statusDict(1), headers)
+
+    def testFullBudgetDoesNotWait(self):
+        '''Test that a fresh Api sends a burst of requests without sleeping'''
+        self._respondWithLimit(150)
+        api = self._newApi(rate_limiter=twitter.DEFAULT_RATE_LIMITER)
+        started = time.time()
+        for i in xrange(10):
+            api.getStatus(1)
+        self.assertTrue(time.time() - started < 2)
+        self.assertTrue(api.getSchedulerMetrics()['normal']['max_wait'] < 0.1)
+
+    def testUnmeteredUntilUpdated(self):
+        '''Test that requests go straight through before Twitter reports a limit'''
+        limiter = twitter.RateLimiter(burst=1, max_wait=0)
+        for i in xrange(10):
+            limiter.acquire()
+        self.assertEqual(10, limiter.getMetrics()['normal']['requests'])
+
+    def testBurst(self):
+        '''Test that an explicit burst meters requests past it'''
+        limiter = twitter.RateLimiter(burst=2, max_wait=0.5)
+        limiter.update(150, 150, time.time() + 3600)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertRaises(twitter.TwitterError, limiter.acquire)
+
+    def testDefaultBurst(self):
+        '''Test that the default burst is a share of the hourly limit'''
+        limiter = twitter.RateLimiter(max_wait=0.5)
+        limiter.update(150, 150, time.time() + 3600)
+        for i in xrange(int(150 * twitter.RateLimiter.DEFAULT_BURST_SHARE)):
+            limiter.acquire()
+        self.assertRaises(twitter.TwitterError, limiter.acquire)
+
+    def testBurstRefills(self):
+        '''Test that the bucket refills at the rate left until the reset'''
+        limiter = twitter.RateLimiter(burst=1)
+        limiter.update(150, 100, time.time() + 10)
+        limiter.acquire()
+        started = time.time()
+        limiter.acquire()
+        self.assertTrue(0.02 < time.time() - started < 1)
+
+    def testExhausted(self):
+        '''Test that no requests go once the remaining hits are spent'''
+        limiter = twitter.RateLimiter(max_wait=0.5)
+        limiter.update(150, 1, time.time() + 3600)
+        limiter.acquire(twitter.PRIORITY_INTERACTIVE)
+        self.assertRaises(twitter.TwitterError, limiter.acquire, twitter.PRIORITY_INTERACTIVE)
+
+    def testReset(self):
+        '''Test that requests are unmetered once the reset time passes'''
+        limiter = twitter.RateLimiter(max_wait=0)
+        limiter.update(150, 0, time.time() - 1)
+        limiter.acquire()
+
+    def testPostNotMetered(self):
+        '''Test that POST requests do not wait for the limiter'''
+        self._respondWithLimit(0)
+        limiter = twitter.RateLimiter(max_wait=0)
+        api = self._newAuthenticatedApi(rate_limiter=limiter)
+        api.getStatus(1)
+        self.assertRaises(twitter.TwitterError, api.getStatus, 1)
+        api.postUpdate('hello')
+        self.assertEqual(['GET', 'POST'], [request[0] for request in self._server.requests])
+
+
+class MaximumHitFrequencyTest(_ApiTestCase):
+
+    def _respondWithStatus(self, remaining, reset_in):
+        self._respondWith({'hourly_limit': 150, 'remaining_hits': remaining,
+            'reset_time_in_seconds': int(time.time() + reset_in)})
+
+    def testFromState(self):
+        '''Test that a current rate limit state needs no request'''
+        api = self._newAuthenticatedApi()
+        api.getRateLimitState().update(150, 100, time.time() + 1025)
+        self.assertEqual(11, api.maximumHitFrequency())
+        self.assertEqual([], self._getPaths())
+
+    def testPollsWhenUnknown(self):
+        '''Test that the status is fetched when nothing has been reported'''
+        self._respondWithStatus(100, 1025)
+        api = self._newAuthenticatedApi()
+        self.assertEqual(11, api.maximumHitFrequency())
+        self.assertEqual(1, len(self._getPaths()))
+
+    def testPollsAfterReset(self):
+        '''Test that the status is fetched again once the reset time passes'''
+        self._respondWithStatus(50, 1025)
+        api = self._newAuthenticatedApi()
+        api.getRateLimitState().update(150, 0, time.time() - 10)
+        self.assertEqual(21, api.maximumHitFrequency())
+        self.assertEqual(1, len(self._getPaths()))
+
+    def testAssumesFullWindow(self):
+        '''Test that a stale reported reset time is taken as a fresh period'''
+        self._respondWithStatus(0, -10)
+        api = self._newAuthenticatedApi()
+        self.assertTrue(api.maximumHitFrequency() in (24, 25))
+
+
+class ApiPoolTest(_ApiTestCase):
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._respondWith(_statusDict(1))
+        self._first = self._newAuthenticatedApi(access_token_key='first')
+        self._second = self._newAuthenticatedApi(access_token_key='second')
+        self._pool = twitter.ApiPool([self._first, self._second])
+
+    def _getTokens(self):
+        tokens = []
+        for method, path, headers, body, client_address in self._server.requests:
+            if method == 'POST':
+                query = urlparse.parse_qs(body)
+            else:
+                query = urlparse.parse_qs(urlparse.urlparse(path).query)
+            tokens.append(query['oauth_token'][0])
+        return tokens
+
+    def testNeedsApis(self):
+        '''Test that an empty pool is refused'''
+        self.assertRaises(twitter.TwitterError, twitter.ApiPool, [])
+
+    def testReadsUseMostBudget(self):
+        '''Test that reads go through the account with the most hits left'''
+        reset_time = time.time() + 3600
+        self._first.getRateLimitState().update(150, 10, reset_time)
+        self._second.getRateLimitState().update(150, 90, reset_time)
+        self._pool.getStatus(1)
+        self._first.getRateLimitState().update(150, 100, reset_time)
+        self._pool.getStatus(1)
+        self.assertEqual(['second', 'first'], self._getTokens())
+
+    def testResetAccountHasFullBudget(self):
+        '''Test that an account whose limit has reset is preferred'''
+        self._first.getRateLimitState().update(150, 100, time.time() + 3600)
+        self._second.getRateLimitState().update(150, 0, time.time() - 1)
+        self._pool.getStatus(1)
+        self.assertEqual(['second'], self._getTokens())
+
+    def testWritesUsePrimary(self):
+        '''Test that POST requests always go through the primary account'''
+        reset_time = time.time() + 3600
+        self._first.getRateLimitState().update(150, 0, reset_time)
+        self._second.getRateLimitState().update(150, 150, reset_time)
+        self._pool.postUpdate('hello')
+        self.assertEqual(['first'], self._getTokens())
+
+    def testAccountSpecificUsesPrimary(self):
+        '''Test that account specific reads go through the primary account'''
+        reset_time = time.time() + 3600
+        self._first.getRateLimitState().update(150, 0, reset_time)
+        self._second.getRateLimitState().update(150, 150, reset_time)
+        self._respondWith([_statusDict(1)])
+        self._pool.getMentions()
+        self.assertEqual(['first'], self._getTokens())
+
+    def testRetweetsUsePrimary(self):
+        '''Test that getRetweets goes through the primary account'''
+        reset_time = time.time() + 3600
+        self._first.getRateLimitState().update(150, 0, reset_time)
+        self._second.getRateLimitState().update(150, 150, reset_time)
+        self._respondWith([_statusDict(1)])
+        self._pool.getRetweets(1)
+        self.assertEqual(['first'], self._getTokens())
+
+    def testUnauthorizedReadRetriedThroughPrimary(self):
+        '''Test that a read refused to another account is made by the primary'''
+        reset_time = time.time() + 3600
+        self._first.getRateLimitState().update(150, 0, reset_time)
+        self._second.getRateLimitState().update(150, 150, reset_time)
+        def respond(handler):
+            query = urlparse.parse_qs(urlparse.urlparse(handler.path).query)
+            if query['oauth_token'][0] == 'second':
+                return 401, {}, simplejson.dumps({'error': 'Not authorized'})
+            return 200, {}, simplejson.dumps([_statusDict(1)])
+        self._respond = respond
+        self.assertEqual(1, self._pool.getUserTimeline('protected')[0].id)
+        self.assertEqual(['second', 'first'], self._getTokens())
+
+    def testAccountSpecificEntriesKeyedByAccount(self):
+        '''Test that accounts sharing a cache do not share their own reads'''
+        cache = twitter.LRUCache()
+        first = self._newAuthenticatedApi(access_token_key='first', cache=cache)
+        second = self._newAuthenticatedApi(access_token_key='second', cache=cache)
+        self._respondWith([_statusDict(1)])
+        first.getMentions()
+        second.getMentions()
+        first.getMentions()
+        first.getUserTimeline('bob')
+        second.getUserTimeline('bob')
+        self.assertEqual(['first', 'second', 'first'], self._getTokens())
+
+    def testInFlightSpreadsLoad(self):
+        '''Test that concurrent reads are spread over the accounts'''
+        first = self._pool._acquireApi(False)
+        second = self._pool._acquireApi(False)
+        self.assertNotEqual(first, second)
+        self._pool._releaseApi(first)
+        self._pool._releaseApi(second)
+
+    def testCombinedRateLimitState(self):
+        '''Test that the pool reports the sum of its accounts' budgets'''
+        self.assertEqual(None, self._pool.getRateLimitState().reset_time)
+        self._first.getRateLimitState().update(150, 10, 1000)
+        self._second.getRateLimitState().update(150, 90, 2000)
+        state = self._pool.getRateLimitState()
+        self.assertEqual((300, 100, 2000), state.get())
+
+
+class PriorityTest(_PagingTestCase):
+
+    def testBulkKeepsReserve(self):
+        '''Test that bulk requests leave the reserve to the other classes'''
+        limiter = twitter.RateLimiter(burst=21, max_wait=0.2)
+        limiter.update(100, 21, time.time() + 3600)
+        limiter.acquire(twitter.PRIORITY_BULK)
+        self.assertRaises(twitter.TwitterError, limiter.acquire, twitter.PRIORITY_BULK)
+        for i in xrange(15):
+            limiter.acquire(twitter.PRIORITY_NORMAL)
+        self.assertRaises(twitter.TwitterError, limiter.acquire, twitter.PRIORITY_NORMAL)
+        for i in xrange(5):
+            limiter.acquire(twitter.PRIORITY_INTERACTIVE)
+        self.assertRaises(twitter.TwitterError, limiter.acquire, twitter.PRIORITY_INTERACTIVE)
+
+    def testUrgentFirst(self):
+        '''Test that waiting requests are let through in priority order'''
+        limiter = twitter.RateLimiter(burst=1)
+        limiter.update(100, 100, time.time() + 20)
+        limiter.acquire()
+        order = []
+        def acquire(priority):
+            limiter.acquire(priority)
+            order.append(priority)
+        threads = []
+        for priority in (twitter.PRIORITY_BULK, twitter.PRIORITY_NORMAL,
+                twitter.PRIORITY_INTERACTIVE):
+            thread = threading.Thread(target=acquire, args=(priority,))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.05)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual([twitter.PRIORITY_INTERACTIVE, twitter.PRIORITY_NORMAL,
+            twitter.PRIORITY_BULK], order)
+
+    def testMetrics(self):
+        '''Test that each class counts its own requests'''
+        limiter = twitter.RateLimiter()
+        limiter.acquire(twitter.PRIORITY_BULK)
+        limiter.acquire(twitter.PRIORITY_BULK)
+        limiter.acquire()
+        metrics = limiter.getMetrics()
+        self.assertEqual(2, metrics['bulk']['requests'])
+        self.assertEqual(1, metrics['normal']['requests'])
+        self.assertEqual(0, metrics['interactive']['requests'])
+        self.assertEqual(0, metrics['bulk']['queued'])
+
+    def testInteractiveReads(self):
+        '''Test that reads a user waits on request at PRIORITY_INTERACTIVE'''
+        limiter = twitter.RateLimiter()
+        api = self._newAuthenticatedApi(rate_limiter=limiter)
+        self._respondWith([])
+        api.getMentions()
+        api.getDirectMessages()
+        api.getReplies()
+        api.getHomeTimeline()
+        metrics = limiter.getMetrics()
+        self.assertEqual(4, metrics['interactive']['requests'])
+        self.assertEqual(0, metrics['normal']['requests'])
+
+    def testRateLimitStatusNotMetered(self):
+        '''Test that getRateLimitStatus goes through with no budget left'''
+        limiter = twitter.RateLimiter()
+        limiter.update(150, 0, time.time() + 3600)
+        api = self._newAuthenticatedApi(rate_limiter=limiter)
+        self._respondWith({'hourly_limit': 150, 'remaining_hits': 0,
+            'reset_time_in_seconds': int(time.time() + 3600)})
+        self.assertEqual(0, api.getRateLimitStatus()['remaining_hits'])
+
+    def testNormalRequestsDoNotWaitForReset(self):
+        '''Test that by default a normal request raises rather than wait an hour'''
+        limiter = twitter.RateLimiter()
+        limiter.update(150, 0, time.time() + 3600)
+        started = time.time()
+        self.assertRaises(twitter.TwitterError, limiter.acquire)
+        self.assertTrue(time.time() - started < 1)
+
+    def testIteratorsAreBulk(self):
+        '''Test that cursor iterators request at PRIORITY_BULK by default'''
+        limiter = twitter.RateLimiter()
+        api = self._newAuthenticatedApi(rate_limiter=limiter)
+        list(api.iterFollowerIDs())
+        api.getFollowerIDs()
+        list(api.iterFollowerIDs(priority=twitter.PRIORITY_INTERACTIVE))
+        metrics = limiter.getMetrics()
+        self.assertEqual(3, metrics['bulk']['requests'])
+        self.assertEqual(1, metrics['normal']['requests'])
+        self.assertEqual(3, metrics['interactive']['requests'])
+
+
+class ThreadPoolTest(unittest.TestCase):
+
+    def _runConcurrently(self, pool, count):
+        '''Submit count calls that block until all of them are running.'''
+        lock = threading.Lock()
+        running = [0]
+        release = threading.Event()
+        def call(i):
+            lock.acquire()
+            running[0] += 1
+            lock.release()
+            release.wait(5)
+            return i
+        futures = [pool.submit(call, i) for i in xrange(count)]
+        started = time.time()
+        while running[0] < count and time.time() - started < 2:
+            time.sleep(0.01)
+        seen = running[0]
+        release.set()
+        self.assertEqual(range(count), [future.get(5) for future in futures])
+        return seen
+
+    def testRunsConcurrently(self):
+        '''Test that a burst runs on as many workers as it needs'''
+        pool = twitter._ThreadPool(8)
+        self.assertEqual(8, self._runConcurrently(pool, 8))
+
+    def testBurstAfterWarmUp(self):
+        '''Test that a burst after earlier calls still starts new workers'''
+        pool = twitter._ThreadPool(8)
+        pool.submit(lambda: None).get(5)
+        pool.submit(lambda: None).get(5)
+        self.assertEqual(8, self._runConcurrently(pool, 8))
+        self.assertEqual(8, self._runConcurrently(pool, 8))
+
+    def testBounded(self):
+        '''Test that no more than max_workers calls run at once'''
+        pool = twitter._ThreadPool(3)
+        self.assertEqual(3, self._runConcurrently(pool, 6))
+        self.assertTrue(pool._workers <= 3)
+
+    def testShutdownCancel(self):
+        '''Test that a cancelled shutdown drops the queued calls'''
+        pool = twitter._ThreadPool(1)
+        release = threading.Event()
+        first = pool.submit(release.wait, 5)
+        second = pool.submit(lambda: 1)
+        time.sleep(0.05)
+        pool.shutdown(cancel=True)
+        release.set()
+        first.get(5)
+        time.sleep(0.05)
+        self.assertFalse(second.isDone())
+
+
+class ThreadedApiTest(_ApiTestCase):
+
+    def testReturnsFutures(self):
+        '''Test that calls return Futures of the blocking results'''
+        self._respondWith(_statusDict(4))
+        api = twitter.ThreadedApi(self._newApi(), max_workers=4)
+        futures = [api.getStatus(4) for i in xrange(6)]
+        self.assertTrue(isinstance(futures[0], twitter.Future))
+        self.assertEqual([4] * 6, [future.get(5).id for future in futures])
+
+    def testErrors(self):
+        '''Test that errors are raised from Future.get'''
+        self._respondWith({'error': 'Not found'})
+        api = twitter.ThreadedApi(self._newApi())
+        future = api.getStatus(4)
+        self.assertRaises(twitter.TwitterError, future.get, 5)
+
+    def testLocalMethods(self):
+        '''Test that local accessors are called directly'''
+        blocking = self._newApi()
+        api = twitter.ThreadedApi(blocking)
+        self.assertTrue(api.getApi() is blocking)
+        self.assertTrue(isinstance(api.getRateLimitState(), twitter.RateLimitState))
+        api.setCacheTimeout(7)
+        self.assertEqual(7, blocking._cache_timeout)
+
+
+class _BrokenConnectionPool(twitter.ConnectionPool):
+    '''Hands out connections whose requests raise error.'''
+
+    def __init__(self, error, **kw):
+        twitter.ConnectionPool.__init__(self, **kw)
+        self.error = error
+
+    def acquire(self, scheme, host):
+        connection, reused = twitter.ConnectionPool.acquire(self, scheme, host)
+        connection.request = self._fail
+        return connection, reused
+
+    def _fail(self, *args):
+        raise self.error
+
+
+class MaxActiveTest(unittest.TestCase):
+
+    def testWaitsForRelease(self):
+        '''Test that acquire() waits once max_active connections are out'''
+        pool = twitter.ConnectionPool(max_active=1)
+        connection, reused = pool.acquire('http', 'example.com')
+        acquired = threading.Event()
+        def acquire():
+            pool.acquire('http', 'example.com')
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.setDaemon(True)
+        thread.start()
+        acquired.wait(0.2)
+        self.assertFalse(acquired.isSet())
+        pool.release('http', 'example.com', connection)
+        acquired.wait(5)
+        self.assertTrue(acquired.isSet())
+
+    def testOtherHostsUnaffected(self):
+        '''Test that max_active applies to each host separately'''
+        pool = twitter.ConnectionPool(max_active=1)
+        pool.acquire('http', 'example.com')
+        pool.acquire('http', 'example.org')
+        pool.acquire('https', 'example.com')
+
+    def _open(self, pool):
+        opener = urllib2.build_opener(twitter._KeepAliveHTTPHandler(pool))
+        return opener.open('http://127.0.0.1:1/')
+
+    def testSlotReleasedOnSocketError(self):
+        '''Test that a failed request hands back its slot'''
+        pool = _BrokenConnectionPool(socket.error(111, 'Connection refused'), max_active=1)
+        self.assertRaises(urllib2.URLError, self._open, pool)
+        self.assertEqual(0, pool._active[('http', '127.0.0.1:1')])
+
+    def testSlotReleasedOnOtherError(self):
+        '''Test that a request failing with any exception hands back its slot'''
+        pool = _BrokenConnectionPool(ValueError('bad header'), max_active=1)
+        self.assertRaises(ValueError, self._open, pool)
+        self.assertRaises(ValueError, self._open, pool)
+        self.assertEqual(0, pool._active[('http', '127.0.0.1:1')])
+
+
+class FetchManyTest(_ApiTestCase):
+
+    def setUp(self):
+        _ApiTestCase.setUp(self)
+        self._respond = self._respondWithStatus
+
+    def _respondWithStatus(self, handler):
+        id = int(urlparse.urlparse(handler.path).path.split('/')[-1].split('.')[0])
+        if id == 3:
+            return 200, {}, simplejson.dumps({'error': 'Not found'})
+        time.sleep(0.01 * (5 - id))
+        return 200, {}, simplejson.dumps(_statusDict(id))
+
+    def testOrdered(self):
+        '''Test that results follow the order of the calls'''
+        api = self._newApi()
+        results = list(api.fetchMany([1, 2, 4, 5], method='getStatus'))
+        self.assertEqual([1, 2, 4, 5], [call for call, result, error in results])
+        self.assertEqual([1, 2, 4, 5], [result.id for call, result, error in results])
+
+    def testErrors(self):
+        '''Test that a failed call yields its error instead of raising'''
+        api = self._newApi()
+        results = list(api.fetchMany([2, 3], method='getStatus'))
+        self.assertEqual(2, results[0][1].id)
+        self.assertEqual(None, results[1][1])
+        self.assertTrue(isinstance(results[1][2], twitter.TwitterError))
+
+    def testNamedCalls(self):
+        '''Test calls given as (method name, keyword arguments) pairs'''
+        api = self._newApi()
+        results = list(api.fetchMany([('getStatus', {'id': 4}), 5], method='getStatus'))
+        self.assertEqual([4, 5], [result.id for call, result, error in results])
+
+    def testUnordered(self):
+        '''Test that ordered=False yields every call as it completes'''
+        api = self._newApi()
+        results = list(api.fetchMany([1, 2, 4, 5], method='getStatus', ordered=False))
+        self.assertEqual([1, 2, 4, 5], sorted([result.id for call, result, error in results]))
+
+
+class _RecordingDecodePool(twitter.DecodePool):
+    '''A DecodePool that records the model and items_key of each call.'''
+
+    def __init__(self, **kw):
+        twitter.DecodePool.__init__(self, **kw)
+        self.calls = []
+
+    def decode(self, data, model=None, items_key=None, lazy=False):
+        self.calls.append((model, items_key))
+        return twitter.DecodePool.decode(self, data, model, items_key, lazy)
+
+
+class DecodePoolTest(_PagingTestCase):
+
+    def testDecodesInWorker(self):
+        '''Test that large bodies are decoded and built in a worker process'''
+        pool = twitter.DecodePool(processes=1, min_size=0)
+        try:
+            data = simplejson.dumps({'users': [{'id': 1}, {'id': 2}]})
+            result = pool.decode(data, twitter.User, 'users')
+            self.assertEqual([1, 2], [u.id for u in result['users']])
+            self.assertTrue(isinstance(result['users'][0], twitter.User))
+            self.assertTrue(pool._pool is not None)
+        finally:
+            pool.close()
+
+    def testSmallBodiesInPlace(self):
+        '''Test that bodies under min_size never start the workers'''
+        pool = twitter.DecodePool(min_size=1024)
+        self.assertEqual([{'id': 1}], pool.decode('[{"id": 1}]'))
+        self.assertEqual(None, pool._pool)
+
+    def testPagesBuiltInPool(self):
+        '''Test that single pages build their models in the decode pool'''
+        pool = _RecordingDecodePool()
+        api = self._newAuthenticatedApi(decode_pool=pool)
+        friends = api.getFriends('bob')
+        followers = api.getFollowers()
+        self.assertEqual([1, 2], [u.id for u in friends])
+        self.assertEqual(5, followers.next_cursor)
+        self.assertTrue(isinstance(followers[0], twitter.User))
+        self.assertEqual([(twitter.User, 'users')] * 2, pool.calls)
+
+    def testIteratorsBuildInPool(self):
+        '''Test that iterators build their models in the decode pool'''
+        pool = _RecordingDecodePool()
+        api = self._newAuthenticatedApi(decode_pool=pool)
+        users = list(api.iterFriends('bob', read_ahead=2))
+        self.assertEqual([1, 2, 3, 4, 5], [u.id for u in users])
+        self.assertTrue(isinstance(users[0], twitter.User))
+        self.assertEqual([(twitter.User, 'users')] * 3, pool.calls)
+
+    def testIteratorsKeepingItemsFetchJson(self):
+        '''Test that pages a checkpoint keeps are fetched as decoded JSON'''
+        pool = _RecordingDecodePool()
+        api = self._newAuthenticatedApi(decode_pool=pool)
+        checkpoint = twitter.PagingCheckpoint('crawl', twitter.LRUCache(), keep_items=True)
+        users = list(api.iterFriends('bob', checkpoint=checkpoint))
+        self.assertTrue(isinstance(users[0], twitter.User))
+        self.assertEqual([(None, 'users')] * 3, pool.calls)
+
+    def testListPagesBuiltInPool(self):
+        '''Test that list pages build their models in the decode pool'''
+        self._respondWith({'lists': [{'id': 1, 'name': 'one'}],
+            'next_cursor': 0, 'previous_cursor': 0})
+        pool = _RecordingDecodePool()
+        api = self._newAuthenticatedApi(decode_pool=pool)
+        lists = api.getLists('bob')
+        subscriptions = api.getSubscriptions('bob')
+        self.assertEqual('one', lists[0].name)
+        self.assertTrue(isinstance(subscriptions[0], twitter.List))
+        self.assertEqual([(twitter.List, 'lists')] * 2, pool.calls)
+
+    def testSearchInWorker(self):
+        '''Test that search results are built in a worker process'''
+        results = [_statusDict(1, from_user='alice', profile_image_url='http://a/alice')]
+        self._respondWith({'results': results})
+        pool = twitter.DecodePool(processes=1, min_size=0)
+        api = self._newApi(decode_pool=pool)
+        fetchJson = api._fetchJson
+        api._fetchJson = lambda url, **kw: fetchJson(self._server.getBaseUrl() + '/search.json', **kw)
+        try:
+            statuses = api.getSearch('term')
+        finally:
+            pool.close()
+        self.assertEqual(1, statuses[0].id)
+        self.assertEqual('alice', statuses[0].user.screen_name)
+        self.assertEqual('http://a/alice', statuses[0].user.profile_image_url)
+
+
+class PickleTest(unittest.TestCase):
+
+    # A User pickled with protocol 0 before the models had __slots__.
+    UNSLOTTED_USER_PICKLE = (
+        "ccopy_reg\n_reconstructor\np0\n(ctwitter\nUser\np1\n"
+        "c__builtin__\nobject\np2\nNtp3\nRp4\n(dp5\nS'_location'\n"
+        "p6\nNsS'_description'\np7\nNsS'_time_zone'\np8\n"
+        "NsS'_followers_count'\np9\nNsS'_statuses_count'\np10\n"
+        "NsS'_profile_text_color'\np11\nNsS'_profile_image_url'\n"
+        "p12\nNsS'_favourites_count'\np13\nNsS'_utc_offset'\np14\n"
+        "NsS'_status'\np15\nNsS'_protected'\np16\n"
+        "NsS'friends_count'\np17\nNsS'_profile_background_tile'\n"
+        "p18\nNsS'_profile_link_color'\np19\nNsS'_geo_enabled'\np20\n"
+        "NsS'_profile_background_image_url'\np21\nNsS'_screen_name'\n"
+        "p22\nS'bob'\np23\nsS'_name'\np24\n"
+        "NsS'_profile_sidebar_fill_color'\np25\nNsS'_url'\np26\n"
+        "NsS'_id'\np27\nI1\nsS'_profile_background_color'\np28\nNsb.")
+
+    def _newStatus(self, lazy=False):
+        data = _statusDict(1, retweeted_status=_statusDict(2, screen_name='carol'),
+            entities={'hashtags': [{'text': 'tag'}], 'urls': [], 'user_mentions': []})
+        return twitter.Status.newFromJsonDict(data, lazy=lazy)
+
+    def testModelsHaveNoDict(self):
+        '''Test that Status and User keep their attributes in slots'''
+        status = self._newStatus()
+        self.assertFalse(hasattr(status, '__dict__'))
+        self.assertFalse(hasattr(status.user, '__dict__'))
+
+    def testRoundTrip(self):
+        '''Test that Status and User survive pickling with protocols 0 to 2'''
+        status = self._newStatus()
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(status, protocol))
+            self.assertEqual(status, copy)
+            self.assertEqual('bob', copy.user.screen_name)
+            self.assertEqual('carol', copy.retweeted_status.user.screen_name)
+            self.assertEqual(['tag'], [h.text for h in copy.hashtags])
+            user = pickle.loads(pickle.dumps(status.user, protocol))
+            self.assertEqual(status.user, user)
+
+    def testLazyRoundTrip(self):
+        '''Test that a lazy Status pickles with every nested model built'''
+        for protocol in (0, 1, 2):
+            copy = pickle.loads(pickle.dumps(self._newStatus(lazy=True), protocol))
+            self.assertEqual(self._newStatus(), copy)
+            self.assertEqual('carol', copy.retweeted_status.user.screen_name)
+
+    def testUnslottedPickle(self):
+        '''Test that pickles made before the models had slots still load'''
+        user = pickle.loads(self.UNSLOTTED_USER_PICKLE)
+        self.assertEqual((1, 'bob'), (user.id, user.screen_name))
+        self.assertEqual(None, user.name)
+
+
+class LazyModelTest(_ApiTestCase):
+
+    def _statusData(self, id):
+        return _statusDict(id, retweeted_status=_statusDict(id + 100, screen_name='carol'),
+            entities={'hashtags': [{'text': 'tag'}]})
+
+    def testNestedModelsBuiltOnAccess(self):
+        '''Test that a lazy Status builds its user and retweet when first read'''
+        status = twitter.Status.newFromJsonDict(self._statusData(1), lazy=True)
+        self.assertEqual(None, status._user)
+        self.assertEqual(None, status._retweeted_status)
+        self.assertEqual('bob', status.user.screen_name)
+        self.assertTrue(isinstance(status._user, twitter.User))
+        self.assertEqual(None, status._retweeted_status)
+        self.assertEqual('carol', status.retweeted_status.user.screen_name)
+        self.assertEqual(['tag'], [h.text for h in status.hashtags])
+        self.assertFalse(status._pending)
+
+    def testEqualToEager(self):
+        '''Test that lazy and eager instances compare equal'''
+        data = self._statusData(1)
+        lazy = twitter.Status.newFromJsonDict(data, lazy=True)
+        self.assertEqual(twitter.Status.newFromJsonDict(data), lazy)
+        self.assertEqual(twitter.Status.newFromJsonDict(data).asDict(), lazy.asDict())
+
+    def testSetterDiscardsPending(self):
+        '''Test that assigning a nested model drops its raw JSON'''
+        status = twitter.Status.newFromJsonDict(self._statusData(1), lazy=True)
+        status.user = twitter.User(screen_name='dave')
+        self.assertEqual('dave', status.user.screen_name)
+        self.assertFalse('user' in status._pending)
+
+    def testLazyTimeline(self):
+        '''Test that an Api set to build lazy models returns lazy statuses'''
+        self._respondWith([self._statusData(1), self._statusData(2)])
+        api = self._newApi(lazy_models=True)
+        statuses = api.getUserTimeline('bob')
+        self.assertEqual(None, statuses[0]._user)
+        self.assertEqual('bob', statuses[1].user.screen_name)
+
+    def _search(self, api):
+        results = [dict(self._statusData(1), from_user='alice',
+            profile_image_url='http://a/alice')]
+        self._respondWith({'results': results})
+        fetchJson = api._fetchJson
+        api._fetchJson = lambda url, **kw: fetchJson(self._server.getBaseUrl() + '/search.json', **kw)
+        return api.getSearch('term')
+
+    def testLazySearch(self):
+        '''Test that getSearch builds lazy statuses when the Api is set to'''
+        statuses = self._search(self._newApi(lazy_models=True))
+        self.assertEqual('alice', statuses[0].user.screen_name)
+        self.assertEqual(None, statuses[0]._retweeted_status)
+        self.assertEqual('carol', statuses[0].retweeted_status.user.screen_name)
+
+    def testEagerSearch(self):
+        '''Test that getSearch builds everything at once by default'''
+        statuses = self._search(self._newApi())
+        self.assertEqual(None, statuses[0]._pending)
+        self.assertEqual('carol', statuses[0]._retweeted_status.user.screen_name)
+
+
+class OpenResponseTest(_ApiTestCase):
+
+    def _openQuietly(self, api, url):
+        '''Call api._openResponse(url), returning its result and anything printed.'''
+        stdout = sys.stdout
+        sys.stdout = output = StringIO.StringIO()
+        try:
+            try:
+                return api._openResponse(url), output.getvalue()
+            except IOError, e:
+                return e, output.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def testHttpErrorSentOnce(self):
+        '''Test that an HTTP error response is returned after one request'''
+        headers = {'X-RateLimit-Limit': '150', 'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time() + 60))}
+        self._respond = lambda handler: (404, headers, simplejson.dumps({'error': 'Not found'}))
+        api = self._newApi()
+        result, output = self._openQuietly(api, self._server.getBaseUrl() + '/a')
+        self.assertEqual(404, result[0])
+        self.assertEqual('', output)
+        self.assertEqual(1, len(self._server.requests))
+        self.assertEqual((150, 0), api.getRateLimitState().get()[:2])
+
+    def testTransportErrorRaised(self):
+        '''Test that a transport error is raised at once, silently'''
+        api = self._newApi()
+        result, output = self._openQuietly(api, 'http://127.0.0.1:1/a')
+        self.assertTrue(isinstance(result, urllib2.URLError))
+        self.assertEqual('', output)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTests(unittest.makeSuite(ConnectionPoolTest))
+    suite.addTests(unittest.makeSuite(FetchJsonTest))
+    suite.addTests(unittest.makeSuite(LRUCacheTest))
+    suite.addTests(unittest.makeSuite(CacheKeyTest))
+    suite.addTests(unittest.makeSuite(ApiCacheTest))
+    suite.addTests(unittest.makeSuite(SqliteCacheTest))
+    suite.addTests(unittest.makeSuite(BoundedCacheTest))
+    suite.addTests(unittest.makeSuite(CompressedCacheTest))
+    suite.addTests(unittest.makeSuite(SingleFlightTest))
+    suite.addTests(unittest.makeSuite(StaleWhileRevalidateTest))
+    suite.addTests(unittest.makeSuite(ConditionalGetTest))
+    suite.addTests(unittest.makeSuite(CursorIteratorTest))
+    suite.addTests(unittest.makeSuite(PageTest))
+    suite.addTests(unittest.makeSuite(PrefetchTest))
+    suite.addTests(unittest.makeSuite(PagingCheckpointTest))
+    suite.addTests(unittest.makeSuite(UsersLookupTest))
+    suite.addTests(unittest.makeSuite(SearchUsersTest))
+    suite.addTests(unittest.makeSuite(RateLimiterTest))
+    suite.addTests(unittest.makeSuite(MaximumHitFrequencyTest))
+    suite.addTests(unittest.makeSuite(ApiPoolTest))
+    suite.addTests(unittest.makeSuite(PriorityTest))
+    suite.addTests(unittest.makeSuite(ThreadPoolTest))
+    suite.addTests(unittest.makeSuite(ThreadedApiTest))
+    suite.addTests(unittest.makeSuite(MaxActiveTest))
+    suite.addTests(unittest.makeSuite(FetchManyTest))
+    suite.addTests(unittest.makeSuite(DecodePoolTest))
+    suite.addTests(unittest.makeSuite(PickleTest))
+    suite.addTests(unittest.makeSuite(LazyModelTest))
+    suite.addTests(unittest.makeSuite(OpenResponseTest))
+    return suite
+
+
+if __name__ == '__main__':
+    unittest.main()